@@ -0,0 +1,147 @@
+"""Rows/sec of the vectorized dataset loader against the previous iterrows/ORM path.
+
+Usage (from smart-energy-backend/):
+
+  python -m benchmarks.bench_dataset_loader --sizes 1000 100000 1000000
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import pandas as pd
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from database.csv_to_db import _get_dataset_path, map_csv_headers
+from database.dataset_loader import load_dataset
+from database.db import Base
+from database.models import EnergyRecord
+
+
+def _to_float(value) -> Optional[float]:
+  if pd.isna(value):
+    return None
+  try:
+    return float(value)
+  except (TypeError, ValueError):
+    return None
+
+
+def legacy_load(session, dataset_path: str) -> int:
+  """The pre-vectorization loader: one ORM object per `df.iterrows()` row."""
+  df = pd.read_csv(dataset_path)
+  df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce')
+
+  records = []
+  for _, row in df.iterrows():
+    records.append(
+      EnergyRecord(
+        machine_id=str(row.get('machine_id')) if not pd.isna(row.get('machine_id')) else None,
+        machine_model=str(row.get('machine_model')) if not pd.isna(row.get('machine_model')) else None,
+        rated_capacity_kw=_to_float(row.get('rated_capacity_kw')),
+        contract_demand_kw=_to_float(row.get('contract_demand_kw')),
+        timestamp=row.get('timestamp'),
+        shift=str(row.get('shift')) if not pd.isna(row.get('shift')) else None,
+        operator_id=str(row.get('operator_id')) if not pd.isna(row.get('operator_id')) else None,
+        power_kw=_to_float(row.get('power_kw')),
+        energy_kwh=_to_float(row.get('energy_kwh')),
+        load_percent=_to_float(row.get('load_percent')),
+        power_factor=_to_float(row.get('power_factor')),
+        temperature=_to_float(row.get('temperature')),
+        ambient_temperature=_to_float(row.get('ambient_temperature')),
+        production_output=_to_float(row.get('production_output')),
+        operating_status=str(row.get('operating_status'))
+        if not pd.isna(row.get('operating_status'))
+        else None,
+        idle_flag=bool(row.get('idle_flag')) if not pd.isna(row.get('idle_flag')) else None,
+        electricity_tariff=_to_float(row.get('electricity_tariff')),
+        maintenance_cost=_to_float(row.get('maintenance_cost')),
+        co2_emission=_to_float(row.get('co2_emission')),
+        true_anomaly_label=int(row.get('true_anomaly_label'))
+        if not pd.isna(row.get('true_anomaly_label'))
+        else None,
+        downtime_minutes=_to_float(row.get('downtime_minutes')),
+      ),
+    )
+  session.bulk_save_objects(records)
+  session.commit()
+  return len(records)
+
+
+def write_dataset(path: str, rows: int) -> None:
+  """Write `rows` readings by tiling the bundled dataset, one week later per copy."""
+  base = pd.read_csv(_get_dataset_path())
+  base = base.rename(columns=map_csv_headers(list(base.columns)))
+  base['timestamp'] = pd.to_datetime(base['timestamp'])
+
+  copies = -(-rows // len(base))
+  df = pd.concat([base] * copies, ignore_index=True).iloc[:rows]
+  df['timestamp'] = df['timestamp'] + pd.to_timedelta((df.index // len(base)) * 7, unit='D')
+  df.to_csv(path, index=False)
+
+
+def _fresh_engine(path: str):
+  """Bare energy_records table for the legacy ORM path."""
+  engine = create_engine(f'sqlite:///{path}')
+  Base.metadata.create_all(bind=engine, tables=[EnergyRecord.__table__])
+  return engine
+
+
+def run(sizes: List[int], skip_legacy: bool = False) -> List[Dict]:
+  results = []
+  with tempfile.TemporaryDirectory() as tmp:
+    for size in sizes:
+      csv_path = os.path.join(tmp, f'energy_{size}.csv')
+      write_dataset(csv_path, size)
+      result = {'rows': size}
+
+      engine = create_engine(f"sqlite:///{os.path.join(tmp, f'vectorized_{size}.db')}")
+      started = time.perf_counter()
+      inserted = load_dataset(csv_path, bind=engine)
+      elapsed = time.perf_counter() - started
+      engine.dispose()
+      result['vectorized_seconds'] = elapsed
+      result['vectorized_rows_per_sec'] = inserted / elapsed
+
+      if not skip_legacy:
+        engine = _fresh_engine(os.path.join(tmp, f'legacy_{size}.db'))
+        session = sessionmaker(bind=engine)()
+        started = time.perf_counter()
+        inserted = legacy_load(session, csv_path)
+        elapsed = time.perf_counter() - started
+        session.close()
+        engine.dispose()
+        result['legacy_seconds'] = elapsed
+        result['legacy_rows_per_sec'] = inserted / elapsed
+        result['speedup'] = result['vectorized_rows_per_sec'] / result['legacy_rows_per_sec']
+
+      results.append(result)
+      print(
+        f"{size:>9} rows  vectorized {result['vectorized_rows_per_sec']:>10.0f} rows/s"
+        + (
+          f"  legacy {result['legacy_rows_per_sec']:>10.0f} rows/s  x{result['speedup']:.1f}"
+          if 'legacy_rows_per_sec' in result
+          else ''
+        ),
+      )
+  return results
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--sizes', type=int, nargs='+', default=[1_000, 100_000, 1_000_000])
+  parser.add_argument('--skip-legacy', action='store_true', help='Only time the vectorized loader.')
+  parser.add_argument('--json', help='Write results to this JSON file.')
+  args = parser.parse_args()
+
+  results = run(args.sizes, skip_legacy=args.skip_legacy)
+  if args.json:
+    with open(args.json, 'w', encoding='utf-8') as fh:
+      json.dump(results, fh, indent=2)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,394 @@
+"""End-to-end benchmarks of the backend hot paths on synthetic data.
+
+Usage (from smart-energy-backend/):
+
+  python -m benchmarks.bench_suite --rows 10000 100000 --json bench.json
+  python -m benchmarks.bench_suite --rows 1000000 --machines 200 --only ingest dashboard
+  python -m benchmarks.bench_suite --rows 100000 --only http --http-requests 2000 --concurrency 32
+
+Every size runs in a subprocess of its own against a scratch database, models
+directory and Parquet mirror (ENERGY_DB_PATH, MODELS_DIR, ENERGY_DATASET_PATH and
+PARQUET_MIRROR_DIR point into a temporary directory), so energy.db and models/ are
+never touched and no cache state carries over between sizes. GROQ_USE_FAKE=1 is set
+unless --real-groq is given. The data is written by benchmarks.synthetic and imported
+with ingest_csv() before any benchmark runs; models are trained when a selected
+benchmark needs them.
+
+Benchmarks (all by default):
+
+  ingest     ingest_csv() of the synthetic CSV, feature-stats and rollup refreshes
+  dashboard  get_dashboard_stats(): recomputed (cache cleared) and cached calls
+  training   train_and_publish(), with the manifest's stage timings and memory
+  insights   score_pending_records() of every record, then get_dashboard_ml_insights()
+  analysis   run_full_analysis() per machine and one batch over machines x scenarios
+  http       uvicorn workers under concurrent clients, per endpoint
+
+Results go to --json as {"meta": {...}, "results": [{"rows": ..., "benchmarks": {...}}]};
+meta records the git commit, so files from two commits can be diffed directly.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional, Sequence
+
+BENCHMARKS = ('ingest', 'dashboard', 'training', 'insights', 'analysis', 'http')
+_NEEDS_MODELS = {'training', 'insights', 'analysis', 'http'}
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _latency_summary(samples: Sequence[float]) -> Dict:
+  """Count, mean and percentiles in milliseconds of per-call durations in seconds."""
+  if not samples:
+    return {'calls': 0}
+  ordered = sorted(samples)
+
+  def pct(q: float) -> float:
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000.0, 3)
+
+  return {
+    'calls': len(ordered),
+    'mean_ms': round(sum(ordered) / len(ordered) * 1000.0, 3),
+    'p50_ms': pct(0.50),
+    'p95_ms': pct(0.95),
+    'p99_ms': pct(0.99),
+    'max_ms': round(ordered[-1] * 1000.0, 3),
+  }
+
+
+def _time_calls(fn: Callable[[], object], repeat: int) -> Dict:
+  samples = []
+  for _ in range(repeat):
+    started = time.perf_counter()
+    fn()
+    samples.append(time.perf_counter() - started)
+  return _latency_summary(samples)
+
+
+def _timed(fn: Callable[[], object]):
+  started = time.perf_counter()
+  value = fn()
+  return value, time.perf_counter() - started
+
+
+# --- benchmarks; run in the per-size worker, after the scratch environment is set ---
+
+
+def bench_ingest(csv_path: str, rows: int) -> Dict:
+  from database.csv_to_db import ingest_csv
+  from ml.feature_stats import refresh_feature_stats
+  from services.rollup_service import refresh_machine_rollups
+
+  summary, seconds = _timed(lambda: ingest_csv(csv_path))
+  _, stats_seconds = _timed(refresh_feature_stats)
+  _, rollup_seconds = _timed(refresh_machine_rollups)
+  inserted = (summary or {}).get('rows_inserted', rows)
+  return {
+    'seconds': round(seconds, 3),
+    'rows_per_sec': round(inserted / seconds) if seconds > 0 else None,
+    'rows_inserted': inserted,
+    'feature_stats_seconds': round(stats_seconds, 3),
+    'rollups_seconds': round(rollup_seconds, 3),
+  }
+
+
+def bench_dashboard(repeat: int) -> Dict:
+  from database.db import SessionLocal
+  from services.energy_service import _dashboard_cache, get_dashboard_stats
+
+  db = SessionLocal()
+  try:
+    def recompute():
+      _dashboard_cache.invalidate()
+      get_dashboard_stats(db)
+
+    return {
+      'recompute': _time_calls(recompute, max(repeat // 10, 3)),
+      'cached': _time_calls(lambda: get_dashboard_stats(db), repeat),
+    }
+  finally:
+    db.close()
+
+
+def bench_training() -> Dict:
+  from ml.artifacts import read_training_info
+  from ml.registry import version_dir
+  from ml.train_models import train_and_publish
+
+  version, seconds = _timed(train_and_publish)
+  info = read_training_info(version_dir(version)) or {}
+  return {'seconds': round(seconds, 3), 'version': version, **info}
+
+
+def bench_insights(repeat: int) -> Dict:
+  from ml.predict import warm_up_models
+  from services.ml_service import get_dashboard_ml_insights
+  from services.scoring_service import score_pending_records
+
+  warm_up_models()
+  _, scoring = _timed(score_pending_records)
+  _, first = _timed(get_dashboard_ml_insights)
+  return {
+    'scoring_seconds': round(scoring, 3),
+    'first_call_seconds': round(first, 3),
+    'cached': _time_calls(get_dashboard_ml_insights, repeat),
+  }
+
+
+def bench_analysis(repeat: int, machines: List[str]) -> Dict:
+  from database.db import AsyncSessionLocal, SessionLocal
+  from services.ml_service import run_batch_analysis_async, run_full_analysis
+
+  rng = random.Random(0)
+  db = SessionLocal()
+  try:
+    single = _time_calls(
+      lambda: run_full_analysis(rng.choice(machines), rng.uniform(4, 20), rng.uniform(0, 8), db),
+      repeat,
+    )
+  finally:
+    db.close()
+
+  scenarios = [(float(on), float(off)) for on in range(0, 24, 2) for off in (0.0, 4.0)]
+
+  async def batch():
+    async with AsyncSessionLocal() as session:
+      return await run_batch_analysis_async(session, None, scenarios)
+
+  grid, seconds = _timed(lambda: asyncio.run(batch()))
+  cells = len(grid['machines']) * len(scenarios)
+  return {
+    'single': single,
+    'batch': {'cells': cells, 'seconds': round(seconds, 3), 'cells_per_sec': round(cells / seconds) if seconds else None},
+  }
+
+
+def _free_port() -> int:
+  with socket.socket() as sock:
+    sock.bind(('127.0.0.1', 0))
+    return sock.getsockname()[1]
+
+
+async def _load(url: str, make_request: Callable, requests: int, concurrency: int) -> Dict:
+  import httpx
+
+  samples: List[float] = []
+  statuses: Dict[str, int] = {}
+  remaining = iter(range(requests))
+
+  async with httpx.AsyncClient(base_url=url, timeout=60.0) as client:
+    async def worker():
+      for _ in remaining:
+        started = time.perf_counter()
+        try:
+          status = str((await make_request(client)).status_code)
+        except httpx.HTTPError as exc:
+          status = type(exc).__name__
+        samples.append(time.perf_counter() - started)
+        statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+  return {
+    'requests': requests,
+    'concurrency': concurrency,
+    'seconds': round(elapsed, 3),
+    'requests_per_sec': round(requests / elapsed, 1) if elapsed else None,
+    'statuses': statuses,
+    'latency': _latency_summary(samples),
+  }
+
+
+def bench_http(machines: List[str], requests: int, concurrency: int, workers: int) -> Dict:
+  import httpx
+
+  port = _free_port()
+  url = f'http://127.0.0.1:{port}'
+  server = subprocess.Popen(
+    [sys.executable, '-m', 'uvicorn', 'main:app', '--host', '127.0.0.1', '--port', str(port),
+     '--workers', str(workers), '--log-level', 'warning'],
+    cwd=BACKEND_DIR,
+  )
+  try:
+    deadline = time.monotonic() + 300
+    while True:
+      try:
+        if httpx.get(f'{url}/ready', timeout=5).status_code == 200:
+          break
+      except httpx.HTTPError:
+        pass
+      if server.poll() is not None or time.monotonic() > deadline:
+        raise RuntimeError('uvicorn did not become ready.')
+      time.sleep(0.5)
+
+    rng = random.Random(0)
+    endpoints = {
+      'GET /health': lambda c: c.get('/health'),
+      'GET /api/dashboard': lambda c: c.get('/api/dashboard'),
+      'GET /api/timeseries': lambda c: c.get('/api/timeseries', params={'machine_id': rng.choice(machines), 'bucket': 'day'}),
+      'POST /api/analyze': lambda c: c.post(
+        '/api/analyze',
+        json={'machine_id': rng.choice(machines), 'on_time_hours': rng.randint(4, 20), 'off_time_hours': rng.randint(0, 8)},
+      ),
+    }
+    return {
+      'workers': workers,
+      'endpoints': {
+        name: asyncio.run(_load(url, request, requests, concurrency)) for name, request in endpoints.items()
+      },
+    }
+  finally:
+    server.terminate()
+    server.wait(timeout=60)
+
+
+def run_worker(args: argparse.Namespace, rows: int) -> Dict:
+  """Benchmarks for one size; expects the scratch environment `run_size` sets up."""
+  from benchmarks.synthetic import write_synthetic_csv
+  from database.db import Base, engine
+  from database.record_frames import peak_rss_bytes
+
+  selected = set(args.only)
+  csv_path = os.environ['ENERGY_DATASET_PATH']
+  Base.metadata.create_all(bind=engine)
+
+  results: Dict = {}
+  written, seconds = _timed(
+    lambda: write_synthetic_csv(csv_path, rows, machines=args.machines, anomaly_rate=args.anomaly_rate, seed=args.seed),
+  )
+  results['generate'] = {
+    'seconds': round(seconds, 3),
+    'rows_per_sec': round(written / seconds) if seconds else None,
+    'csv_bytes': os.path.getsize(csv_path),
+  }
+  ingest = bench_ingest(csv_path, rows)
+  if 'ingest' in selected:
+    results['ingest'] = ingest
+  if 'dashboard' in selected:
+    results['dashboard'] = bench_dashboard(args.repeat)
+  if selected & _NEEDS_MODELS:
+    results['training'] = bench_training()
+  if 'insights' in selected:
+    results['insights'] = bench_insights(args.repeat)
+
+  machines = [f'MCH-{i + 1:03d}' for i in range(args.machines)]
+  if 'analysis' in selected:
+    results['analysis'] = bench_analysis(args.repeat, machines)
+  peak = peak_rss_bytes()
+  results['peak_rss_mb'] = round(peak / 2**20, 1) if peak is not None else None
+  engine.dispose()
+
+  if 'http' in selected:
+    results['http'] = bench_http(machines, args.http_requests, args.concurrency, args.http_workers)
+  return results
+
+
+# --- driver ---
+
+
+def _git_commit() -> Optional[str]:
+  try:
+    return subprocess.run(
+      ['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR, capture_output=True, text=True, check=True,
+    ).stdout.strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+
+def run_size(rows: int, args: argparse.Namespace) -> Dict:
+  with tempfile.TemporaryDirectory(prefix='energy-bench-', dir=args.workdir) as tmp:
+    env = {
+      **os.environ,
+      'ENERGY_DB_PATH': os.path.join(tmp, 'energy.db'),
+      'MODELS_DIR': os.path.join(tmp, 'models'),
+      'ENERGY_DATASET_PATH': os.path.join(tmp, 'dataset', 'energy_dataset.csv'),
+      'PARQUET_MIRROR_DIR': os.path.join(tmp, 'parquet', 'energy_records'),
+      'PYTHONPATH': os.pathsep.join(filter(None, [BACKEND_DIR, os.environ.get('PYTHONPATH')])),
+    }
+    if not args.real_groq:
+      env['GROQ_USE_FAKE'] = '1'
+    os.makedirs(os.path.dirname(env['ENERGY_DATASET_PATH']))
+    out_path = os.path.join(tmp, 'result.json')
+    command = [
+      sys.executable, '-m', 'benchmarks.bench_suite', '--worker', out_path,
+      '--rows', str(rows), '--machines', str(args.machines), '--anomaly-rate', str(args.anomaly_rate),
+      '--seed', str(args.seed), '--repeat', str(args.repeat), '--only', *args.only,
+      '--http-requests', str(args.http_requests), '--concurrency', str(args.concurrency),
+      '--http-workers', str(args.http_workers),
+    ]
+    subprocess.run(command, cwd=BACKEND_DIR, env=env, check=True)
+    with open(out_path, encoding='utf-8') as fh:
+      return {'rows': rows, 'machines': args.machines, 'benchmarks': json.load(fh)}
+
+
+def _print_summary(result: Dict) -> None:
+  bench = result['benchmarks']
+  parts = [f"{result['rows']:>11} rows"]
+  if 'ingest' in bench:
+    parts.append(f"ingest {bench['ingest']['rows_per_sec']} rows/s")
+  if 'dashboard' in bench:
+    parts.append(f"dashboard {bench['dashboard']['recompute']['p50_ms']} ms")
+  if 'training' in bench:
+    parts.append(f"training {bench['training']['seconds']} s")
+  if 'insights' in bench:
+    parts.append(f"insights {bench['insights']['first_call_seconds']} s")
+  if 'analysis' in bench:
+    parts.append(f"analyze p50 {bench['analysis']['single']['p50_ms']} ms")
+  for name, load in bench.get('http', {}).get('endpoints', {}).items():
+    parts.append(f"{name} {load['requests_per_sec']} req/s")
+  print('  '.join(parts), flush=True)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000])
+  parser.add_argument('--machines', type=int, default=50)
+  parser.add_argument('--anomaly-rate', type=float, default=0.05)
+  parser.add_argument('--seed', type=int, default=42)
+  parser.add_argument('--only', nargs='+', choices=BENCHMARKS, default=list(BENCHMARKS))
+  parser.add_argument('--repeat', type=int, default=50, help='Calls per latency measurement.')
+  parser.add_argument('--http-requests', type=int, default=500, help='Requests per endpoint.')
+  parser.add_argument('--concurrency', type=int, default=16, help='Concurrent HTTP clients.')
+  parser.add_argument('--http-workers', type=int, default=1, help='uvicorn worker processes.')
+  parser.add_argument('--real-groq', action='store_true', help='Do not set GROQ_USE_FAKE=1.')
+  parser.add_argument('--workdir', help='Where scratch databases go (default: system temp dir).')
+  parser.add_argument('--json', help='Write results to this JSON file.')
+  parser.add_argument('--worker', metavar='OUT', help=argparse.SUPPRESS)
+  args = parser.parse_args(argv)
+
+  if args.worker:
+    (rows,) = args.rows
+    results = run_worker(args, rows)
+    with open(args.worker, 'w', encoding='utf-8') as fh:
+      json.dump(results, fh)
+    return
+
+  meta = {
+    'commit': _git_commit(),
+    'python': platform.python_version(),
+    'platform': platform.platform(),
+    'cpu_count': os.cpu_count(),
+    'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    'args': {k: v for k, v in vars(args).items() if k not in ('worker', 'json')},
+  }
+  results = []
+  for rows in args.rows:
+    result = run_size(rows, args)
+    _print_summary(result)
+    results.append(result)
+  if args.json:
+    with open(args.json, 'w', encoding='utf-8') as fh:
+      json.dump({'meta': meta, 'results': results}, fh, indent=2)
+
+
+if __name__ == '__main__':
+  main()
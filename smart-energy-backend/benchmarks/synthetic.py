@@ -0,0 +1,156 @@
+"""Synthetic energy_dataset.csv-shaped readings at any scale.
+
+Usage (from smart-energy-backend/):
+
+  python -m benchmarks.synthetic --rows 1000000 --machines 200 --out /tmp/energy_1m.csv
+
+Every machine reports once per hour, so `rows` readings cover rows / machines hours
+starting at --start. Values follow the bundled dataset: Running / Idle / Off status
+with matching load, power factor, temperature and production, shift-dependent tariffs,
+and Off readings labelled anomalous. On top of that --anomaly-rate of the readings get
+an injected fault (overheating, power-factor collapse or an overload spike) and
+True_Anomaly_Label = 1. Output is deterministic for a given seed and chunk size and is
+written chunk by chunk, so 100M rows need no more memory than 10k.
+"""
+import argparse
+import time
+from typing import Iterator, Optional
+
+import numpy as np
+import pandas as pd
+
+MACHINE_MODELS = ('Siemens S7-1500', 'ABB ACS880', 'Fanuc 30i', 'Mitsubishi M800', 'Bosch Rexroth')
+STATUSES = np.array(['Running', 'Idle', 'Off'])
+STATUS_WEIGHTS = (0.71, 0.21, 0.08)
+# Mean tariff (INR/kWh) per shift: Morning, Afternoon, Night.
+SHIFTS = np.array(['Morning', 'Afternoon', 'Night'])
+SHIFT_TARIFFS = np.array([9.5, 11.0, 7.8])
+DEFAULT_CHUNK_ROWS = 500_000
+
+
+def _shift_index(hours: np.ndarray) -> np.ndarray:
+  """0 = Morning (06-13), 1 = Afternoon (14-21), 2 = Night (22-05)."""
+  return np.where((hours >= 6) & (hours < 14), 0, np.where((hours >= 14) & (hours < 22), 1, 2))
+
+
+class _Fleet:
+  """Per-machine constants drawn once so a machine keeps its identity across chunks."""
+
+  def __init__(self, machines: int, seed: int) -> None:
+    rng = np.random.default_rng([seed, 0])
+    self.ids = np.array([f'MCH-{i + 1:03d}' for i in range(machines)])
+    self.models = np.array(MACHINE_MODELS)[np.arange(machines) % len(MACHINE_MODELS)]
+    self.rated_kw = rng.choice(np.arange(100, 301, 50), size=machines).astype(float)
+    self.contract_kw = rng.choice(np.arange(500, 801, 50), size=machines).astype(float)
+    self.maintenance = rng.uniform(50.0, 200.0, size=machines).round(2)
+    self.co2_factor = rng.uniform(0.78, 0.82, size=machines).round(3)
+    self.operators = max(10, machines // 2)
+
+
+def generate_chunks(
+  rows: int,
+  machines: int = 50,
+  start: str = '2024-01-01 00:00:00',
+  anomaly_rate: float = 0.05,
+  seed: int = 42,
+  chunk_rows: int = DEFAULT_CHUNK_ROWS,
+) -> Iterator[pd.DataFrame]:
+  """Yield DataFrames with the CSV's column headers, `chunk_rows` readings at a time."""
+  fleet = _Fleet(machines, seed)
+  origin = pd.Timestamp(start)
+  for chunk_no, first in enumerate(range(0, rows, chunk_rows), start=1):
+    rng = np.random.default_rng([seed, chunk_no])
+    index = np.arange(first, min(first + chunk_rows, rows))
+    n = len(index)
+    machine = index % machines
+    timestamps = origin + pd.to_timedelta(index // machines, unit='h')
+    shift = _shift_index(timestamps.hour.to_numpy())
+
+    status = rng.choice(3, size=n, p=STATUS_WEIGHTS)
+    running, idle, off = status == 0, status == 1, status == 2
+    load = np.where(running, rng.normal(77.0, 15.0, n).clip(20.0, 120.0), 0.0)
+    load = np.where(idle, rng.normal(12.0, 4.0, n).clip(0.0, 30.0), load)
+    power_factor = np.where(running, rng.normal(0.905, 0.03, n), rng.normal(0.88, 0.04, n)).clip(0.5, 0.99)
+    power_factor = np.where(off, 0.0, power_factor)
+    ambient = rng.normal(30.0, 3.0, n).clip(25.0, 40.0)
+    temperature = np.where(off, ambient - rng.uniform(0.0, 5.0, n), ambient + 0.5 * load + rng.normal(0.0, 4.0, n))
+    downtime = np.where(off, rng.normal(110.0, 40.0, n).clip(30.0, 180.0), 0.0)
+    downtime = np.where(idle, rng.exponential(35.0, n).clip(0.0, 180.0), downtime)
+    label = off.astype(np.int8)
+
+    # Injected faults on otherwise normal readings.
+    faulty = ~off & (rng.random(n) < anomaly_rate)
+    fault = rng.integers(0, 3, n)
+    temperature = np.where(faulty & (fault == 0), temperature + rng.uniform(25.0, 45.0, n), temperature)
+    power_factor = np.where(faulty & (fault == 1), power_factor * rng.uniform(0.3, 0.6, n), power_factor)
+    load = np.where(faulty & (fault == 2), load * rng.uniform(1.4, 1.8, n) + 20.0, load)
+    label[faulty] = 1
+
+    power = fleet.rated_kw[machine] * load / 100.0
+    production = np.where(running, np.floor(load * 1.16 * rng.normal(1.0, 0.1, n).clip(0.5, 1.5)), 0)
+    tariff = (SHIFT_TARIFFS[shift] + rng.normal(0.0, 0.5, n)).clip(7.0, 12.0)
+
+    yield pd.DataFrame({
+      'Machine_ID': fleet.ids[machine],
+      'Machine_Model': fleet.models[machine],
+      'Rated_Capacity_kW': fleet.rated_kw[machine],
+      'Timestamp': timestamps.strftime('%Y-%m-%d %H:%M:%S'),
+      'Power_kW': power.round(2),
+      # One reading per hour: the hour's energy equals its mean power.
+      'Energy_kWh': power.round(2),
+      'Production_Output': production.astype(np.int64),
+      'Load_%': load.round(2),
+      'Power_Factor': power_factor.round(3),
+      'Temperature': temperature.round(1),
+      'Operating_Status': STATUSES[status],
+      'Shift': SHIFTS[shift],
+      'Operator_ID': np.char.add('OPR-', np.char.zfill(rng.integers(1, fleet.operators + 1, n).astype(str), 3)),
+      'Electricity_Tariff_INR_per_kWh': tariff.round(2),
+      'Maintenance_Cost_per_hour': fleet.maintenance[machine],
+      'CO2_Emission_Factor_kg_per_kWh': fleet.co2_factor[machine],
+      'Ambient_Temperature': ambient.round(1),
+      'Contract_Demand_kW': fleet.contract_kw[machine],
+      'True_Anomaly_Label': label,
+      'Downtime_Minutes': downtime.round().astype(np.int64),
+      'Idle_Flag': idle.astype(np.int8),
+    })
+
+
+def write_synthetic_csv(
+  path: str,
+  rows: int,
+  machines: int = 50,
+  start: str = '2024-01-01 00:00:00',
+  anomaly_rate: float = 0.05,
+  seed: int = 42,
+  chunk_rows: int = DEFAULT_CHUNK_ROWS,
+) -> int:
+  """Write `rows` synthetic readings to `path`; returns the rows written."""
+  written = 0
+  for chunk in generate_chunks(rows, machines, start, anomaly_rate, seed, chunk_rows):
+    chunk.to_csv(path, mode='w' if written == 0 else 'a', header=written == 0, index=False)
+    written += len(chunk)
+  return written
+
+
+def main(argv: Optional[list] = None) -> None:
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--rows', type=int, required=True)
+  parser.add_argument('--out', required=True, help='CSV file to write.')
+  parser.add_argument('--machines', type=int, default=50)
+  parser.add_argument('--start', default='2024-01-01 00:00:00', help='Timestamp of the first hour.')
+  parser.add_argument('--anomaly-rate', type=float, default=0.05, help='Share of readings with an injected fault.')
+  parser.add_argument('--seed', type=int, default=42)
+  parser.add_argument('--chunk-rows', type=int, default=DEFAULT_CHUNK_ROWS)
+  args = parser.parse_args(argv)
+
+  started = time.perf_counter()
+  written = write_synthetic_csv(
+    args.out, args.rows, args.machines, args.start, args.anomaly_rate, args.seed, args.chunk_rows,
+  )
+  elapsed = time.perf_counter() - started
+  print(f'Wrote {written} readings to {args.out} in {elapsed:.1f}s ({written / elapsed:.0f} rows/s).')
+
+
+if __name__ == '__main__':
+  main()
@@ -1,99 +1,37 @@
 import logging
-import os
 from typing import Optional
 
-import pandas as pd
-from sqlalchemy.orm import Session
-
-from .db import SessionLocal, engine
-from .models import EnergyRecord
+from .csv_to_db import (
+  CSV_CHUNK_SIZE,
+  _ensure_record_schema,
+  _get_dataset_path,
+  insert_record_frame,
+  iter_csv_chunks,
+)
+from .db import engine
 
 logger = logging.getLogger(__name__)
 
 
-def _get_dataset_path() -> str:
-  base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-  return os.path.join(base_dir, 'dataset', 'energy_dataset.csv')
-
-
-def _has_existing_records(db: Session) -> bool:
-  return db.query(EnergyRecord).first() is not None
-
-
-def _to_float(value) -> Optional[float]:
-  if pd.isna(value):
-    return None
-  try:
-    return float(value)
-  except (TypeError, ValueError):
-    return None
-
-
-def load_dataset_if_empty() -> None:
-  """Load CSV dataset into the database if no records exist yet."""
-  dataset_path = _get_dataset_path()
-
-  if not os.path.exists(dataset_path):
-    logger.warning('Dataset file not found at %s; skipping initial load.', dataset_path)
-    return
-
-  db = SessionLocal()
-  try:
-    if _has_existing_records(db):
-      logger.info('Energy records already present in database; skipping dataset load.')
-      return
-
-    logger.info('Loading dataset from %s', dataset_path)
-    df = pd.read_csv(dataset_path)
-
-    if 'timestamp' in df.columns:
-      df['timestamp'] = pd.to_datetime(df['timestamp'], errors='coerce')
+def load_dataset_into(conn, dataset_path: str, chunksize: int = CSV_CHUNK_SIZE) -> int:
+  """Stream `dataset_path` into energy_records on `conn`; returns rows inserted.
 
-    records = []
-    for _, row in df.iterrows():
-      record = EnergyRecord(
-        machine_id=str(row.get('machine_id')) if not pd.isna(row.get('machine_id')) else None,
-        machine_model=str(row.get('machine_model'))
-        if not pd.isna(row.get('machine_model'))
-        else None,
-        rated_capacity_kw=_to_float(row.get('rated_capacity_kw')),
-        contract_demand_kw=_to_float(row.get('contract_demand_kw')),
-        timestamp=row.get('timestamp'),
-        shift=str(row.get('shift')) if not pd.isna(row.get('shift')) else None,
-        operator_id=str(row.get('operator_id'))
-        if not pd.isna(row.get('operator_id'))
-        else None,
-        power_kw=_to_float(row.get('power_kw')),
-        energy_kwh=_to_float(row.get('energy_kwh')),
-        load_percent=_to_float(row.get('load_percent')),
-        power_factor=_to_float(row.get('power_factor')),
-        temperature=_to_float(row.get('temperature')),
-        ambient_temperature=_to_float(row.get('ambient_temperature')),
-        production_output=_to_float(row.get('production_output')),
-        operating_status=str(row.get('operating_status'))
-        if not pd.isna(row.get('operating_status'))
-        else None,
-        idle_flag=bool(row.get('idle_flag')) if not pd.isna(row.get('idle_flag')) else None,
-        electricity_tariff=_to_float(row.get('electricity_tariff')),
-        maintenance_cost=_to_float(row.get('maintenance_cost')),
-        co2_emission=_to_float(row.get('co2_emission')),
-        true_anomaly_label=int(row.get('true_anomaly_label'))
-        if not pd.isna(row.get('true_anomaly_label'))
-        else None,
-        downtime_minutes=_to_float(row.get('downtime_minutes')),
-      )
-      records.append(record)
+  Each chunk is coerced column-wise by pandas and handed to the cursor as one
+  executemany batch, so there is no per-row Python or ORM work. The schema
+  (dedup index, records counter) must already exist; see `load_dataset`.
+  """
+  inserted = 0
+  for chunk in iter_csv_chunks(dataset_path, chunksize=chunksize):
+    inserted += insert_record_frame(conn, chunk)
+  return inserted
 
-    if not records:
-      logger.warning('Dataset is empty; no records inserted.')
-      return
 
-    db.bulk_save_objects(records)
-    db.commit()
-    logger.info('Inserted %d energy records into the database.', len(records))
-  except Exception as exc:  # noqa: BLE001
-    db.rollback()
-    logger.exception('Error while loading dataset: %s', exc)
-  finally:
-    db.close()
+def load_dataset(dataset_path: Optional[str] = None, bind=None, chunksize: int = CSV_CHUNK_SIZE) -> int:
+  """Bring the schema up to date on `bind` (the app engine by default) and load the dataset.
 
+  Without `dataset_path` this loads ENERGY_DATASET_PATH or the bundled CSV, like ingest_csv.
+  """
+  bind = bind if bind is not None else engine
+  _ensure_record_schema(bind)
+  with bind.begin() as conn:
+    return load_dataset_into(conn, dataset_path or _get_dataset_path(), chunksize)
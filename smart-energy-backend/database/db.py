@@ -1,18 +1,49 @@
 import os
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import declarative_base, sessionmaker
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-DB_PATH = os.path.join(BASE_DIR, 'energy.db')
+DB_PATH = os.getenv('ENERGY_DB_PATH', os.path.join(BASE_DIR, 'energy.db'))
 SQLALCHEMY_DATABASE_URL = f"sqlite:///{DB_PATH.replace(os.sep, '/')}"
+ASYNC_SQLALCHEMY_DATABASE_URL = f"sqlite+aiosqlite:///{DB_PATH.replace(os.sep, '/')}"
+
+# Applied to every new SQLite connection. WAL lets dashboard reads proceed while an
+# ingest is writing; NORMAL sync is durable across app crashes in WAL mode and avoids
+# an fsync per transaction. Sizes can be tuned per deployment through the environment.
+SQLITE_PRAGMAS = {
+  'journal_mode': 'WAL',
+  'synchronous': 'NORMAL',
+  'mmap_size': int(os.getenv('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024))),
+  # Negative cache_size is in KiB.
+  'cache_size': -int(os.getenv('SQLITE_CACHE_KB', str(64 * 1024))),
+  'temp_store': 'MEMORY',
+  'busy_timeout': int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000')),
+}
 
 engine = create_engine(
   SQLALCHEMY_DATABASE_URL,
   connect_args={'check_same_thread': False},
 )
 
+# Used by the async request handlers so DB waits do not hold a threadpool worker.
+async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL)
+
+
+@event.listens_for(engine, 'connect')
+@event.listens_for(async_engine.sync_engine, 'connect')
+def _apply_sqlite_pragmas(dbapi_connection, connection_record) -> None:  # noqa: ARG001
+  cursor = dbapi_connection.cursor()
+  try:
+    for name, value in SQLITE_PRAGMAS.items():
+      cursor.execute(f'PRAGMA {name}={value}')
+  finally:
+    cursor.close()
+
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 
 Base = declarative_base()
 
@@ -24,3 +55,7 @@ def get_db():
   finally:
     db.close()
 
+
+async def get_async_db():
+  async with AsyncSessionLocal() as db:
+    yield db
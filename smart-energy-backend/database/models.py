@@ -1,13 +1,31 @@
-from sqlalchemy import Boolean, Column, DateTime, Float, Integer, String
+from sqlalchemy import BigInteger, Boolean, Column, DateTime, Float, Index, Integer, String
 
 from .db import Base
 
 
 class EnergyRecord(Base):
   __tablename__ = 'energy_records'
+  __table_args__ = (
+    # Append-only ingestion dedup key: the same reading delivered twice is ignored,
+    # while distinct readings sharing a machine/timestamp are kept. Its
+    # (machine_id, timestamp) prefix also serves per-machine lookups and time ranges.
+    Index('ux_energy_records_reading', 'machine_id', 'timestamp', 'reading_hash', unique=True),
+    Index('ix_energy_records_shift', 'shift'),
+    # Covers the single-pass dashboard aggregation: the GROUP BY (machine_id, shift)
+    # walks this index in order and never touches the table rows.
+    Index(
+      'ix_energy_records_dashboard',
+      'machine_id',
+      'shift',
+      'energy_kwh',
+      'electricity_tariff',
+      'production_output',
+      'true_anomaly_label',
+    ),
+  )
 
-  id = Column(Integer, primary_key=True, index=True)
-  machine_id = Column(String, index=True)
+  id = Column(Integer, primary_key=True)
+  machine_id = Column(String)
   machine_model = Column(String)
   rated_capacity_kw = Column(Float)
   contract_demand_kw = Column(Float)
@@ -28,4 +46,172 @@ class EnergyRecord(Base):
   co2_emission = Column(Float)
   true_anomaly_label = Column(Integer)
   downtime_minutes = Column(Float)
+  reading_hash = Column(BigInteger)
 
+
+class EnergyScore(Base):
+  """Persisted model outputs for one energy record under one model version."""
+
+  __tablename__ = 'energy_scores'
+
+  model_version = Column(String, primary_key=True)
+  record_id = Column(Integer, primary_key=True)
+  is_anomaly = Column(Boolean)
+  anomaly_score = Column(Float)
+  efficiency = Column(Float)
+
+
+class EnergyScoreTotal(Base):
+  """Running totals of one model version's energy_scores, kept alongside the inserts."""
+
+  __tablename__ = 'energy_score_totals'
+
+  model_version = Column(String, primary_key=True)
+  scored = Column(Integer, nullable=False, default=0)
+  anomalies = Column(Integer, nullable=False, default=0)
+  # Sum and non-null count of efficiency, so the mean matches SQL AVG().
+  sum_efficiency = Column(Float, nullable=False, default=0.0)
+  n_efficiency = Column(Integer, nullable=False, default=0)
+
+
+class IngestSource(Base):
+  """Per-source ingestion watermark: how far into a CSV file we have imported."""
+
+  __tablename__ = 'ingest_sources'
+
+  source = Column(String, primary_key=True)
+  byte_offset = Column(Integer, nullable=False, default=0)
+  head_hash = Column(String)
+  offset_hash = Column(String)
+  rows_ingested = Column(Integer, nullable=False, default=0)
+  updated_at = Column(DateTime)
+
+
+class IngestMachineWatermark(Base):
+  """Latest reading timestamp imported per machine from one source."""
+
+  __tablename__ = 'ingest_machine_watermarks'
+
+  source = Column(String, primary_key=True)
+  machine_id = Column(String, primary_key=True)
+  last_timestamp = Column(DateTime)
+
+
+class RecommendationCacheEntry(Base):
+  """Persisted LLM recommendation, keyed by the normalized prompt fingerprint."""
+
+  __tablename__ = 'recommendation_cache'
+
+  fingerprint = Column(String, primary_key=True)
+  text = Column(String, nullable=False)
+  expires_at = Column(Float, nullable=False)
+
+
+class _RollupSums:
+  """Running sums and non-null counts of the columns `run_full_analysis` averages.
+
+  Averages are `sum_<col> / n_<col>`, matching SQL AVG() semantics (NULLs skipped).
+  """
+
+  readings = Column(Integer, nullable=False, default=0)
+  sum_power_kw = Column(Float, nullable=False, default=0.0)
+  n_power_kw = Column(Integer, nullable=False, default=0)
+  sum_load_percent = Column(Float, nullable=False, default=0.0)
+  n_load_percent = Column(Integer, nullable=False, default=0)
+  sum_temperature = Column(Float, nullable=False, default=0.0)
+  n_temperature = Column(Integer, nullable=False, default=0)
+  sum_downtime_minutes = Column(Float, nullable=False, default=0.0)
+  n_downtime_minutes = Column(Integer, nullable=False, default=0)
+  sum_power_factor = Column(Float, nullable=False, default=0.0)
+  n_power_factor = Column(Integer, nullable=False, default=0)
+  sum_energy_kwh = Column(Float, nullable=False, default=0.0)
+  n_energy_kwh = Column(Integer, nullable=False, default=0)
+  sum_electricity_tariff = Column(Float, nullable=False, default=0.0)
+  n_electricity_tariff = Column(Integer, nullable=False, default=0)
+  sum_idle_flag = Column(Float, nullable=False, default=0.0)
+  n_idle_flag = Column(Integer, nullable=False, default=0)
+
+
+class MachineRollup(_RollupSums, Base):
+  """All-time per-machine sums, maintained incrementally from new energy_records rows."""
+
+  __tablename__ = 'machine_rollups'
+
+  machine_id = Column(String, primary_key=True)
+
+
+class _TimeseriesSums:
+  """Per-bucket totals served by /api/timeseries."""
+
+  sum_cost = Column(Float, nullable=False, default=0.0)
+  sum_production = Column(Float, nullable=False, default=0.0)
+  sum_idle_energy = Column(Float, nullable=False, default=0.0)
+  sum_co2_kg = Column(Float, nullable=False, default=0.0)
+
+
+class MachineHourlyRollup(_RollupSums, _TimeseriesSums, Base):
+  """Per machine, hour and shift sums; windowed averages add up the recent buckets."""
+
+  __tablename__ = 'machine_hourly_rollups'
+  __table_args__ = (Index('ix_machine_hourly_rollups_bucket', 'bucket_start'),)
+
+  # Key order lets a machine's time-range query seek on (machine_id, bucket_start).
+  machine_id = Column(String, primary_key=True)
+  bucket_start = Column(DateTime, primary_key=True)
+  # '' when the reading has no shift, so the bucket still has a usable key.
+  shift = Column(String, primary_key=True)
+
+
+class MachineDailyRollup(_RollupSums, _TimeseriesSums, Base):
+  """Per machine, day and shift sums, for long time-series ranges."""
+
+  __tablename__ = 'machine_daily_rollups'
+  __table_args__ = (Index('ix_machine_daily_rollups_bucket', 'bucket_start'),)
+
+  machine_id = Column(String, primary_key=True)
+  bucket_start = Column(DateTime, primary_key=True)
+  shift = Column(String, primary_key=True)
+
+
+class RollupWatermark(Base):
+  """Last energy_records id (and row count up to it) a derived store has folded in.
+
+  The 'energy_records' row is the table's own counter (max id, row count), kept
+  current by every insert.
+  """
+
+  __tablename__ = 'rollup_watermarks'
+
+  name = Column(String, primary_key=True)
+  last_id = Column(Integer, nullable=False, default=0)
+  rows = Column(Integer, nullable=False, default=0)
+
+
+class MachineBaseline(Base):
+  """Streaming per-machine baseline of one signal: EWMA level and mean absolute deviation."""
+
+  __tablename__ = 'machine_baselines'
+
+  machine_id = Column(String, primary_key=True)
+  signal = Column(String, primary_key=True)
+  readings = Column(Integer, nullable=False, default=0)
+  mean = Column(Float, nullable=False, default=0.0)
+  deviation = Column(Float, nullable=False, default=0.0)
+
+
+class OnlineAnomalyScore(Base):
+  """Near-real-time anomaly flags of one reading from the streaming baselines."""
+
+  __tablename__ = 'online_anomaly_scores'
+  __table_args__ = (Index('ix_online_anomaly_scores_machine', 'machine_id', 'record_id'),)
+
+  record_id = Column(Integer, primary_key=True)
+  machine_id = Column(String)
+  power_kw_z = Column(Float)
+  temperature_z = Column(Float)
+  power_factor_z = Column(Float)
+  max_abs_z = Column(Float)
+  baseline_anomaly = Column(Boolean)
+  # decision_function of the forest refitted on the recent window; NULL before the first refit.
+  window_score = Column(Float)
+  is_anomaly = Column(Boolean)
@@ -0,0 +1,340 @@
+"""Optional columnar mirror of energy_records as Hive-partitioned Parquet files.
+
+  parquet/energy_records/month=YYYY-MM/machine_id=<id>/part-<first id>-<last id>.parquet
+  parquet/energy_records/_mirror.json   -> last id (and row count) mirrored
+
+Full-history scans (training above all) read only the columns and partitions they
+need from here, memory-mapped, instead of pulling every row through SQLite and
+pd.read_sql_query. SQLite stays the source of truth: the mirror is appended to from an
+id watermark like the rollups, rebuilt when records are removed, and readers add the
+rows beyond its watermark from SQLite themselves.
+
+Enabled with PARQUET_MIRROR=1 when pyarrow is installed; otherwise every function here
+is a no-op and callers keep reading SQLite.
+"""
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+from urllib.parse import quote, unquote
+
+import pandas as pd
+from sqlalchemy import text
+
+from .db import BASE_DIR, engine
+from .models import EnergyRecord
+from .record_frames import typed_frame
+from .watermark import records_watermark
+
+try:
+  import pyarrow as pa
+  import pyarrow.compute as pc
+  import pyarrow.dataset as ds
+  import pyarrow.fs as pafs
+  import pyarrow.parquet as pq
+except Exception:  # noqa: BLE001
+  pa = pc = ds = pafs = pq = None  # type: ignore[assignment]
+
+logger = logging.getLogger(__name__)
+
+PARQUET_MIRROR = os.getenv('PARQUET_MIRROR', '0').lower() in ('1', 'true', 'yes')
+PARQUET_MIRROR_DIR = os.getenv('PARQUET_MIRROR_DIR', os.path.join(BASE_DIR, 'parquet', 'energy_records'))
+# Readings mirrored per SQLite read while syncing.
+PARQUET_SYNC_CHUNK = int(os.getenv('PARQUET_SYNC_CHUNK', '200000'))
+# Unsynced readings that make a `min_rows` sync worth doing (live ingest flushes).
+PARQUET_SYNC_ROWS = int(os.getenv('PARQUET_SYNC_ROWS', '10000'))
+# Parts per partition before they are compacted into one file.
+PARQUET_MAX_PARTS = int(os.getenv('PARQUET_MAX_PARTS', '16'))
+
+# Hive's marker for a null partition value.
+_NULL_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+_STATE_NAME = '_mirror.json'
+_PART_RE = re.compile(r'^part-(\d+)-(\d+)\.parquet$')
+
+_lock = threading.Lock()
+
+
+def mirror_enabled() -> bool:
+  return PARQUET_MIRROR and pa is not None
+
+
+def _arrow_type(column):
+  if column.name in ('id', 'reading_hash', 'true_anomaly_label'):
+    return pa.int64()
+  python_type = column.type.python_type
+  if python_type is bool:
+    return pa.bool_()
+  if python_type is float:
+    return pa.float64()
+  if python_type is datetime:
+    return pa.timestamp('us')
+  return pa.string()
+
+
+def _file_schema():
+  """Schema of the part files; machine_id and month live in the directory names."""
+  return pa.schema(
+    [
+      pa.field(column.name, _arrow_type(column))
+      for column in EnergyRecord.__table__.columns
+      if column.name != 'machine_id'
+    ],
+  )
+
+
+def _partitioning():
+  return ds.partitioning(pa.schema([('month', pa.string()), ('machine_id', pa.string())]), flavor='hive')
+
+
+def _state_path() -> str:
+  return os.path.join(PARQUET_MIRROR_DIR, _STATE_NAME)
+
+
+def _read_state() -> Tuple[int, int]:
+  try:
+    with open(_state_path(), 'r', encoding='utf-8') as fh:
+      state = json.load(fh)
+    return int(state['last_id']), int(state['rows'])
+  except (OSError, ValueError, KeyError):
+    return 0, 0
+
+
+def _write_state(last_id: int, rows: int) -> None:
+  tmp_path = f'{_state_path()}.tmp'
+  with open(tmp_path, 'w', encoding='utf-8') as fh:
+    json.dump({'last_id': last_id, 'rows': rows}, fh)
+  os.replace(tmp_path, _state_path())
+
+
+def mirror_watermark() -> int:
+  """Highest energy_records id in the mirror; 0 when it is disabled or empty."""
+  return _read_state()[0] if mirror_enabled() else 0
+
+
+def _partition_dir(month: Optional[str], machine_id: Optional[str]) -> str:
+  def segment(value: Optional[str]) -> str:
+    return _NULL_PARTITION if value is None else quote(value, safe='')
+
+  return os.path.join(PARQUET_MIRROR_DIR, f'month={segment(month)}', f'machine_id={segment(machine_id)}')
+
+
+def _iter_parts() -> Iterator[Tuple[str, str, str, int, int]]:
+  """(path, month, machine_id, first id, last id) of every part file."""
+  if not os.path.isdir(PARQUET_MIRROR_DIR):
+    return
+  for month_dir in os.listdir(PARQUET_MIRROR_DIR):
+    if not month_dir.startswith('month='):
+      continue
+    for machine_dir in os.listdir(os.path.join(PARQUET_MIRROR_DIR, month_dir)):
+      if not machine_dir.startswith('machine_id='):
+        continue
+      directory = os.path.join(PARQUET_MIRROR_DIR, month_dir, machine_dir)
+      for name in os.listdir(directory):
+        match = _PART_RE.match(name)
+        if match:
+          month = unquote(month_dir[len('month='):])
+          machine = unquote(machine_dir[len('machine_id='):])
+          yield os.path.join(directory, name), month, machine, int(match.group(1)), int(match.group(2))
+
+
+def _write_part(directory: str, table) -> str:
+  ids = table.column('id')
+  first, last = pc.min(ids).as_py(), pc.max(ids).as_py()
+  os.makedirs(directory, exist_ok=True)
+  path = os.path.join(directory, f'part-{first:012d}-{last:012d}.parquet')
+  # A leading dot keeps readers from picking up the half-written file.
+  tmp_path = os.path.join(directory, f'.part-{first:012d}-{last:012d}.tmp')
+  pq.write_table(table, tmp_path, compression='zstd')
+  os.replace(tmp_path, path)
+  return path
+
+
+def _records_table(df: pd.DataFrame):
+  """SQLite rows (pd.read_sql_query frame) as an Arrow table in `_file_schema` order."""
+  schema = _file_schema()
+  columns = {}
+  for field in schema:
+    series = df[field.name]
+    if pa.types.is_timestamp(field.type):
+      series = pd.to_datetime(series, errors='coerce')
+    elif pa.types.is_boolean(field.type):
+      series = pd.to_numeric(series, errors='coerce').astype('boolean')
+    elif pa.types.is_integer(field.type):
+      series = pd.to_numeric(series, errors='coerce').astype('Int64')
+    columns[field.name] = pa.array(series, type=field.type, from_pandas=True)
+  return pa.table(columns, schema=schema)
+
+
+def _compact(directory: str) -> None:
+  """Merge a partition's parts into one file once it has more than PARQUET_MAX_PARTS.
+
+  The merged file is written before the parts are removed; readers skip parts whose id
+  range lies inside another part of the same partition, so they never count a row twice.
+  """
+  parts = sorted(name for name in os.listdir(directory) if _PART_RE.match(name))
+  if len(parts) <= PARQUET_MAX_PARTS:
+    return
+  table = pa.concat_tables([pq.read_table(os.path.join(directory, name), schema=_file_schema()) for name in parts])
+  merged = _write_part(directory, table.sort_by('id'))
+  for name in parts:
+    path = os.path.join(directory, name)
+    if path != merged:
+      os.remove(path)
+
+
+def sync_parquet_mirror(min_rows: int = 0, chunk_rows: int = PARQUET_SYNC_CHUNK) -> int:
+  """Append energy_records rows added since the last sync to the mirror.
+
+  Skipped while fewer than `min_rows` rows are pending. Parts left behind by an
+  interrupted sync are discarded, and the mirror is rebuilt when records were removed.
+  Returns the number of rows mirrored.
+  """
+  if not mirror_enabled():
+    return 0
+
+  with _lock:
+    last_id, last_rows = _read_state()
+    with engine.connect() as conn:
+      rows, max_id = records_watermark(conn)
+
+    if max_id < last_id or rows < last_rows:
+      logger.warning('energy_records shrank since the last Parquet sync; rebuilding the mirror.')
+      shutil.rmtree(PARQUET_MIRROR_DIR, ignore_errors=True)
+      last_id, last_rows = 0, 0
+    if max_id - last_id < max(min_rows, 1):
+      return 0
+
+    os.makedirs(PARQUET_MIRROR_DIR, exist_ok=True)
+    for path, _, _, first, _ in list(_iter_parts()):
+      if first > last_id:
+        os.remove(path)
+
+    columns = ', '.join(EnergyRecord.__table__.columns.keys())
+    mirrored = 0
+    touched = set()
+    while last_id < max_id:
+      with engine.connect() as conn:
+        df = pd.read_sql_query(
+          text(
+            f'SELECT {columns} FROM energy_records WHERE id > :last_id AND id <= :max_id '
+            'ORDER BY id LIMIT :limit',
+          ),
+          con=conn,
+          params={'last_id': last_id, 'max_id': max_id, 'limit': int(chunk_rows)},
+        )
+      if df.empty:
+        break
+      month = pd.to_datetime(df['timestamp'], errors='coerce').dt.strftime('%Y-%m')
+      groups = df.groupby([month.fillna(_NULL_PARTITION), df['machine_id'].fillna(_NULL_PARTITION)], sort=False)
+      for (month_key, machine_key), group in groups:
+        directory = _partition_dir(
+          None if month_key == _NULL_PARTITION else month_key,
+          None if machine_key == _NULL_PARTITION else machine_key,
+        )
+        _write_part(directory, _records_table(group))
+        touched.add(directory)
+      last_id = int(df['id'].iloc[-1])
+      mirrored += len(df)
+      _write_state(last_id, last_rows + mirrored)
+
+    for directory in touched:
+      _compact(directory)
+
+  logger.info('Mirrored %d readings to Parquet (up to id %d).', mirrored, last_id)
+  return mirrored
+
+
+def _live_parts(
+  machine_ids: Optional[Sequence[str]],
+  months: Optional[Tuple[str, str]],
+  after_id: int,
+  upto_id: int,
+) -> List[str]:
+  """Part files that can hold matching rows, pruned on directory and file names alone."""
+  by_partition: Dict[Tuple[str, str], List[Tuple[int, int, str]]] = defaultdict(list)
+  wanted = set(machine_ids) if machine_ids is not None else None
+  for path, month, machine, first, last in _iter_parts():
+    if wanted is not None and machine not in wanted:
+      continue
+    if months is not None and month != _NULL_PARTITION and not months[0] <= month <= months[1]:
+      continue
+    if last <= after_id or first > upto_id:
+      continue
+    by_partition[(month, machine)].append((first, last, path))
+
+  paths = []
+  for parts in by_partition.values():
+    for first, last, path in parts:
+      # Skip parts already merged into a compacted part that has not been deleted yet.
+      if not any((f, l) != (first, last) and f <= first and last <= l for f, l, _ in parts):
+        paths.append(path)
+  return paths
+
+
+def scan_batches(
+  columns: Sequence[str],
+  machine_ids: Optional[Sequence[str]] = None,
+  start: Optional[datetime] = None,
+  end: Optional[datetime] = None,
+  after_id: int = 0,
+  batch_rows: int = PARQUET_SYNC_CHUNK,
+  upto_id: Optional[int] = None,
+) -> Optional[Iterator[pd.DataFrame]]:
+  """Stream `columns` of the mirrored rows as typed DataFrames, or None when disabled.
+
+  Only the requested columns are decoded; partitions and files are pruned by machine,
+  month and id range before any file is opened, and the timestamp/id predicates are
+  pushed down to the Parquet row-group statistics. Covers ids up to `upto_id` (default
+  `mirror_watermark()`) only; rows beyond it are still in SQLite alone. Callers that
+  continue in SQLite read the watermark once and pass it, so a sync finishing mid-scan
+  cannot move the boundary between the two reads. Rows are not in id order.
+  """
+  if not mirror_enabled():
+    return None
+  if upto_id is None:
+    upto_id = mirror_watermark()
+  months = None
+  if start is not None or end is not None:
+    months = (start.strftime('%Y-%m') if start else '0000-00', end.strftime('%Y-%m') if end else '9999-99')
+  paths = _live_parts(machine_ids, months, after_id, upto_id)
+  if not paths:
+    return iter(())
+
+  dataset = ds.dataset(
+    paths,
+    schema=_file_schema().append(pa.field('month', pa.string())).append(pa.field('machine_id', pa.string())),
+    format='parquet',
+    # Memory-mapped reads: column chunks come straight from the page cache.
+    filesystem=pafs.LocalFileSystem(use_mmap=True),
+    partitioning=_partitioning(),
+    partition_base_dir=PARQUET_MIRROR_DIR,
+  )
+  condition = (ds.field('id') > after_id) & (ds.field('id') <= upto_id)
+  if start is not None:
+    condition &= ds.field('timestamp') >= pa.scalar(start, type=pa.timestamp('us'))
+  if end is not None:
+    condition &= ds.field('timestamp') <= pa.scalar(end, type=pa.timestamp('us'))
+
+  def batches() -> Iterator[pd.DataFrame]:
+    for batch in dataset.to_batches(columns=list(columns), filter=condition, batch_size=batch_rows):
+      if batch.num_rows:
+        yield typed_frame(batch.to_pandas(strings_to_categorical=True))
+
+  return batches()
+
+
+def mirror_status() -> Dict:
+  parts = list(_iter_parts()) if mirror_enabled() else []
+  return {
+    'enabled': mirror_enabled(),
+    'pyarrow_installed': pa is not None,
+    'path': PARQUET_MIRROR_DIR,
+    'last_id': mirror_watermark(),
+    'files': len(parts),
+    'bytes': sum(os.path.getsize(p[0]) for p in parts),
+  }
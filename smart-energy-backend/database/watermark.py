@@ -0,0 +1,127 @@
+import datetime as dt
+from typing import Dict, Optional, Tuple, Union
+
+import pandas as pd
+from sqlalchemy import func, select, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from .models import EnergyRecord, IngestMachineWatermark, IngestSource, RollupWatermark
+
+# rollup_watermarks row holding energy_records' own (max id, row count), maintained by
+# the insert path so readers never have to COUNT the table.
+RECORDS_COUNTER = 'energy_records'
+
+_RECORDS_COUNTER = select(RollupWatermark.rows, RollupWatermark.last_id).where(
+  RollupWatermark.name == RECORDS_COUNTER,
+)
+_RECORDS_SCAN = select(func.count(EnergyRecord.id), func.max(EnergyRecord.id))
+
+
+def _as_watermark(row) -> Tuple[int, int]:
+  if row is None:
+    return 0, 0
+  count, max_id = row
+  return int(count or 0), int(max_id or 0)
+
+
+def records_watermark(db: Union[Session, Connection]) -> Tuple[int, int]:
+  """Return `(row_count, max_id)` for energy_records.
+
+  Both values only move when rows are inserted or deleted, so derived results
+  (dashboard aggregates, scores, rollups) can be cached against this pair. Read from
+  the maintained counter row; the table is only counted before that row exists.
+  """
+  row = db.execute(_RECORDS_COUNTER).first()
+  if row is None:
+    row = db.execute(_RECORDS_SCAN).first()
+  return _as_watermark(row)
+
+
+async def records_watermark_async(db: AsyncSession) -> Tuple[int, int]:
+  row = (await db.execute(_RECORDS_COUNTER)).first()
+  if row is None:
+    row = (await db.execute(_RECORDS_SCAN)).first()
+  return _as_watermark(row)
+
+
+def reset_records_counter(conn) -> Tuple[int, int]:
+  """Recount energy_records into the counter row, after deletes or a schema rebuild."""
+  conn.execute(text('DELETE FROM rollup_watermarks WHERE name = :name'), {'name': RECORDS_COUNTER})
+  conn.execute(
+    text(
+      'INSERT INTO rollup_watermarks (name, last_id, rows) '
+      'SELECT :name, COALESCE(MAX(id), 0), COUNT(id) FROM energy_records',
+    ),
+    {'name': RECORDS_COUNTER},
+  )
+  return records_watermark(conn)
+
+
+def bump_records_counter(conn, inserted: int) -> None:
+  """Add `inserted` new rows to the counter, in the transaction that inserted them."""
+  if inserted <= 0:
+    return
+  updated = conn.execute(
+    text(
+      'UPDATE rollup_watermarks SET rows = rows + :inserted, '
+      'last_id = (SELECT COALESCE(MAX(id), 0) FROM energy_records) WHERE name = :name',
+    ),
+    {'inserted': int(inserted), 'name': RECORDS_COUNTER},
+  )
+  if not updated.rowcount:
+    reset_records_counter(conn)
+
+
+def load_source_watermark(conn, source: str) -> Optional[Dict]:
+  """Return the stored ingestion watermark for `source`, or None if never ingested."""
+  table = IngestSource.__table__
+  row = conn.execute(select(table).where(table.c.source == source)).mappings().first()
+  return dict(row) if row is not None else None
+
+
+def save_source_watermark(
+  conn,
+  source: str,
+  byte_offset: int,
+  head_hash: Optional[str],
+  offset_hash: Optional[str],
+  rows_ingested: int,
+) -> None:
+  table = IngestSource.__table__
+  values = {
+    'byte_offset': int(byte_offset),
+    'head_hash': head_hash,
+    'offset_hash': offset_hash,
+    'rows_ingested': int(rows_ingested),
+    'updated_at': dt.datetime.now(dt.timezone.utc).replace(tzinfo=None),
+  }
+  updated = conn.execute(table.update().where(table.c.source == source).values(**values))
+  if not updated.rowcount:
+    conn.execute(table.insert().values(source=source, **values))
+
+
+def load_machine_watermarks(conn, source: str) -> Dict[str, pd.Timestamp]:
+  """Return `{machine_id: last imported timestamp}` for `source`."""
+  table = IngestMachineWatermark.__table__
+  rows = conn.execute(
+    select(table.c.machine_id, table.c.last_timestamp).where(table.c.source == source),
+  ).all()
+  return {machine_id: pd.Timestamp(ts) for machine_id, ts in rows if ts is not None}
+
+
+def save_machine_watermarks(conn, source: str, watermarks: Dict[str, pd.Timestamp]) -> None:
+  if not watermarks:
+    return
+  table = IngestMachineWatermark.__table__
+  conn.execute(
+    table.delete().where(table.c.source == source, table.c.machine_id.in_(list(watermarks))),
+  )
+  conn.execute(
+    table.insert(),
+    [
+      {'source': source, 'machine_id': machine_id, 'last_timestamp': ts.to_pydatetime()}
+      for machine_id, ts in watermarks.items()
+    ],
+  )
@@ -1,14 +1,34 @@
 import logging
+from concurrent.futures import Future
+from typing import Optional
 
 from dotenv import load_dotenv
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 
-from database.db import Base, engine
+from database.db import Base, async_engine, engine
 from database.csv_to_db import load_csv_to_db
-from ml.train_models import ensure_models_trained
+from database.parquet_mirror import sync_parquet_mirror
+from ml.feature_stats import refresh_feature_stats
+from ml.predict import current_model_version, model_status, models_ready, warm_up_models
+from ml.train_models import models_available
+from services.anomaly_service import refresh_online_anomalies
+from services.executor import shutdown_ml_executor, submit_to_ml_executor
+from services.metrics import TimingMiddleware, instrument_engine
+from services.rollup_service import refresh_machine_rollups
+from services.scoring_service import score_pending_records
+from services.telemetry_service import shutdown_telemetry
+from services.training_jobs import shutdown_training_pool, start_training_job
 from routes.analysis import router as analysis_router
+from routes.anomalies import router as anomalies_router
 from routes.dashboard import router as dashboard_router
+from routes.ingest import router as ingest_router
+from routes.metrics import router as metrics_router
+from routes.models import router as models_router
+from routes.readings import router as readings_router
+from routes.recommendations import router as recommendations_router
+from routes.timeseries import router as timeseries_router
 
 # Ensure ORM models are imported so Base knows about tables before create_all().
 import database.models  # noqa: F401,E402
@@ -38,26 +58,101 @@ app.add_middleware(
   allow_methods=['*'],
   allow_headers=['*'],
 )
+# Outermost, so request timings include the other middleware.
+app.add_middleware(TimingMiddleware)
+instrument_engine(engine)
+instrument_engine(async_engine.sync_engine)
 
 app.include_router(dashboard_router)
 app.include_router(analysis_router)
+app.include_router(anomalies_router)
+app.include_router(ingest_router)
+app.include_router(metrics_router)
+app.include_router(models_router)
+app.include_router(readings_router)
+app.include_router(recommendations_router)
+app.include_router(timeseries_router)
+
+
+# Startup work that blocks (CSV import, stats, rollups, model warm-up); /ready waits for it.
+_startup: Optional[Future] = None
+
+
+def _prepare_data_and_models() -> None:
+  """Blocking part of startup, run on the ML executor so the event loop starts serving."""
+  try:
+    logger.info('Appending new CSV readings to the database (incremental).')
+    load_csv_to_db()
+
+    logger.info('Refreshing feature statistics for new records.')
+    refresh_feature_stats()
+
+    logger.info('Updating per-machine rollups.')
+    refresh_machine_rollups()
+
+    logger.info('Scoring new readings against the online anomaly baselines (background).')
+    submit_to_ml_executor(refresh_online_anomalies)
+    # No-op unless PARQUET_MIRROR is enabled.
+    submit_to_ml_executor(sync_parquet_mirror)
+
+    if models_available():
+      logger.info('Warming up ML models.')
+      warm_up_models()
+      logger.info('Scoring records not yet scored by the current models (background).')
+      submit_to_ml_executor(score_pending_records)
+    else:
+      # Training time grows with the dataset, so it never blocks startup; requests get
+      # fallback predictions and /ready reports 503 until the first version is published.
+      logger.info('No trained models yet; training in the background.')
+      start_training_job()
+  except Exception:
+    logger.exception('Startup data preparation failed.')
+    raise
+
+
+def _startup_status() -> str:
+  if _startup is None or not _startup.done():
+    return 'running'
+  if _startup.cancelled() or _startup.exception() is not None:
+    return 'failed'
+  return 'done'
 
 
 @app.on_event('startup')
 async def on_startup() -> None:
-  """Backend startup sequence: DB + CSV + ML models."""
+  """Backend startup sequence: DB + CSV + rollups, online anomaly baselines, then ML models (warmed or trained in the background)."""
+  global _startup
   logger.info('Creating database (if not present).')
-  # Ensure the SQLite file exists; actual table schema will be inferred from CSV.
+  # Ensure the SQLite file and ORM tables exist; CSV headers are mapped onto them on import.
   Base.metadata.create_all(bind=engine)
+  _startup = submit_to_ml_executor(_prepare_data_and_models)
 
-  logger.info('Attempting to load CSV dataset into database.')
-  load_csv_to_db()
 
-  logger.info('Ensuring ML models are trained (if missing).')
-  ensure_models_trained()
+@app.on_event('shutdown')
+async def on_shutdown() -> None:
+  # Flush buffered live readings before the pools they refresh through go away.
+  shutdown_telemetry()
+  shutdown_training_pool()
+  shutdown_ml_executor()
+  await async_engine.dispose()
 
 
 @app.get('/health')
-def health_check():
+async def health_check():
   return {'status': 'ok'}
 
+
+@app.get('/ready')
+async def readiness_check():
+  """Readiness for load balancers: 200 only once startup finished and every model is loaded and warmed."""
+  startup = _startup_status()
+  ready = startup == 'done' and models_ready()
+  return JSONResponse(
+    status_code=200 if ready else 503,
+    content={
+      'status': 'ready' if ready else 'not_ready',
+      'startup': startup,
+      'model_version': current_model_version(),
+      'models': model_status(),
+    },
+  )
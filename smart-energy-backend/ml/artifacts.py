@@ -0,0 +1,103 @@
+"""Model artifact files: joblib bundles plus a manifest with size, features and checksum.
+
+Bundles are written uncompressed by default so `joblib.load(mmap_mode='r')` can map
+their large numpy arrays straight from the file; worker processes then share those
+pages through the OS page cache instead of each holding a private copy. Set
+MODEL_COMPRESS (zlib level 1-9) for smaller cold-storage artifacts, which are loaded
+fully into memory.
+"""
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Dict, Optional
+
+import joblib
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = 'manifest.json'
+MODEL_COMPRESS = int(os.getenv('MODEL_COMPRESS', '0'))
+MODEL_MMAP = os.getenv('MODEL_MMAP', '1').lower() not in ('0', 'false', 'no')
+
+
+def file_sha256(path: str, chunk_size: int = 1 << 20) -> str:
+  digest = hashlib.sha256()
+  with open(path, 'rb') as fh:
+    for chunk in iter(lambda: fh.read(chunk_size), b''):
+      digest.update(chunk)
+  return digest.hexdigest()
+
+
+def save_bundle(bundle: Dict, path: str, compress: Optional[int] = None) -> Dict:
+  """Atomically write `bundle` to `path`; returns its manifest entry."""
+  compress = MODEL_COMPRESS if compress is None else int(compress)
+  tmp_path = f'{path}.tmp'
+  joblib.dump(bundle, tmp_path, compress=compress)
+  os.replace(tmp_path, path)
+
+  model = bundle.get('model')
+  return {
+    'file': os.path.basename(path),
+    'bytes': os.path.getsize(path),
+    'sha256': file_sha256(path),
+    'compress': compress,
+    'model_class': type(model).__name__,
+    'features': list(bundle.get('features') or []),
+    'saved_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+  }
+
+
+def manifest_path(models_dir: str) -> str:
+  return os.path.join(models_dir, MANIFEST_NAME)
+
+
+def read_manifest(models_dir: str) -> Dict[str, Dict]:
+  """Manifest entries keyed by model name; empty when there is no (readable) manifest."""
+  path = manifest_path(models_dir)
+  if not os.path.exists(path):
+    return {}
+  try:
+    with open(path, 'r', encoding='utf-8') as fh:
+      return json.load(fh).get('models', {})
+  except (OSError, ValueError) as exc:
+    logger.warning('Ignoring unreadable model manifest %s: %s', path, exc)
+    return {}
+
+
+def read_training_info(models_dir: str) -> Dict:
+  """Rows, per-stage timings and memory recorded by the training run that wrote the manifest."""
+  path = manifest_path(models_dir)
+  try:
+    with open(path, 'r', encoding='utf-8') as fh:
+      return json.load(fh).get('training') or {}
+  except (OSError, ValueError):
+    return {}
+
+
+def write_manifest(models_dir: str, entries: Dict[str, Dict], training: Optional[Dict] = None) -> None:
+  path = manifest_path(models_dir)
+  tmp_path = f'{path}.tmp'
+  content = {'models': entries}
+  if training is not None:
+    content['training'] = training
+  with open(tmp_path, 'w', encoding='utf-8') as fh:
+    json.dump(content, fh, indent=2)
+  os.replace(tmp_path, path)
+
+
+def manifest_entry(path: str) -> Optional[Dict]:
+  """Manifest entry describing the artifact at `path`, if it still matches the file."""
+  entry = read_manifest(os.path.dirname(path))
+  entry = next((e for e in entry.values() if e.get('file') == os.path.basename(path)), None)
+  if entry is None or entry.get('bytes') != os.path.getsize(path):
+    return None
+  return entry
+
+
+def load_artifact(path: str, entry: Optional[Dict] = None):
+  """joblib.load the artifact, memory-mapping its arrays unless it is compressed."""
+  if MODEL_MMAP and not (entry and entry.get('compress')):
+    return joblib.load(path, mmap_mode='r')
+  return joblib.load(path)
@@ -0,0 +1,223 @@
+"""Feature-statistics store shared by prediction, scoring and training.
+
+Column means, standard deviations, min/max, medians and quantiles of the numeric
+energy_records columns, kept in memory and in models/feature_stats.pkl. The store is
+refreshed incrementally (only rows with an id above the last one seen) after ingestion;
+readers get the latest snapshot and never touch the records table.
+"""
+import logging
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import joblib
+import numpy as np
+import pandas as pd
+from sqlalchemy import Boolean, Float, Integer, text
+
+from database.db import engine
+from database.models import EnergyRecord
+from database.watermark import records_watermark
+from .registry import models_dir
+
+logger = logging.getLogger(__name__)
+
+FEATURE_STATS_BATCH_SIZE = 50_000
+FEATURE_STATS_RESERVOIR = int(os.getenv('FEATURE_STATS_RESERVOIR', '50000'))
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+# Row identity columns carry no signal for the models.
+_NON_FEATURE_COLUMNS = {'id', 'reading_hash'}
+
+
+def _numeric_feature_columns() -> Tuple[str, ...]:
+  columns = []
+  for column in EnergyRecord.__table__.columns:
+    if column.name in _NON_FEATURE_COLUMNS:
+      continue
+    if isinstance(column.type, (Float, Integer, Boolean)):
+      columns.append(column.name)
+  return tuple(columns)
+
+
+FEATURE_COLUMNS = _numeric_feature_columns()
+
+
+def get_feature_stats_path() -> str:
+  return os.path.join(models_dir(), 'feature_stats.pkl')
+
+
+class _StatsState:
+  """Mergeable running statistics plus a uniform reservoir sample for quantiles."""
+
+  def __init__(self, columns: Tuple[str, ...], reservoir_size: int = FEATURE_STATS_RESERVOIR) -> None:
+    n = len(columns)
+    self.columns = columns
+    self.last_id = 0
+    self.rows = 0
+    self.count = np.zeros(n)
+    self.mean = np.zeros(n)
+    self.m2 = np.zeros(n)
+    self.min = np.full(n, np.nan)
+    self.max = np.full(n, np.nan)
+    self.reservoir_size = reservoir_size
+    self.reservoir = np.empty((0, n))
+    self._rng = np.random.default_rng(42)
+    self._summary: Optional[Dict] = None
+
+  def update(self, x: np.ndarray, last_id: int) -> None:
+    """Merge a batch of rows (Chan et al. parallel mean/variance update)."""
+    valid = ~np.isnan(x)
+    batch_count = valid.sum(axis=0).astype(float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+      batch_mean = np.where(batch_count > 0, np.nansum(x, axis=0) / np.maximum(batch_count, 1), 0.0)
+      batch_m2 = np.nansum(np.where(valid, x - batch_mean, 0.0) ** 2, axis=0)
+
+      total = self.count + batch_count
+      delta = batch_mean - self.mean
+      share = np.where(total > 0, batch_count / np.maximum(total, 1), 0.0)
+      self.mean = self.mean + delta * share
+      self.m2 = self.m2 + batch_m2 + delta ** 2 * self.count * share
+      self.count = total
+      self.min = np.fmin(self.min, np.nanmin(np.where(valid, x, np.inf), axis=0))
+      self.max = np.fmax(self.max, np.nanmax(np.where(valid, x, -np.inf), axis=0))
+    self.min[np.isinf(self.min)] = np.nan
+    self.max[np.isinf(self.max)] = np.nan
+
+    self._sample(x)
+    self.rows += len(x)
+    self.last_id = last_id
+    self._summary = None
+
+  def _sample(self, x: np.ndarray) -> None:
+    """Vectorized reservoir sampling (Algorithm R) over the new rows."""
+    offered = self.rows
+    free = self.reservoir_size - len(self.reservoir)
+    if free > 0:
+      self.reservoir = np.vstack([self.reservoir, x[:free]])
+      offered += len(x[:free])
+      x = x[free:]
+    if not len(x):
+      return
+    # Row k (1-based, over everything offered so far) replaces a random slot with
+    # probability reservoir_size / k.
+    positions = offered + np.arange(1, len(x) + 1)
+    slots = (self._rng.random(len(x)) * positions).astype(np.int64)
+    keep = slots < self.reservoir_size
+    self.reservoir[slots[keep]] = x[keep]
+
+  def summary(self) -> Dict:
+    if self._summary is not None:
+      return self._summary
+
+    with np.errstate(invalid='ignore'):
+      std = np.sqrt(np.where(self.count > 1, self.m2 / np.maximum(self.count - 1, 1), 0.0))
+      if len(self.reservoir):
+        qs = np.nanquantile(self.reservoir, QUANTILES, axis=0)
+      else:
+        qs = np.full((len(QUANTILES), len(self.columns)), np.nan)
+
+    def by_column(values) -> Dict[str, float]:
+      return {c: float(v) for c, v in zip(self.columns, values) if not np.isnan(v)}
+
+    has_values = self.count > 0
+    self._summary = {
+      'watermark': (self.rows, self.last_id),
+      'columns': list(self.columns),
+      'count': {c: int(n) for c, n in zip(self.columns, self.count)},
+      'mean': by_column(np.where(has_values, self.mean, np.nan)),
+      'std': by_column(np.where(has_values, std, np.nan)),
+      'min': by_column(self.min),
+      'max': by_column(self.max),
+      'median': by_column(qs[QUANTILES.index(0.5)]),
+      'quantiles': {str(q): by_column(row) for q, row in zip(QUANTILES, qs)},
+    }
+    return self._summary
+
+  def __getstate__(self) -> Dict:
+    state = dict(self.__dict__)
+    state['_summary'] = None
+    return state
+
+
+_lock = threading.Lock()
+_state: Optional[_StatsState] = None
+
+
+def _load_state() -> Optional[_StatsState]:
+  global _state
+  if _state is None:
+    path = get_feature_stats_path()
+    if os.path.exists(path):
+      try:
+        loaded = joblib.load(path)
+        if isinstance(loaded, _StatsState) and loaded.columns == FEATURE_COLUMNS:
+          _state = loaded
+      except Exception as exc:  # noqa: BLE001
+        logger.warning('Ignoring unreadable feature stats at %s: %s', path, exc)
+  return _state
+
+
+def _save_state(state: _StatsState) -> None:
+  path = get_feature_stats_path()
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  tmp_path = f'{path}.tmp'
+  joblib.dump(state, tmp_path)
+  os.replace(tmp_path, path)
+
+
+def get_feature_stats() -> Dict:
+  """Latest statistics snapshot (empty dict before the first refresh); no DB access."""
+  with _lock:
+    state = _load_state()
+    return state.summary() if state is not None else {}
+
+
+def feature_means() -> Dict[str, float]:
+  return dict(get_feature_stats().get('mean') or {})
+
+
+def feature_medians() -> Dict[str, float]:
+  return dict(get_feature_stats().get('median') or {})
+
+
+def refresh_feature_stats(batch_size: int = FEATURE_STATS_BATCH_SIZE) -> Dict:
+  """Fold records added since the last refresh into the store and persist it.
+
+  The store is rebuilt from scratch when records were removed (the table shrank or its
+  max id went backwards), e.g. after the legacy schema rebuild or dedup on startup.
+  """
+  global _state
+  select_cols = ', '.join(FEATURE_COLUMNS)
+
+  with _lock:
+    state = _load_state()
+    with engine.connect() as conn:
+      rows, max_id = records_watermark(conn)
+      if state is None or max_id < state.last_id or rows < state.rows:
+        state = _StatsState(FEATURE_COLUMNS)
+
+      changed = state is not _state
+      while state.last_id < max_id:
+        df = pd.read_sql_query(
+          text(f'SELECT id, {select_cols} FROM energy_records WHERE id > :last_id ORDER BY id LIMIT :limit'),
+          con=conn,
+          params={'last_id': state.last_id, 'limit': int(batch_size)},
+        )
+        if df.empty:
+          break
+        x = df[list(FEATURE_COLUMNS)].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+        state.update(x, int(df['id'].iloc[-1]))
+        changed = True
+
+    _state = state
+    if changed:
+      _save_state(state)
+      logger.info('Feature stats refreshed at watermark %s.', state.summary()['watermark'])
+    return state.summary()
+
+
+def training_feature_means(columns: List[str]) -> Dict[str, float]:
+  """Store means for `columns`, for bundles' missing-feature fill values."""
+  means = feature_means()
+  return {c: means[c] for c in columns if c in means}
@@ -1,13 +1,19 @@
+import hashlib
+import logging
 import os
-from functools import lru_cache
-from typing import Dict, Tuple
+import threading
+import time
+from typing import Dict, NamedTuple, Optional, Sequence, Union
 
-import joblib
 import numpy as np
 import pandas as pd
 
-from database.db import engine
-from .train_models import get_model_paths
+from services.metrics import span
+from .artifacts import load_artifact, manifest_entry
+from .feature_stats import feature_means
+from .registry import current_version, model_paths
+
+logger = logging.getLogger(__name__)
 
 
 def _as_float(value, default: float = 0.0) -> float:
@@ -19,107 +25,279 @@ def _as_float(value, default: float = 0.0) -> float:
     return default
 
 
+def _artifact_version(path: str, entry: Optional[Dict] = None) -> str:
+  """Content checksum from the manifest; name, size and mtime for unlisted files."""
+  if entry and entry.get('sha256'):
+    return entry['sha256'][:12]
+  stat = os.stat(path)
+  raw = f'{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns}'
+  return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:12]
+
+
+@span('model.load')
 def _load_bundle(path: str) -> Dict:
   if not os.path.exists(path):
     raise FileNotFoundError(f'Model file not found: {path}. Train models first.')
-  obj = joblib.load(path)
+  entry = manifest_entry(path)
+  version = _artifact_version(path, entry)
+  started = time.perf_counter()
+  obj = load_artifact(path, entry)
+  load_seconds = time.perf_counter() - started
   # Backwards compatibility: allow plain estimators.
   if isinstance(obj, dict) and 'model' in obj and 'features' in obj:
-    return obj
-  return {'model': obj, 'features': [], 'feature_means': {}}
+    bundle = {**obj, 'version': version, 'load_seconds': load_seconds}
+  else:
+    bundle = {'model': obj, 'features': [], 'feature_means': {}, 'version': version, 'load_seconds': load_seconds}
+  return _compile_bundle(bundle)
 
 
 def _dataset_feature_means() -> Dict[str, float]:
-  """Compute global numeric column means from energy_records for missing features."""
-  try:
-    df = pd.read_sql_query('SELECT * FROM energy_records', con=engine)
-  except Exception:
-    return {}
-
-  if df.empty:
-    return {}
+  """Dataset column means from the feature-statistics store (no table scan)."""
+  return feature_means()
 
-  num_df = df.select_dtypes(include='number')
-  return num_df.mean(numeric_only=True).fillna(0.0).to_dict()
 
+def _compile_bundle(bundle: Dict) -> Dict:
+  """Resolve feature order and fill values once per bundle instead of once per call.
 
-def _build_feature_vector(bundle: Dict, input_data: Dict) -> Tuple[np.ndarray, Dict]:
+  Adds `feature_order` (tuple of column names) and `feature_fill` (float array aligned
+  with it). Bundles without feature metadata (older models) fall back to dataset means.
+  """
   model = bundle['model']
-  feature_names = bundle.get('features') or []
+  feature_names = list(bundle.get('features') or [])
   feature_means = dict(bundle.get('feature_means') or {})
 
-  # If the bundle does not include feature metadata (older models), fall back to dataset means.
-  if not feature_names:
-    if hasattr(model, 'n_features_in_'):
-      # Use generic numeric columns from the DB to approximate features.
-      means = _dataset_feature_means()
-      feature_names = sorted(means.keys())[: model.n_features_in_]
-      feature_means = means
-    else:
-      feature_names = []
-
-  if not feature_means:
+  if not feature_names and hasattr(model, 'n_features_in_'):
+    # Use generic numeric columns from the DB to approximate features.
+    feature_means = _dataset_feature_means()
+    feature_names = sorted(feature_means.keys())[: model.n_features_in_]
+  if feature_names and not feature_means:
     feature_means = _dataset_feature_means()
 
-  row = []
-  for name in feature_names:
-    if name in input_data and input_data.get(name) is not None:
-      row.append(_as_float(input_data[name]))
-    else:
-      row.append(_as_float(feature_means.get(name, 0.0)))
+  fill = np.array([_as_float(feature_means.get(name, 0.0)) for name in feature_names], dtype=float)
+  return {**bundle, 'feature_order': tuple(feature_names), 'feature_fill': fill}
+
+
+FeatureInput = Union[pd.DataFrame, np.ndarray, Sequence[Dict]]
+
+
+def _build_feature_matrix(bundle: Dict, data: FeatureInput) -> np.ndarray:
+  """Build the model input matrix for many rows at once.
+
+  `data` may be a DataFrame (columns matched by name), a list of dicts, or a 2-D array
+  already in the bundle's feature order. Missing columns and NaNs are filled with the
+  training means stored in the bundle.
+  """
+  order = bundle['feature_order']
+  fill = bundle['feature_fill']
+
+  if isinstance(data, np.ndarray):
+    x = np.array(data, dtype=float, ndmin=2)
+    if x.shape[1] != len(order):
+      raise ValueError(f'Expected {len(order)} feature columns in order {list(order)}, got {x.shape[1]}.')
+  else:
+    df = data if isinstance(data, pd.DataFrame) else pd.DataFrame(list(data))
+    x = np.empty((len(df), len(order)), dtype=float)
+    for i, name in enumerate(order):
+      if name in df.columns:
+        x[:, i] = pd.to_numeric(df[name], errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+      else:
+        x[:, i] = np.nan
+
+  missing = np.isnan(x)
+  if missing.any():
+    x = np.where(missing, fill, x)
+  return x
+
+
+MODEL_NAMES = ('anomaly', 'cost', 'efficiency')
+# How often a worker re-reads the registry's CURRENT pointer to pick up a new version.
+MODEL_POLL_SECONDS = float(os.getenv('MODEL_POLL_SECONDS', '2'))
+
+
+class LoadedModels(NamedTuple):
+  """Immutable snapshot of one registry version; swapped whole, never mutated."""
+
+  version: str
+  bundles: Dict[str, Dict]
+  status: Dict[str, Dict]
+
+  @property
+  def complete(self) -> bool:
+    return all(name in self.bundles for name in MODEL_NAMES)
+
+
+_models: Optional[LoadedModels] = None
+_swap_lock = threading.Lock()
+_next_poll = 0.0
+
+
+def _warm_up(bundle: Dict) -> float:
+  """Run one prediction on the fill-value row; returns the seconds it took."""
+  started = time.perf_counter()
+  x = bundle['feature_fill'].reshape(1, -1)
+  if x.shape[1]:
+    model = bundle['model']
+    (model.decision_function if hasattr(model, 'decision_function') else model.predict)(x)
+  return time.perf_counter() - started
+
+
+def _load_version(version: str) -> LoadedModels:
+  paths = model_paths(version)
+  bundles: Dict[str, Dict] = {}
+  status: Dict[str, Dict] = {}
+  for name in MODEL_NAMES:
+    try:
+      bundle = _load_bundle(getattr(paths, name))
+      status[name] = {
+        'loaded': True,
+        'version': bundle['version'],
+        'load_seconds': round(bundle['load_seconds'], 4),
+        'warmup_seconds': round(_warm_up(bundle), 4),
+      }
+      bundles[name] = bundle
+    except Exception as exc:  # noqa: BLE001
+      logger.warning('Loading the %s model of version %s failed: %s', name, version, exc)
+      status[name] = {'loaded': False, 'error': str(exc)}
+  return LoadedModels(version, bundles, status)
+
+
+def current_models(force: bool = False) -> LoadedModels:
+  """The model snapshot in service, hot-swapped when the registry's CURRENT moves.
+
+  The pointer is polled at most every MODEL_POLL_SECONDS. A new version is loaded and
+  warmed by the one caller that notices it while everyone else keeps using the old
+  snapshot, so in-flight requests are never dropped. A version that fails to load
+  fully does not replace a complete one.
+  """
+  global _models, _next_poll
+  models = _models
+  if not force and models is not None and time.monotonic() < _next_poll:
+    return models
+  if not _swap_lock.acquire(blocking=models is None or force):
+    return models
 
-  x = np.array([row], dtype=float) if row else np.zeros((1, 0), dtype=float)
-  return x, {'model': model, 'features': feature_names}
+  try:
+    _next_poll = time.monotonic() + MODEL_POLL_SECONDS
+    version = current_version()
+    if force or _models is None or _models.version != version or not _models.complete:
+      loaded = _load_version(version)
+      if loaded.complete or _models is None or not _models.complete:
+        if _models is not None and _models.version != version:
+          logger.info('Switched models from version %s to %s.', _models.version, version)
+        _models = loaded
+      else:
+        logger.warning('Keeping model version %s; version %s did not load.', _models.version, version)
+    return _models
+  finally:
+    _swap_lock.release()
+
+
+def polled_models() -> Optional[LoadedModels]:
+  """The snapshot in service while it needs no poll or load, else None; never blocks.
+
+  For the event loop: on None, resolve through `current_models()` in a worker thread.
+  """
+  models = _models
+  if models is None or time.monotonic() >= _next_poll:
+    return None
+  return models
+
+
+def _current_bundle(name: str) -> Dict:
+  models = current_models()
+  bundle = models.bundles.get(name)
+  if bundle is None:
+    raise FileNotFoundError(models.status[name].get('error') or f'{name} model is not loaded.')
+  return bundle
 
 
-@lru_cache(maxsize=1)
 def _load_anomaly_model():
-  paths = get_model_paths()
-  return _load_bundle(paths.anomaly)
+  return _current_bundle('anomaly')
 
 
-@lru_cache(maxsize=1)
 def _load_cost_model():
-  paths = get_model_paths()
-  return _load_bundle(paths.cost)
+  return _current_bundle('cost')
 
 
-@lru_cache(maxsize=1)
 def _load_efficiency_model():
-  paths = get_model_paths()
-  return _load_bundle(paths.efficiency)
+  return _current_bundle('efficiency')
 
 
-def predict_anomaly(input_data: Dict) -> Dict:
-  """Return anomaly status (Normal/Anomaly) and anomaly score."""
+def current_model_version() -> Optional[str]:
+  """Registry version of the snapshot in service, if one is loaded."""
+  models = _models
+  return models.version if models is not None and models.complete else None
+
+
+def warm_up_models() -> Dict[str, Dict]:
+  """Load and warm the current version so the first request pays neither cost.
+
+  Returns the per-model status also served by `model_status`.
+  """
+  current_models(force=True)
+  return model_status()
+
+
+def model_status() -> Dict[str, Dict]:
+  models = _models
+  if models is None:
+    return {name: {'loaded': False} for name in MODEL_NAMES}
+  return {name: dict(status) for name, status in models.status.items()}
+
+
+def models_ready() -> bool:
+  models = _models
+  return models is not None and models.complete
+
+
+@span('model.predict.anomaly')
+def predict_anomaly_batch(data: FeatureInput) -> Dict[str, np.ndarray]:
+  """Anomaly flags and scores for many rows, aligned with the input order.
+
+  IsolationForest labels a sample anomalous exactly when its decision value
+  (`score_samples - offset_`) is negative, so both come from one pass over the trees.
+  """
   bundle = _load_anomaly_model()
-  x, meta = _build_feature_vector(bundle, input_data)
-  model = meta['model']
+  x = _build_feature_matrix(bundle, data)
+  model = bundle['model']
 
-  pred = int(model.predict(x)[0])  # 1 normal, -1 anomaly
-  score = float(model.decision_function(x)[0])
+  if hasattr(model, 'decision_function'):
+    score = np.asarray(model.decision_function(x), dtype=float)
+    is_anomaly = score < 0
+  else:
+    is_anomaly = np.asarray(model.predict(x)) == -1
+    score = np.where(is_anomaly, -1.0, 1.0)
+  return {'is_anomaly': is_anomaly, 'anomaly_score': score}
 
-  status = 'Anomaly' if pred == -1 else 'Normal'
-  return {'anomaly_status': status, 'anomaly_score': score}
+
+@span('model.predict.cost')
+def predict_cost_batch(data: FeatureInput) -> np.ndarray:
+  """Predicted energy cost (INR) per row, floored at 0."""
+  bundle = _load_cost_model()
+  pred = np.asarray(bundle['model'].predict(_build_feature_matrix(bundle, data)), dtype=float)
+  return np.maximum(pred, 0.0)
+
+
+@span('model.predict.efficiency')
+def predict_efficiency_batch(data: FeatureInput) -> np.ndarray:
+  """Predicted efficiency per row, clipped to 0..1 for UI friendliness."""
+  bundle = _load_efficiency_model()
+  pred = np.asarray(bundle['model'].predict(_build_feature_matrix(bundle, data)), dtype=float)
+  return np.clip(pred, 0.0, 1.0)
+
+
+def predict_anomaly(input_data: Dict) -> Dict:
+  """Return anomaly status (Normal/Anomaly) and anomaly score."""
+  result = predict_anomaly_batch([input_data])
+  status = 'Anomaly' if result['is_anomaly'][0] else 'Normal'
+  return {'anomaly_status': status, 'anomaly_score': float(result['anomaly_score'][0])}
 
 
 def predict_cost(input_data: Dict) -> float:
   """Predict energy cost (INR) for the provided features."""
-  bundle = _load_cost_model()
-  x, meta = _build_feature_vector(bundle, input_data)
-  model = meta['model']
-
-  pred = float(model.predict(x)[0])
-  return max(0.0, pred)
+  return float(predict_cost_batch([input_data])[0])
 
 
 def predict_efficiency(input_data: Dict) -> float:
   """Predict efficiency score from 0..1 (clipped for UI friendliness)."""
-  bundle = _load_efficiency_model()
-  x, meta = _build_feature_vector(bundle, input_data)
-  model = meta['model']
-
-  pred = float(model.predict(x)[0])
-  # For dashboard/UI, keep this in a stable range.
-  return float(np.clip(pred, 0.0, 1.0))
-
+  return float(predict_efficiency_batch([input_data])[0])
@@ -0,0 +1,102 @@
+"""Versioned model registry on disk.
+
+  models/versions/<version>/{anomaly,cost,efficiency}_model.pkl + manifest.json
+  models/CURRENT            -> name of the version in service (replaced atomically)
+
+Trees without a CURRENT pointer fall back to the flat models/*.pkl layout of older
+builds, reported as version 'unversioned'.
+"""
+import logging
+import os
+import shutil
+import time
+import uuid
+from dataclasses import dataclass
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+UNVERSIONED = 'unversioned'
+MODEL_KEEP_VERSIONS = int(os.getenv('MODEL_KEEP_VERSIONS', '3'))
+
+
+@dataclass(frozen=True)
+class ModelPaths:
+  anomaly: str
+  cost: str
+  efficiency: str
+
+
+def models_dir() -> str:
+  base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+  return os.getenv('MODELS_DIR', os.path.join(base_dir, 'models'))
+
+
+def _versions_dir() -> str:
+  return os.path.join(models_dir(), 'versions')
+
+
+def _pointer_path() -> str:
+  return os.path.join(models_dir(), 'CURRENT')
+
+
+def version_dir(version: str) -> str:
+  if version == UNVERSIONED:
+    return models_dir()
+  return os.path.join(_versions_dir(), version)
+
+
+def model_paths(version: Optional[str] = None) -> ModelPaths:
+  directory = version_dir(version or current_version())
+  return ModelPaths(
+    anomaly=os.path.join(directory, 'anomaly_model.pkl'),
+    cost=os.path.join(directory, 'cost_model.pkl'),
+    efficiency=os.path.join(directory, 'efficiency_model.pkl'),
+  )
+
+
+def current_version() -> str:
+  """Version named by the CURRENT pointer, or UNVERSIONED when there is none."""
+  try:
+    with open(_pointer_path(), 'r', encoding='utf-8') as fh:
+      version = fh.read().strip()
+  except FileNotFoundError:
+    return UNVERSIONED
+  return version or UNVERSIONED
+
+
+def new_version() -> str:
+  """Sortable, unique version name: UTC timestamp plus a short random suffix."""
+  return f"{time.strftime('%Y%m%dT%H%M%SZ', time.gmtime())}-{uuid.uuid4().hex[:6]}"
+
+
+def list_versions() -> List[str]:
+  if not os.path.isdir(_versions_dir()):
+    return []
+  return sorted(name for name in os.listdir(_versions_dir()) if os.path.isdir(version_dir(name)))
+
+
+def publish_version(version: str) -> None:
+  """Point CURRENT at `version` with an atomic rename; readers see the old or new name."""
+  if not os.path.isdir(version_dir(version)):
+    raise FileNotFoundError(f'Model version not found: {version}')
+  tmp_path = f'{_pointer_path()}.tmp'
+  with open(tmp_path, 'w', encoding='utf-8') as fh:
+    fh.write(version)
+  os.replace(tmp_path, _pointer_path())
+  logger.info('Model version %s is now current.', version)
+
+
+def prune_versions(keep: int = MODEL_KEEP_VERSIONS) -> List[str]:
+  """Delete all but the newest `keep` versions, never the current one.
+
+  Workers still serving a pruned version keep working: memory-mapped files stay valid
+  after unlink, and each worker moves to the new version on its next poll.
+  """
+  current = current_version()
+  stale = [v for v in list_versions()[: -max(keep, 1)] if v != current]
+  for version in stale:
+    shutil.rmtree(version_dir(version), ignore_errors=True)
+  if stale:
+    logger.info('Pruned %d old model versions.', len(stale))
+  return stale
@@ -1,177 +1,363 @@
 import logging
 import os
-from dataclasses import dataclass
-from typing import Dict, Tuple
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
 
-import joblib
 import numpy as np
 import pandas as pd
 from sklearn.ensemble import IsolationForest, RandomForestRegressor
 from sklearn.linear_model import LinearRegression
+from sqlalchemy import text
 
 from database.db import engine
+from database.parquet_mirror import mirror_watermark, scan_batches
+from database.record_frames import iter_record_frames, peak_rss_bytes
+from .artifacts import save_bundle, write_manifest
+from .feature_stats import FEATURE_COLUMNS, refresh_feature_stats, training_feature_means
+from .registry import ModelPaths, model_paths, new_version, prune_versions, publish_version, version_dir
 
 logger = logging.getLogger(__name__)
 
+TRAIN_CHUNK_ROWS = int(os.getenv('TRAIN_CHUNK_ROWS', '200000'))
+# Row caps for the tree models on large histories (0 = use every row). The sample is
+# stratified by machine and shift so every machine/shift keeps its share of rows.
+TRAIN_ANOMALY_MAX_ROWS = int(os.getenv('TRAIN_ANOMALY_MAX_ROWS', '200000'))
+TRAIN_FOREST_MAX_ROWS = int(os.getenv('TRAIN_FOREST_MAX_ROWS', '200000'))
 
-@dataclass(frozen=True)
-class ModelPaths:
-  anomaly: str
-  cost: str
-  efficiency: str
 
+def _max_samples(value: Optional[str]) -> Union[str, int, float, None]:
+  """Parse a max_samples setting: 'auto', a row count or a fraction of the rows."""
+  if value is None or value == '':
+    return None
+  if value == 'auto':
+    return value
+  return float(value) if '.' in value else int(value)
 
-def _base_dir() -> str:
-  return os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Rows drawn per tree: IsolationForest's own setting ('auto' = 256) and the
+# RandomForest bootstrap size (unset = as many rows as it is fitted on).
+ANOMALY_MAX_SAMPLES = _max_samples(os.getenv('TRAIN_ANOMALY_MAX_SAMPLES', 'auto'))
+FOREST_MAX_SAMPLES = _max_samples(os.getenv('TRAIN_FOREST_MAX_SAMPLES', '0.5'))
 
 
 def get_model_paths() -> ModelPaths:
-  models_dir = os.path.join(_base_dir(), 'models')
-  return ModelPaths(
-    anomaly=os.path.join(models_dir, 'anomaly_model.pkl'),
-    cost=os.path.join(models_dir, 'cost_model.pkl'),
-    efficiency=os.path.join(models_dir, 'efficiency_model.pkl'),
-  )
+  """Artifact paths of the version the registry currently serves."""
+  return model_paths()
 
 
 def _models_exist(paths: ModelPaths) -> bool:
   return os.path.exists(paths.anomaly) and os.path.exists(paths.cost) and os.path.exists(paths.efficiency)
 
 
-def _load_training_dataframe() -> pd.DataFrame:
-  """Load full energy_records table into a DataFrame."""
-  query = 'SELECT * FROM energy_records'
-  df = pd.read_sql_query(query, con=engine)
-  return df
-
-
-def _numeric_dataframe(df: pd.DataFrame) -> pd.DataFrame:
-  num_df = df.select_dtypes(include='number').copy()
-  if num_df.empty:
-    raise RuntimeError('No numeric columns available for model training.')
-  num_df = num_df.fillna(0.0)
-  return num_df
-
-
-def _exclude_identifier_columns(columns) -> Tuple[str, ...]:
-  excluded = []
-  for col in columns:
-    lower = str(col).lower()
-    if lower == 'id' or lower.endswith('_id') or lower.endswith('id'):
-      excluded.append(col)
-  return tuple(excluded)
-
-
-def _feature_bundle(model, X: pd.DataFrame) -> Dict:
-  means = X.mean(numeric_only=True).fillna(0.0).to_dict()
+class TrainingData(NamedTuple):
+  """Feature matrix shared by all trainers, extracted once per training run."""
+
+  columns: List[str]
+  X: np.ndarray  # float32, missing values filled with 0
+  strata: np.ndarray  # machine/shift group code of every row
+  means: Dict[str, float]
+
+
+def _training_chunks(chunk_rows: int, after_id: int) -> Iterator[pd.DataFrame]:
+  """Typed feature, machine_id and shift columns of rows with an id above `after_id`.
+
+  Rows already in the Parquet mirror are streamed from it (only these columns are
+  decoded); the rest come from SQLite.
+  """
+  columns = list(FEATURE_COLUMNS) + ['machine_id', 'shift']
+  # Both sources split at this one id, so rows mirrored mid-scan are read from SQLite.
+  upto_id = mirror_watermark()
+  mirrored = scan_batches(columns, after_id=after_id, batch_rows=chunk_rows, upto_id=upto_id)
+  if mirrored is not None:
+    yield from mirrored
+    after_id = max(after_id, upto_id)
+  yield from iter_record_frames(columns, after_id=after_id, chunk_rows=chunk_rows)
+
+
+def _stratum_keys(chunk: pd.DataFrame) -> Tuple[np.ndarray, List[str]]:
+  """Per-row codes into a list of 'machine|shift' keys, built from the category codes."""
+  machine = chunk['machine_id'].astype('category')
+  shift = chunk['shift'].astype('category')
+  width = len(shift.cat.categories) + 1
+  # Code -1 (NULL) picks the trailing '' of the name arrays.
+  pairs = machine.cat.codes.to_numpy(np.int64) * width + shift.cat.codes.to_numpy(np.int64) + 1
+  codes, uniques = pd.factorize(pairs)
+  machine_names = np.append(machine.cat.categories.astype(str), '')
+  shift_names = np.append(shift.cat.categories.astype(str), '')
+  keys = [f'{machine_names[pair // width]}|{shift_names[pair % width - 1]}' for pair in uniques]
+  return codes, keys
+
+
+def _load_training_data(chunk_rows: int = TRAIN_CHUNK_ROWS, after_id: int = 0) -> TrainingData:
+  """Read the numeric feature columns of energy_records into one float32 matrix.
+
+  Only rows with an id above `after_id` are read (all rows by default). Chunks arrive
+  already float32 with categorical machine/shift columns and are appended to the
+  matrix as they come, so peak memory stays close to the final matrix.
+  """
+  blocks: List[np.ndarray] = []
+  strata: List[np.ndarray] = []
+  groups: Dict[str, int] = {}
+  for chunk in _training_chunks(chunk_rows, after_id):
+    blocks.append(chunk[list(FEATURE_COLUMNS)].to_numpy(dtype=np.float32, na_value=np.nan))
+    codes, keys = _stratum_keys(chunk)
+    lookup = np.array([groups.setdefault(key, len(groups)) for key in keys], dtype=np.int32)
+    strata.append(lookup[codes])
+    # Drop the frame before the next chunk is read.
+    del chunk
+
+  if not blocks:
+    raise RuntimeError('No records found in energy_records table; cannot train ML models.')
+  X = np.concatenate(blocks)
+  del blocks
+
+  # Columns without a single value carry nothing to learn from.
+  present = ~np.isnan(X).all(axis=0)
+  columns = [c for c, keep in zip(FEATURE_COLUMNS, present) if keep]
+  if not present.all():
+    X = X[:, present]
+  np.nan_to_num(X, copy=False, nan=0.0)
+  means = {c: float(m) for c, m in zip(columns, X.mean(axis=0, dtype=np.float64))}
+  return TrainingData(columns=columns, X=X, strata=np.concatenate(strata), means=means)
+
+
+def stratified_sample(strata: np.ndarray, size: int, seed: int = 42) -> np.ndarray:
+  """Sorted row indices of a ~`size`-row sample keeping every stratum's share of rows.
+
+  Every non-empty stratum keeps at least one row. Returns all rows when `size` is 0 or
+  not smaller than the number of rows.
+  """
+  n = len(strata)
+  if size <= 0 or size >= n:
+    return np.arange(n)
+  rng = np.random.default_rng(seed)
+  counts = np.bincount(strata)
+  quota = np.maximum(np.round(counts * (size / n)), np.minimum(counts, 1)).astype(np.int64)
+  # Shuffle within strata, then keep the first `quota` rows of each.
+  order = np.lexsort((rng.random(n), strata))
+  sorted_strata = strata[order]
+  starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+  rank = np.arange(n) - starts[sorted_strata]
+  return np.sort(order[rank < quota[sorted_strata]])
+
+
+def _column(data: TrainingData, name: str, rows: Optional[np.ndarray] = None) -> Optional[np.ndarray]:
+  if name not in data.columns:
+    return None
+  values = data.X[:, data.columns.index(name)]
+  return (values if rows is None else values[rows]).astype(np.float64)
+
+
+def _feature_bundle(model, data: TrainingData) -> Dict:
+  # Fill values for missing inputs: the store's means over non-null readings, falling
+  # back to the training matrix for anything the store does not cover.
+  means = dict(data.means)
+  means.update(training_feature_means(data.columns))
   return {
     'model': model,
-    'features': list(X.columns),
+    'features': list(data.columns),
     'feature_means': means,
   }
 
 
-def train_anomaly_model(df: pd.DataFrame) -> Dict:
-  num_df = _numeric_dataframe(df)
-  id_like = _exclude_identifier_columns(num_df.columns)
-  feature_cols = [c for c in num_df.columns if c not in id_like]
-  X = num_df[feature_cols]
-
+def train_anomaly_model(data: TrainingData, max_rows: int = TRAIN_ANOMALY_MAX_ROWS) -> Dict:
+  rows = stratified_sample(data.strata, max_rows)
   model = IsolationForest(
     n_estimators=250,
+    max_samples=ANOMALY_MAX_SAMPLES or 'auto',
     contamination='auto',
     random_state=42,
+    n_jobs=-1,
   )
-  model.fit(X.to_numpy(dtype=float))
-  return _feature_bundle(model, X)
+  model.fit(data.X[rows])
+  return _feature_bundle(model, data)
+
+
+def train_window_anomaly_model(window_rows: int) -> Dict:
+  """IsolationForest fitted on the newest `window_rows` readings only.
+
+  Refitting on a recent window keeps the cost independent of the history size; the
+  bundle records the id range it was fitted on.
+  """
+  with engine.connect() as conn:
+    after_id = conn.execute(
+      text('SELECT COALESCE((SELECT id FROM energy_records ORDER BY id DESC LIMIT 1 OFFSET :window), 0)'),
+      {'window': max(int(window_rows), 1)},
+    ).scalar()
+  data = _load_training_data(after_id=int(after_id))
+  bundle = train_anomaly_model(data, max_rows=0)
+  bundle['window'] = {'after_id': int(after_id), 'rows': len(data.X)}
+  return bundle
+
 
+def _cost_target(data: TrainingData) -> np.ndarray:
+  energy, tariff = _column(data, 'energy_kwh'), _column(data, 'electricity_tariff')
+  if energy is None or tariff is None:
+    raise RuntimeError('Cannot compute energy_cost – ensure both energy_kwh and electricity_tariff exist.')
+  return energy * tariff
 
-def train_cost_model(df: pd.DataFrame) -> Dict:
-  df_num = _numeric_dataframe(df)
 
-  if 'energy_cost' in df_num.columns:
-    df_num['energy_cost'] = df_num['energy_cost'].astype(float)
-  elif {'energy_kwh', 'electricity_tariff'}.issubset(df_num.columns):
-    df_num['energy_cost'] = (df_num['energy_kwh'] * df_num['electricity_tariff']).astype(float)
-  else:
-    raise RuntimeError(
-      'Cannot compute energy_cost – ensure either energy_cost column exists or both energy_kwh and electricity_tariff.',
-    )
+def _efficiency_target(data: TrainingData, rows: np.ndarray) -> np.ndarray:
+  production, energy = _column(data, 'production_output', rows), _column(data, 'energy_kwh', rows)
+  if production is None or energy is None:
+    raise RuntimeError('Cannot compute efficiency – ensure both production_output and energy_kwh exist.')
+  # Zero energy gives an efficiency of 0 rather than inf.
+  with np.errstate(divide='ignore', invalid='ignore'):
+    eff = production / np.where(energy == 0, np.nan, energy)
+  return np.nan_to_num(eff, nan=0.0, posinf=0.0, neginf=0.0)
 
-  target = 'energy_cost'
-  id_like = set(_exclude_identifier_columns(df_num.columns))
-  feature_cols = [c for c in df_num.columns if c not in id_like and c != target]
-  X = df_num[feature_cols]
-  y = df_num[target].to_numpy(dtype=float)
 
+def train_cost_model(data: TrainingData) -> Dict:
   model = LinearRegression()
-  model.fit(X.to_numpy(dtype=float), y)
-  return _feature_bundle(model, X)
-
-
-def train_efficiency_model(df: pd.DataFrame) -> Dict:
-  df_num = _numeric_dataframe(df)
-
-  if 'efficiency' in df_num.columns:
-    df_num['efficiency'] = df_num['efficiency'].astype(float)
-  elif {'production_output', 'energy_kwh'}.issubset(df_num.columns):
-    # Avoid division by zero.
-    energy = df_num['energy_kwh'].replace(0, np.nan)
-    eff = (df_num['production_output'] / energy).replace([np.inf, -np.inf], np.nan)
-    eff = eff.fillna(0.0)
-    df_num['efficiency'] = eff.astype(float)
-  else:
-    raise RuntimeError(
-      'Cannot compute efficiency – ensure either efficiency column exists or both production_output and energy_kwh.',
-    )
-
-  target = 'efficiency'
-  id_like = set(_exclude_identifier_columns(df_num.columns))
-  feature_cols = [c for c in df_num.columns if c not in id_like and c != target]
-  X = df_num[feature_cols]
-  y = df_num[target].to_numpy(dtype=float)
+  model.fit(data.X.astype(np.float64), _cost_target(data))
+  return _feature_bundle(model, data)
 
+
+def train_efficiency_model(data: TrainingData, max_rows: int = TRAIN_FOREST_MAX_ROWS) -> Dict:
+  rows = stratified_sample(data.strata, max_rows)
   model = RandomForestRegressor(
     n_estimators=250,
+    max_samples=FOREST_MAX_SAMPLES,
     random_state=42,
     n_jobs=-1,
   )
-  model.fit(X.to_numpy(dtype=float), y)
-  return _feature_bundle(model, X)
+  model.fit(data.X[rows], _efficiency_target(data, rows))
+  return _feature_bundle(model, data)
 
 
-def train_all_models() -> Tuple[Dict, Dict, Dict]:
-  df = _load_training_dataframe()
-  if df.empty:
-    raise RuntimeError('No records found in energy_records table; cannot train ML models.')
+def _memory_report(data: TrainingData) -> Dict[str, Optional[float]]:
+  """Size of the training matrix and the process's peak resident memory, in MB."""
+  peak = peak_rss_bytes()
+  return {
+    'matrix_mb': round((data.X.nbytes + data.strata.nbytes) / 2**20, 1),
+    'peak_rss_mb': round(peak / 2**20, 1) if peak is not None else None,
+  }
+
+
+ProgressCallback = Callable[[str, float], None]
+
+
+def _no_progress(stage: str, fraction: float) -> None:
+  pass
+
+
+class TrainedModels(NamedTuple):
+  anomaly: Dict
+  cost: Dict
+  efficiency: Dict
+  rows: int
+  timings: Dict[str, float]
+  memory: Dict[str, Optional[float]]
+
+
+_TRAINERS = (
+  ('anomaly', train_anomaly_model),
+  ('cost', train_cost_model),
+  ('efficiency', train_efficiency_model),
+)
+
+
+def train_all_models(progress: ProgressCallback = _no_progress) -> TrainedModels:
+  """Extract the features once, then fit the three models concurrently.
+
+  The fits run on threads: the tree builders release the GIL, and IsolationForest and
+  RandomForest spread their trees over all cores themselves. `timings` holds the wall
+  time of every stage in seconds.
+  """
+  timings: Dict[str, float] = {}
+  started = time.perf_counter()
+  progress('loading training data', 0.0)
+  refresh_feature_stats()
+  timings['feature_stats'] = time.perf_counter() - started
+
+  started = time.perf_counter()
+  data = _load_training_data()
+  timings['load'] = time.perf_counter() - started
+
+  def fit(name: str, trainer) -> Dict:
+    fit_started = time.perf_counter()
+    bundle = trainer(data)
+    timings[f'fit_{name}'] = time.perf_counter() - fit_started
+    return bundle
+
+  progress('training models', 0.2)
+  started = time.perf_counter()
+  bundles: Dict[str, Dict] = {}
+  with ThreadPoolExecutor(max_workers=len(_TRAINERS), thread_name_prefix='train') as pool:
+    futures = {pool.submit(fit, name, trainer): name for name, trainer in _TRAINERS}
+    for done, future in enumerate(as_completed(futures), start=1):
+      name = futures[future]
+      bundles[name] = future.result()
+      progress(f'trained {name} model', 0.2 + 0.7 * done / len(_TRAINERS))
+  timings['fit'] = time.perf_counter() - started
+
+  timings = {stage: round(seconds, 3) for stage, seconds in timings.items()}
+  memory = _memory_report(data)
+  logger.info('Trained models on %d rows; stage timings (s): %s; memory (MB): %s', len(data.X), timings, memory)
+  return TrainedModels(
+    anomaly=bundles['anomaly'],
+    cost=bundles['cost'],
+    efficiency=bundles['efficiency'],
+    rows=len(data.X),
+    timings=timings,
+    memory=memory,
+  )
 
-  anomaly_bundle = train_anomaly_model(df)
-  cost_bundle = train_cost_model(df)
-  efficiency_bundle = train_efficiency_model(df)
-  return anomaly_bundle, cost_bundle, efficiency_bundle
 
+def train_and_publish(progress: ProgressCallback = _no_progress) -> str:
+  """Train all models and publish them as a new registry version; returns the version.
+
+  The bundles are written to a fresh models/versions/<version>/ directory and only then
+  is CURRENT switched to it, so serving workers never see a half-written version.
+  """
+  trained = train_all_models(progress)
+
+  progress('saving artifacts', 0.9)
+  started = time.perf_counter()
+  version = new_version()
+  models_dir = version_dir(version)
+  os.makedirs(models_dir, exist_ok=True)
+  paths = model_paths(version)
+  entries = {
+    'anomaly': save_bundle(trained.anomaly, paths.anomaly),
+    'cost': save_bundle(trained.cost, paths.cost),
+    'efficiency': save_bundle(trained.efficiency, paths.efficiency),
+  }
+  timings = {**trained.timings, 'save': round(time.perf_counter() - started, 3)}
+  write_manifest(
+    models_dir,
+    entries,
+    training={'rows': trained.rows, 'timings': timings, 'memory': trained.memory},
+  )
+  publish_version(version)
+  prune_versions()
+  progress('published', 1.0)
+  return version
+
+
+def models_available() -> bool:
+  return _models_exist(get_model_paths())
 
-def ensure_models_trained(force: bool = False) -> None:
-  paths = get_model_paths()
-  os.makedirs(os.path.dirname(paths.anomaly), exist_ok=True)
 
-  if not force and _models_exist(paths):
+def ensure_models_trained(force: bool = False) -> Optional[str]:
+  """Train and publish a new registry version when none exists (or when `force`).
+
+  Returns the published version, or None when nothing was trained.
+  """
+  if not force and models_available():
     logger.info('ML models already exist; skipping training.')
-    return
+    return None
 
   logger.info('Training ML models from CSV dataset...')
   print('Training ML models from CSV dataset...')
   try:
-    anomaly_bundle, cost_bundle, efficiency_bundle = train_all_models()
+    version = train_and_publish()
   except Exception as exc:  # noqa: BLE001
     # If the dataset isn't loaded yet, we don't want to block app startup.
     logger.warning('Skipping ML training (no data available yet): %s', exc)
-    return
-
-  joblib.dump(anomaly_bundle, paths.anomaly)
-  joblib.dump(cost_bundle, paths.cost)
-  joblib.dump(efficiency_bundle, paths.efficiency)
+    return None
 
   print('ML models trained successfully')
-  logger.info('ML models trained successfully and saved to %s', os.path.dirname(paths.anomaly))
-
+  logger.info('ML models trained successfully and published as version %s', version)
+  return version
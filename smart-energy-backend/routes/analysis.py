@@ -1,31 +1,96 @@
-from fastapi import APIRouter, Depends
+from itertools import product
+from typing import List, Literal, Optional, Tuple
+
+from fastapi import APIRouter, Depends, HTTPException, Query
 from pydantic import BaseModel, Field
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from database.db import get_db
-from services.groq_service import generate_recommendation
-from services.ml_service import run_full_analysis
+from database.db import get_async_db
+from services.groq_service import generate_recommendation_async
+from services.ml_service import BatchTooLarge, run_batch_analysis_async, run_full_analysis_async
+from services.recommendation_jobs import start_recommendation_job
 
 router = APIRouter(prefix='/api', tags=['analysis'])
 
+# Upper bound on machines x scenarios evaluated by one batch request.
+MAX_BATCH_CELLS = 50_000
+
+Window = Optional[Literal['24h', '7d', '30d']]
+
 
 class MachineAnalysisRequest(BaseModel):
   machine_id: str = Field(..., description='Identifier of the machine to analyze.')
   on_time_hours: float = Field(..., ge=0, description='Planned on time in hours.')
   off_time_hours: float = Field(..., ge=0, description='Planned off time in hours.')
+  window: Window = Field(
+    None,
+    description='Average only the most recent readings (relative to the newest one); default all-time.',
+  )
+
+
+class Scenario(BaseModel):
+  on_time_hours: float = Field(..., ge=0, description='Planned on time in hours.')
+  off_time_hours: float = Field(..., ge=0, description='Planned off time in hours.')
+
+
+class BatchAnalysisRequest(BaseModel):
+  machine_ids: Optional[List[str]] = Field(
+    None,
+    description='Machines to analyze; every machine with readings when omitted.',
+  )
+  scenarios: List[Scenario] = Field(default_factory=list, description='Explicit on/off-hour pairs.')
+  on_time_hours: List[float] = Field(
+    default_factory=list,
+    description='Grid axis: every value is combined with every off_time_hours value.',
+  )
+  off_time_hours: List[float] = Field(default_factory=list, description='Grid axis, see on_time_hours.')
+  window: Window = Field(None, description='Averaging window, as for /api/analyze.')
+  optimize: bool = Field(
+    False,
+    description='Also return each machine\'s scenario with the lowest energy_cost (estimated energy x tariff).',
+  )
+  min_on_time_hours: float = Field(
+    0.0,
+    ge=0,
+    description='With optimize, only scenarios running at least this long are candidates.',
+  )
+
+  def scenario_pairs(self) -> List[Tuple[float, float]]:
+    """Explicit scenarios followed by the on x off grid, without duplicates."""
+    pairs = [(s.on_time_hours, s.off_time_hours) for s in self.scenarios]
+    pairs += list(product(self.on_time_hours, self.off_time_hours))
+    return list(dict.fromkeys(pairs))
 
 
 @router.post('/analyze')
-def analyze_machine(payload: MachineAnalysisRequest, db: Session = Depends(get_db)):
-  """Run ML-powered analysis and return Groq recommendations."""
-  prediction = run_full_analysis(
+async def analyze_machine(
+  payload: MachineAnalysisRequest,
+  wait_for_recommendation: bool = Query(
+    False,
+    description='Block until the Groq recommendation is ready instead of returning a job id.',
+  ),
+  db: AsyncSession = Depends(get_async_db),
+):
+  """Run ML-powered analysis; the Groq recommendation is generated in the background.
+
+  `ai_recommendation` is filled in right away when it is cached, otherwise it is null and
+  the text is served by /api/recommendations/{recommendation_job_id} (poll or `/stream`).
+  """
+  prediction = await run_full_analysis_async(
     machine_id=payload.machine_id,
     on_time_hours=payload.on_time_hours,
     off_time_hours=payload.off_time_hours,
     db=db,
+    window=payload.window,
   )
 
-  ai_text = generate_recommendation(prediction)
+  job_id = None
+  if wait_for_recommendation:
+    ai_text = await generate_recommendation_async(prediction)
+  else:
+    job = start_recommendation_job(prediction)
+    job_id = job.id
+    ai_text = job.text if job.done else None
 
   return {
     'machine_id': prediction['machine_id'],
@@ -35,5 +100,64 @@ def analyze_machine(payload: MachineAnalysisRequest, db: Session = Depends(get_d
     'efficiency_score': prediction['efficiency_score'],
     'energy_wasted': prediction['energy_wasted'],
     'ai_recommendation': ai_text,
+    'recommendation_job_id': job_id,
+    'model_version': prediction.get('model_version'),
   }
 
+
+def _cheapest_schedules(scenarios: List[Tuple[float, float]], cells: List[List[dict]], min_on_time_hours: float):
+  """Lowest energy_cost eligible scenario of each machine (None if none qualifies); ties go to higher efficiency.
+
+  Ranked on energy_cost rather than predicted_cost: the cost model is not trained on
+  on_time_hours, so its prediction is the same for every scenario of a machine.
+  """
+  eligible = [i for i, (on, _) in enumerate(scenarios) if on >= min_on_time_hours]
+  schedules = []
+  for row in cells:
+    if not eligible:
+      schedules.append(None)
+      continue
+    best = min(eligible, key=lambda i: (row[i]['energy_cost'], -row[i]['efficiency_score'], row[i]['energy_wasted']))
+    on, off = scenarios[best]
+    schedules.append({'scenario_index': best, 'on_time_hours': on, 'off_time_hours': off, **row[best]})
+  return schedules
+
+
+@router.post('/analyze/batch')
+async def analyze_batch(payload: BatchAnalysisRequest, db: AsyncSession = Depends(get_async_db)):
+  """What-if analysis of many machines x on/off-hour scenarios in one call.
+
+  Machine averages come from one grouped rollup query and each model runs once over
+  the whole grid. `results[i][j]` is machine `machines[i]` under `scenarios[j]`. No AI
+  recommendation is generated; use /api/analyze for a chosen scenario.
+  """
+  scenarios = payload.scenario_pairs()
+  if not scenarios:
+    raise HTTPException(status_code=400, detail='Provide scenarios and/or both on_time_hours and off_time_hours.')
+  if any(on < 0 or off < 0 for on, off in scenarios):
+    raise HTTPException(status_code=400, detail='Scenario hours must not be negative.')
+  if payload.machine_ids is not None and not payload.machine_ids:
+    raise HTTPException(status_code=400, detail='machine_ids must not be empty; omit it for all machines.')
+  too_large = f'At most {MAX_BATCH_CELLS} machine x scenario combinations per request.'
+  # Explicit ids are checked up front; "all machines" is counted from the rollups
+  # by run_batch_analysis_async before any model runs.
+  if payload.machine_ids is not None and len(set(payload.machine_ids)) * len(scenarios) > MAX_BATCH_CELLS:
+    raise HTTPException(status_code=413, detail=too_large)
+
+  try:
+    grid = await run_batch_analysis_async(
+      db, payload.machine_ids, scenarios, window=payload.window, max_cells=MAX_BATCH_CELLS,
+    )
+  except BatchTooLarge as exc:
+    raise HTTPException(status_code=413, detail=too_large) from exc
+  response = {
+    'machines': grid['machines'],
+    'scenarios': [{'on_time_hours': on, 'off_time_hours': off} for on, off in scenarios],
+    'results': grid['cells'],
+    'fallback_machines': grid['fallback_machines'],
+    'model_version': grid['model_version'],
+  }
+  if payload.optimize:
+    schedules = _cheapest_schedules(scenarios, grid['cells'], payload.min_on_time_hours)
+    response['schedules'] = {m['machine_id']: s for m, s in zip(grid['machines'], schedules)}
+  return response
@@ -0,0 +1,34 @@
+from typing import Optional
+
+from fastapi import APIRouter, Query
+
+from services.anomaly_service import online_anomaly_status, recent_online_anomalies, refit_window_model
+from services.executor import submit_to_ml_executor
+
+router = APIRouter(prefix='/api/anomalies', tags=['anomalies'])
+
+
+@router.get('/live')
+def read_live_anomalies(
+  machine_id: Optional[str] = Query(None, description='Only readings of this machine.'),
+  limit: int = Query(100, ge=1, le=1000),
+  flagged_only: bool = Query(True, description='Only readings flagged as anomalous.'),
+):
+  """Newest readings scored by the online baselines and the window forest."""
+  return {
+    'machine_id': machine_id,
+    'readings': recent_online_anomalies(machine_id, limit=limit, flagged_only=flagged_only),
+  }
+
+
+@router.get('/baselines')
+def read_baselines():
+  """Per-machine EWMA baselines and the range the window forest was fitted on."""
+  return online_anomaly_status()
+
+
+@router.post('/refit', status_code=202)
+def refit_anomaly_window():
+  """Refit the window forest on recent readings in the background."""
+  submit_to_ml_executor(refit_window_model)
+  return {'status': 'queued'}
@@ -1,18 +1,18 @@
 from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from database.db import get_db
-from services.energy_service import get_dashboard_stats
-from services.ml_service import get_dashboard_ml_insights
+from database.db import get_async_db
+from services.energy_service import get_dashboard_stats_async
+from services.ml_service import get_dashboard_ml_insights_async
 
 router = APIRouter(prefix='/api', tags=['dashboard'])
 
 
 @router.get('/dashboard')
-def read_dashboard(db: Session = Depends(get_db)):
+async def read_dashboard(db: AsyncSession = Depends(get_async_db)):
   """Return aggregated dashboard statistics for the frontend."""
-  stats = get_dashboard_stats(db)
-  ml = get_dashboard_ml_insights()
+  stats = await get_dashboard_stats_async(db)
+  ml = await get_dashboard_ml_insights_async(db)
 
   # Requirement: average_efficiency and anomaly_count should be model-based.
   stats['average_efficiency_true'] = stats.get('average_efficiency', 0.0)
@@ -22,4 +22,3 @@ def read_dashboard(db: Session = Depends(get_db)):
   stats['anomaly_count'] = int(ml.get('anomaly_count', 0))
 
   return stats
-
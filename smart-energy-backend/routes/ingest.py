@@ -0,0 +1,62 @@
+import os
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException
+from pydantic import BaseModel, Field
+
+from database.csv_to_db import get_dataset_dir, ingest_csv
+from database.parquet_mirror import sync_parquet_mirror
+from ml.feature_stats import refresh_feature_stats
+from services.anomaly_service import refresh_online_anomalies
+from services.executor import submit_to_ml_executor
+from services.rollup_service import refresh_machine_rollups
+from services.scoring_service import score_pending_records
+
+router = APIRouter(prefix='/api', tags=['ingest'])
+
+
+class IngestRequest(BaseModel):
+  filename: Optional[str] = Field(
+    None,
+    description='CSV file inside the dataset folder (default: energy_dataset.csv).',
+  )
+
+
+def _resolve_dataset_file(filename: Optional[str]) -> Optional[str]:
+  if not filename:
+    return None
+  dataset_dir = os.path.realpath(get_dataset_dir())
+  path = os.path.realpath(os.path.join(dataset_dir, filename))
+  if os.path.dirname(path) != dataset_dir or not path.lower().endswith('.csv'):
+    raise HTTPException(status_code=400, detail='filename must be a .csv file inside the dataset folder.')
+  if not os.path.exists(path):
+    raise HTTPException(status_code=404, detail=f'Dataset file not found: {filename}')
+  return path
+
+
+def _refresh_after_ingest() -> None:
+  """Bring the derived stores and the model scores up to the newly ingested rows."""
+  refresh_feature_stats()
+  refresh_machine_rollups()
+  refresh_online_anomalies()
+  sync_parquet_mirror()
+  score_pending_records()
+
+
+@router.post('/ingest')
+def ingest_dataset(payload: Optional[IngestRequest] = None):
+  """Append new readings from a dataset CSV, using the stored per-source watermark.
+
+  Without a body (or a filename) the default dataset is ingested. Returns once the
+  rows are stored; stats, rollups, online anomalies, the Parquet mirror and model
+  scores catch up on the ML executor (`refresh_queued`).
+  """
+  summary = ingest_csv(_resolve_dataset_file(payload.filename if payload is not None else None))
+  if summary is None:
+    raise HTTPException(status_code=404, detail='Dataset file not found.')
+
+  summary['refresh_queued'] = bool(summary['rows_inserted'])
+  if summary['refresh_queued']:
+    submit_to_ml_executor(_refresh_after_ingest)
+  summary['source'] = os.path.basename(summary['source'])
+  return summary
@@ -0,0 +1,12 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from services.metrics import render_metrics
+
+router = APIRouter(tags=['metrics'])
+
+
+@router.get('/metrics', response_class=PlainTextResponse)
+def read_metrics():
+  """Request, span and cache metrics of this worker in Prometheus text format."""
+  return PlainTextResponse(render_metrics(), media_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,48 @@
+from fastapi import APIRouter, HTTPException
+
+from database.parquet_mirror import mirror_status
+from ml.artifacts import read_training_info
+from ml.predict import current_model_version, model_status, models_ready
+from ml.registry import list_versions, version_dir
+from services.training_jobs import get_training_job, list_training_jobs, start_training_job, training_in_progress
+
+router = APIRouter(prefix='/api/models', tags=['models'])
+
+
+@router.get('')
+def read_models():
+  """Model version in service, per-model load status and the versions on disk.
+
+  Plain def: the version listing and Parquet part sizes are filesystem reads, so this
+  runs in the threadpool, off the event loop.
+  """
+  version = current_model_version()
+  return {
+    'ready': models_ready(),
+    'model_version': version,
+    'training': read_training_info(version_dir(version)) if version else {},
+    'models': model_status(),
+    'versions': list_versions(),
+    'training_in_progress': training_in_progress(),
+    'parquet_mirror': mirror_status(),
+  }
+
+
+@router.post('/train', status_code=202)
+async def train_models():
+  """Start a background training run (or return the one already in progress)."""
+  return start_training_job()
+
+
+@router.get('/jobs')
+async def read_training_jobs():
+  return {'jobs': list_training_jobs()}
+
+
+@router.get('/jobs/{job_id}')
+async def read_training_job(job_id: str):
+  """Status, current stage and progress (0..1) of a training job."""
+  job = get_training_job(job_id)
+  if job is None:
+    raise HTTPException(status_code=404, detail=f'Training job not found: {job_id}')
+  return job
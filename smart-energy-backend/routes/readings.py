@@ -0,0 +1,101 @@
+from datetime import datetime, timezone
+from typing import List, Optional, Union
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError, field_validator
+
+from services.telemetry_service import QueueFull, enqueue_readings, telemetry_status
+
+router = APIRouter(prefix='/api/readings', tags=['readings'])
+
+# Largest batch one request may carry; bigger uploads belong in /api/ingest.
+MAX_READINGS_PER_REQUEST = 50_000
+
+
+class ReadingIn(BaseModel):
+  """One live meter reading, in the shape of an energy_records row."""
+
+  machine_id: str = Field(..., min_length=1)
+  timestamp: datetime
+  machine_model: Optional[str] = None
+  rated_capacity_kw: Optional[float] = None
+  contract_demand_kw: Optional[float] = None
+  shift: Optional[str] = None
+  operator_id: Optional[str] = None
+  power_kw: Optional[float] = None
+  energy_kwh: Optional[float] = None
+  load_percent: Optional[float] = None
+  power_factor: Optional[float] = None
+  temperature: Optional[float] = None
+  ambient_temperature: Optional[float] = None
+  production_output: Optional[float] = None
+  operating_status: Optional[str] = None
+  idle_flag: Optional[bool] = None
+  electricity_tariff: Optional[float] = None
+  maintenance_cost: Optional[float] = None
+  co2_emission: Optional[float] = None
+  true_anomaly_label: Optional[int] = None
+  downtime_minutes: Optional[float] = None
+
+  @field_validator('timestamp')
+  @classmethod
+  def _naive_utc(cls, value: datetime) -> datetime:
+    # Stored timestamps are naive, like the CSV ones; convert offsets to UTC first.
+    if value.tzinfo is not None:
+      value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+_readings_adapter = TypeAdapter(List[ReadingIn])
+
+
+def _accept(readings: List[ReadingIn]) -> JSONResponse:
+  if len(readings) > MAX_READINGS_PER_REQUEST:
+    raise HTTPException(
+      status_code=413,
+      detail=f'At most {MAX_READINGS_PER_REQUEST} readings per request.',
+    )
+  try:
+    pending = enqueue_readings([reading.model_dump() for reading in readings])
+  except QueueFull as exc:
+    return JSONResponse(
+      status_code=429,
+      content={'detail': str(exc)},
+      headers={'Retry-After': str(int(round(exc.retry_after)))},
+    )
+  return JSONResponse(status_code=202, content={'accepted': len(readings), 'pending': pending})
+
+
+@router.post('', status_code=202)
+async def post_readings(payload: Union[ReadingIn, List[ReadingIn]]):
+  """Queue one reading (or a JSON array of them) for the next micro-batch flush.
+
+  202 means the readings are buffered, not yet stored; 429 with Retry-After means the
+  buffer is full and nothing from the request was accepted.
+  """
+  return _accept(payload if isinstance(payload, list) else [payload])
+
+
+@router.post('/bulk', status_code=202)
+async def post_readings_ndjson(request: Request):
+  """Queue newline-delimited JSON readings (application/x-ndjson), one per line."""
+  lines = [line for line in (await request.body()).splitlines() if line.strip()]
+  if not lines:
+    raise HTTPException(status_code=400, detail='Request body contains no readings.')
+  try:
+    readings = _readings_adapter.validate_json(b'[' + b','.join(lines) + b']')
+  except ValidationError as exc:
+    # Item positions are 0-based positions among the non-empty lines.
+    errors = [
+      {'line': err['loc'][0] + 1 if err['loc'] else None, 'field': '.'.join(map(str, err['loc'][1:])), 'msg': err['msg']}
+      for err in exc.errors(include_url=False, include_input=False)[:20]
+    ]
+    raise HTTPException(status_code=422, detail=errors) from exc
+  return _accept(readings)
+
+
+@router.get('/status')
+async def read_ingest_status():
+  """Buffer depth and flush counters of the live ingest pipeline."""
+  return telemetry_status()
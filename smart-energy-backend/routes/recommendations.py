@@ -0,0 +1,38 @@
+import json
+
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
+
+from services.recommendation_jobs import RecommendationJob, get_recommendation_job
+
+router = APIRouter(prefix='/api', tags=['recommendations'])
+
+
+def _job_or_404(job_id: str) -> RecommendationJob:
+  job = get_recommendation_job(job_id)
+  if job is None:
+    raise HTTPException(status_code=404, detail=f'Recommendation job not found or expired: {job_id}')
+  return job
+
+
+@router.get('/recommendations/{job_id}')
+async def read_recommendation(job_id: str):
+  """Poll a recommendation job started by /api/analyze."""
+  return _job_or_404(job_id).as_dict()
+
+
+@router.get('/recommendations/{job_id}/stream')
+async def stream_recommendation(job_id: str):
+  """Server-Sent Events: one `chunk` event per streamed piece, then a final `done` event."""
+  job = _job_or_404(job_id)
+
+  async def events():
+    async for piece in job.follow():
+      yield f"event: chunk\ndata: {json.dumps({'text': piece})}\n\n"
+    yield f"event: done\ndata: {json.dumps(job.as_dict())}\n\n"
+
+  return StreamingResponse(
+    events(),
+    media_type='text/event-stream',
+    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+  )
@@ -0,0 +1,41 @@
+from datetime import datetime, timezone
+from typing import Literal, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.db import get_async_db
+from services.rollup_service import get_timeseries_async
+
+router = APIRouter(prefix='/api', tags=['timeseries'])
+
+
+def _naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+  # Rollup buckets are naive, like the stored readings; convert offsets to UTC first.
+  if value is not None and value.tzinfo is not None:
+    value = value.astimezone(timezone.utc).replace(tzinfo=None)
+  return value
+
+
+@router.get('/timeseries')
+async def read_timeseries(
+  machine_id: Optional[str] = Query(None, description='Machine to chart; all machines when omitted.'),
+  start: Optional[datetime] = Query(None, alias='from', description='First bucket to include (ISO 8601).'),
+  end: Optional[datetime] = Query(None, alias='to', description='Last bucket to include (ISO 8601).'),
+  bucket: Literal['hour', 'day'] = Query('hour'),
+  shift: Optional[str] = Query(None, description='Only readings from this shift.'),
+  db: AsyncSession = Depends(get_async_db),
+):
+  """Energy, cost, production, idle energy and CO2 per time bucket, from the rollups."""
+  start, end = _naive_utc(start), _naive_utc(end)
+  if start is not None and end is not None and start > end:
+    raise HTTPException(status_code=400, detail='`from` must not be after `to`.')
+
+  points = await get_timeseries_async(db, machine_id, start, end, bucket=bucket, shift=shift)
+  return {
+    'machine_id': machine_id,
+    'bucket': bucket,
+    'from': start.isoformat() if start else None,
+    'to': end.isoformat() if end else None,
+    'points': points,
+  }
@@ -0,0 +1,341 @@
+"""Online anomaly detection for streaming meter readings.
+
+Every machine keeps an EWMA baseline (level plus mean absolute deviation) of power_kw,
+temperature and power_factor. A new reading is scored against its machine's baseline
+and then folded into it, O(1) per reading, so flags on fresh readings cost the same
+however long the history is. Updates are winsorized at the flag threshold, so a burst
+of outliers cannot drag the baseline along with it.
+
+Next to the per-signal z-scores, an IsolationForest refitted every ONLINE_REFIT_EVERY
+readings on only the newest ONLINE_WINDOW_ROWS readings adds a multivariate score.
+"""
+import logging
+import math
+import os
+import threading
+from typing import Dict, List, Optional
+
+import joblib
+import numpy as np
+import pandas as pd
+from sqlalchemy import select, text
+
+from database.db import Base, engine
+from database.models import MachineBaseline, OnlineAnomalyScore, RollupWatermark
+from database.watermark import records_watermark
+from ml.artifacts import save_bundle
+from ml.feature_stats import FEATURE_COLUMNS, feature_medians
+from ml.predict import _build_feature_matrix, _compile_bundle
+from ml.registry import models_dir
+from ml.train_models import train_window_anomaly_model
+from services.executor import submit_to_ml_executor
+
+logger = logging.getLogger(__name__)
+
+BASELINE_SIGNALS = ('power_kw', 'temperature', 'power_factor')
+ONLINE_ALPHA = float(os.getenv('ONLINE_ANOMALY_ALPHA', '0.05'))
+ONLINE_Z_THRESHOLD = float(os.getenv('ONLINE_ANOMALY_Z', '4.0'))
+ONLINE_WARMUP = int(os.getenv('ONLINE_ANOMALY_WARMUP', '20'))
+# Window forest decision values below this flag a reading (IsolationForest's own cut is 0).
+ONLINE_WINDOW_THRESHOLD = float(os.getenv('ONLINE_WINDOW_THRESHOLD', '0'))
+ONLINE_WINDOW_ROWS = int(os.getenv('ONLINE_WINDOW_ROWS', '50000'))
+ONLINE_REFIT_EVERY = int(os.getenv('ONLINE_REFIT_EVERY', '10000'))
+ONLINE_BATCH_SIZE = 5000
+
+# Mean absolute deviation -> standard deviation for normally distributed readings.
+_MAD_TO_STD = math.sqrt(math.pi / 2)
+_WATERMARK_NAME = 'online_anomaly'
+_WATERMARK_REFIT = 'online_anomaly_refit'
+_TABLES = (MachineBaseline.__table__, OnlineAnomalyScore.__table__, RollupWatermark.__table__)
+
+_lock = threading.Lock()
+_refit_lock = threading.Lock()
+# Guards the cached window model; refreshes (under _lock) and status reads both load it.
+_window_lock = threading.Lock()
+_schema_checked = False
+_window_bundle: Optional[Dict] = None
+_window_mtime: Optional[float] = None
+
+
+class _Baseline:
+  """EWMA level and mean absolute deviation of one signal of one machine."""
+
+  __slots__ = ('readings', 'mean', 'deviation')
+
+  def __init__(self, readings: int = 0, mean: float = 0.0, deviation: float = 0.0) -> None:
+    self.readings = readings
+    self.mean = mean
+    self.deviation = deviation
+
+  def update(self, value: float) -> Optional[float]:
+    """z-score of `value` against the baseline, then fold `value` into it.
+
+    Returns None for a missing value and 0.0 while the baseline is still warming up.
+    """
+    if value is None or math.isnan(value):
+      return None
+    if self.readings == 0:
+      self.readings, self.mean, self.deviation = 1, value, 0.0
+      return 0.0
+
+    z = 0.0
+    scale = self.deviation * _MAD_TO_STD
+    if self.readings >= ONLINE_WARMUP and scale > 0:
+      z = (value - self.mean) / scale
+      limit = ONLINE_Z_THRESHOLD * scale
+      value = min(max(value, self.mean - limit), self.mean + limit)
+
+    # Plain running averages while warming up, a fixed-rate EWMA afterwards.
+    self.readings += 1
+    delta = value - self.mean
+    self.mean += max(ONLINE_ALPHA, 1.0 / self.readings) * delta
+    self.deviation += max(ONLINE_ALPHA, 1.0 / (self.readings - 1)) * (abs(delta) - self.deviation)
+    return z
+
+
+def _ensure_schema() -> None:
+  global _schema_checked
+  if not _schema_checked:
+    Base.metadata.create_all(bind=engine, tables=list(_TABLES))
+    _schema_checked = True
+
+
+def _window_model_path() -> str:
+  return os.path.join(models_dir(), 'online', 'window_anomaly_model.pkl')
+
+
+def _window_model() -> Optional[Dict]:
+  """Latest refitted window forest, reloaded when another process replaced the file."""
+  global _window_bundle, _window_mtime
+  path = _window_model_path()
+  try:
+    mtime = os.path.getmtime(path)
+  except OSError:
+    return None
+  with _window_lock:
+    if mtime != _window_mtime:
+      try:
+        # Read fully rather than memory-mapped: the file is replaced in place by refits,
+        # and a mapping opened by name could pair a new file with an old pickle header.
+        _window_bundle = _compile_bundle(joblib.load(path))
+        _window_mtime = mtime
+      except Exception as exc:  # noqa: BLE001
+        logger.warning('Ignoring unreadable window anomaly model %s: %s', path, exc)
+    return _window_bundle
+
+
+def _read_watermark(conn, name: str):
+  mark = conn.execute(
+    select(RollupWatermark.last_id, RollupWatermark.rows).where(RollupWatermark.name == name),
+  ).first()
+  return (int(mark[0]), int(mark[1])) if mark else (0, 0)
+
+
+def _write_watermark(conn, name: str, last_id: int, rows: int) -> None:
+  conn.execute(text('DELETE FROM rollup_watermarks WHERE name = :name'), {'name': name})
+  conn.execute(RollupWatermark.__table__.insert().values(name=name, last_id=last_id, rows=rows))
+
+
+def _load_baselines(conn, machines: List[str]) -> Dict[str, List[_Baseline]]:
+  baselines = {machine: [_Baseline() for _ in BASELINE_SIGNALS] for machine in machines}
+  rows = conn.execute(
+    select(
+      MachineBaseline.machine_id,
+      MachineBaseline.signal,
+      MachineBaseline.readings,
+      MachineBaseline.mean,
+      MachineBaseline.deviation,
+    ).where(MachineBaseline.machine_id.in_(machines)),
+  )
+  for machine_id, signal, readings, mean, deviation in rows:
+    if signal in BASELINE_SIGNALS:
+      baselines[machine_id][BASELINE_SIGNALS.index(signal)] = _Baseline(int(readings), float(mean), float(deviation))
+  return baselines
+
+
+def _save_baselines(conn, baselines: Dict[str, List[_Baseline]]) -> None:
+  table = MachineBaseline.__table__
+  conn.execute(table.delete().where(table.c.machine_id.in_(list(baselines))))
+  conn.execute(
+    table.insert(),
+    [
+      {
+        'machine_id': machine_id,
+        'signal': signal,
+        'readings': state.readings,
+        'mean': state.mean,
+        'deviation': state.deviation,
+      }
+      for machine_id, states in baselines.items()
+      for signal, state in zip(BASELINE_SIGNALS, states)
+    ],
+  )
+
+
+def _score_batch(df: pd.DataFrame, baselines: Dict[str, List[_Baseline]], window: Optional[Dict]) -> List[Dict]:
+  machines = df['machine_id'].tolist()
+  values = df[list(BASELINE_SIGNALS)].to_numpy(dtype=float, na_value=np.nan).tolist()
+  z = np.full((len(df), len(BASELINE_SIGNALS)), np.nan)
+  # Readings must be folded in one by one, in id order, per machine.
+  for i, (machine, row) in enumerate(zip(machines, values)):
+    for j, (state, value) in enumerate(zip(baselines[machine], row)):
+      score = state.update(value)
+      if score is not None:
+        z[i, j] = score
+
+  abs_z = np.abs(z)
+  max_abs_z = np.max(np.nan_to_num(abs_z, nan=-1.0), axis=1)
+  max_abs_z[np.isnan(abs_z).all(axis=1)] = np.nan
+  baseline_anomaly = np.nan_to_num(max_abs_z, nan=0.0) > ONLINE_Z_THRESHOLD
+
+  window_score = np.full(len(df), np.nan)
+  if window is not None and window['feature_order']:
+    medians = {c: v for c, v in feature_medians().items() if c in window['feature_order']}
+    features = df.fillna(medians) if medians else df
+    window_score = np.asarray(window['model'].decision_function(_build_feature_matrix(window, features)), dtype=float)
+  # A reading is flagged when a signal leaves its machine's baseline, or when the window
+  # forest scores it as an outlier among recent readings.
+  is_anomaly = baseline_anomaly | (np.nan_to_num(window_score, nan=np.inf) < ONLINE_WINDOW_THRESHOLD)
+
+  def nullable(value: float) -> Optional[float]:
+    return None if np.isnan(value) else float(value)
+
+  return [
+    {
+      'record_id': int(record_id),
+      'machine_id': machine,
+      **{f'{signal}_z': nullable(z[i, j]) for j, signal in enumerate(BASELINE_SIGNALS)},
+      'max_abs_z': nullable(max_abs_z[i]),
+      'baseline_anomaly': bool(baseline_anomaly[i]),
+      'window_score': nullable(window_score[i]),
+      'is_anomaly': bool(is_anomaly[i]),
+    }
+    for i, (record_id, machine) in enumerate(zip(df['id'].tolist(), machines))
+  ]
+
+
+def refresh_online_anomalies(batch_size: int = ONLINE_BATCH_SIZE) -> int:
+  """Score readings added since the last refresh and fold them into their baselines.
+
+  Works from an id watermark like the rollups, one transaction per `batch_size`
+  readings; everything is recomputed when records were removed. Schedules a background
+  window refit once ONLINE_REFIT_EVERY readings arrived since the last one. Returns the
+  number of readings scored.
+  """
+  select_cols = ', '.join(dict.fromkeys(('id', 'machine_id') + BASELINE_SIGNALS + FEATURE_COLUMNS))
+  scored = 0
+  with _lock:
+    _ensure_schema()
+    window = _window_model()
+    with engine.begin() as conn:
+      rows, max_id = records_watermark(conn)
+      last_id, last_rows = _read_watermark(conn, _WATERMARK_NAME)
+      if max_id < last_id or rows < last_rows:
+        logger.warning('energy_records shrank since the last online scoring; rebuilding baselines.')
+        conn.execute(MachineBaseline.__table__.delete())
+        conn.execute(OnlineAnomalyScore.__table__.delete())
+        _write_watermark(conn, _WATERMARK_NAME, 0, 0)
+        _write_watermark(conn, _WATERMARK_REFIT, 0, 0)
+        last_rows = 0
+
+    while True:
+      with engine.begin() as conn:
+        last_id, seen = _read_watermark(conn, _WATERMARK_NAME)
+        df = pd.read_sql_query(
+          text(f'SELECT {select_cols} FROM energy_records WHERE id > :last_id ORDER BY id LIMIT :limit'),
+          con=conn,
+          params={'last_id': last_id, 'limit': int(batch_size)},
+        )
+        if df.empty:
+          break
+        df['machine_id'] = df['machine_id'].fillna('')
+        baselines = _load_baselines(conn, df['machine_id'].unique().tolist())
+        conn.execute(OnlineAnomalyScore.__table__.insert(), _score_batch(df, baselines, window))
+        _save_baselines(conn, baselines)
+        _write_watermark(conn, _WATERMARK_NAME, int(df['id'].iloc[-1]), seen + len(df))
+        scored += len(df)
+      if len(df) < batch_size:
+        break
+
+    with engine.connect() as conn:
+      refit_id, _ = _read_watermark(conn, _WATERMARK_REFIT)
+    # Ids only grow on insert, so the id gap counts the readings since the last refit.
+    pending = max_id - refit_id
+
+  if scored:
+    logger.info('Scored %d readings against the online baselines.', scored)
+  if pending >= ONLINE_REFIT_EVERY or (window is None and rows):
+    submit_to_ml_executor(refit_window_model)
+  return scored
+
+
+def refit_window_model(window_rows: int = ONLINE_WINDOW_ROWS) -> Optional[Dict]:
+  """Refit the window forest on the newest `window_rows` readings and swap it in.
+
+  Skipped when another refit is already running. Returns the window the model was
+  fitted on, or None when nothing was refitted.
+  """
+  if not _refit_lock.acquire(blocking=False):
+    return None
+  try:
+    _ensure_schema()
+    with engine.connect() as conn:
+      rows, max_id = records_watermark(conn)
+    if not rows:
+      return None
+    bundle = train_window_anomaly_model(window_rows)
+    path = _window_model_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    save_bundle(bundle, path)
+    with engine.begin() as conn:
+      _write_watermark(conn, _WATERMARK_REFIT, int(max_id), int(rows))
+    logger.info('Refitted the window anomaly model on %d recent readings.', bundle['window']['rows'])
+    return bundle['window']
+  except Exception as exc:  # noqa: BLE001
+    logger.warning('Window anomaly model refit failed: %s', exc)
+    return None
+  finally:
+    _refit_lock.release()
+
+
+def online_anomaly_status() -> Dict:
+  """Baselines of every machine plus the window model's fit range."""
+  _ensure_schema()
+  with engine.connect() as conn:
+    rows = conn.execute(
+      select(
+        MachineBaseline.machine_id,
+        MachineBaseline.signal,
+        MachineBaseline.readings,
+        MachineBaseline.mean,
+        MachineBaseline.deviation,
+      ).order_by(MachineBaseline.machine_id, MachineBaseline.signal),
+    ).all()
+    scored_upto, _ = _read_watermark(conn, _WATERMARK_NAME)
+  machines: Dict[str, Dict] = {}
+  for machine_id, signal, readings, mean, deviation in rows:
+    machines.setdefault(machine_id, {})[signal] = {
+      'readings': int(readings),
+      'mean': float(mean),
+      'std': float(deviation) * _MAD_TO_STD,
+    }
+  window = _window_model()
+  return {
+    'scored_upto_id': scored_upto,
+    'z_threshold': ONLINE_Z_THRESHOLD,
+    'window_model': window.get('window') if window is not None else None,
+    'machines': machines,
+  }
+
+
+def recent_online_anomalies(machine_id: Optional[str] = None, limit: int = 100, flagged_only: bool = True) -> List[Dict]:
+  """Newest online scores, optionally for one machine and/or only flagged readings."""
+  _ensure_schema()
+  table = OnlineAnomalyScore
+  stmt = select(table).order_by(table.record_id.desc()).limit(int(limit))
+  if machine_id is not None:
+    stmt = stmt.where(table.machine_id == machine_id)
+  if flagged_only:
+    stmt = stmt.where(table.is_anomaly.is_(True))
+  with engine.connect() as conn:
+    return [dict(row._mapping) for row in conn.execute(stmt)]
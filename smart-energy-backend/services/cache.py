@@ -0,0 +1,156 @@
+import asyncio
+import copy
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from services.metrics import count_cache
+
+MISS = object()
+
+
+class WatermarkCache:
+  """Memoize computed results until the data watermark they were built from moves.
+
+  Each entry remembers the watermark it was computed at; a lookup with a different
+  watermark recomputes and replaces the entry. Values are deep-copied on the way out
+  so callers can decorate the returned dicts without corrupting the cache. Lookups of a
+  named cache are counted in the cache_requests_total metric.
+  """
+
+  def __init__(self, name: Optional[str] = None) -> None:
+    self.name = name
+    self._lock = threading.Lock()
+    self._entries: Dict[Hashable, Tuple[Hashable, Any]] = {}
+
+  def lookup(self, key: Hashable, watermark: Hashable) -> Any:
+    """Return a copy of the entry for `key` if it is current, else `MISS`."""
+    with self._lock:
+      entry = self._entries.get(key)
+    hit = entry is not None and entry[0] == watermark
+    if self.name:
+      count_cache(self.name, hit)
+    return copy.deepcopy(entry[1]) if hit else MISS
+
+  def store(self, key: Hashable, watermark: Hashable, value: Any) -> Any:
+    with self._lock:
+      self._entries[key] = (watermark, value)
+    return copy.deepcopy(value)
+
+  def get_or_compute(self, key: Hashable, watermark: Hashable, compute: Callable[[], Any]) -> Any:
+    value = self.lookup(key, watermark)
+    if value is MISS:
+      value = self.store(key, watermark, compute())
+    return value
+
+  def invalidate(self, key: Hashable = None) -> None:
+    with self._lock:
+      if key is None:
+        self._entries.clear()
+      else:
+        self._entries.pop(key, None)
+
+
+class TTLCache:
+  """Thread-safe LRU cache whose entries also expire `ttl` seconds after insertion.
+
+  Lookups of a named cache are counted in the cache_requests_total metric.
+  """
+
+  def __init__(
+    self,
+    maxsize: int = 1024,
+    ttl: float = 3600.0,
+    clock: Callable[[], float] = time.monotonic,
+    name: Optional[str] = None,
+  ) -> None:
+    self.name = name
+    self.maxsize = maxsize
+    self.ttl = ttl
+    self._clock = clock
+    self._lock = threading.Lock()
+    self._entries: 'OrderedDict[Hashable, Tuple[float, Any]]' = OrderedDict()
+
+  def get(self, key: Hashable) -> Any:
+    """Return the live value for `key`, else `MISS`."""
+    value = self._get(key)
+    if self.name:
+      count_cache(self.name, value is not MISS)
+    return value
+
+  def _get(self, key: Hashable) -> Any:
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is None:
+        return MISS
+      expires_at, value = entry
+      if expires_at <= self._clock():
+        del self._entries[key]
+        return MISS
+      self._entries.move_to_end(key)
+      return value
+
+  def set(self, key: Hashable, value: Any) -> None:
+    with self._lock:
+      self._entries[key] = (self._clock() + self.ttl, value)
+      self._entries.move_to_end(key)
+      while len(self._entries) > self.maxsize:
+        self._entries.popitem(last=False)
+
+  def clear(self) -> None:
+    with self._lock:
+      self._entries.clear()
+
+  def __len__(self) -> int:
+    with self._lock:
+      return len(self._entries)
+
+
+class SingleFlight:
+  """Collapse concurrent calls for the same key into one underlying call.
+
+  The first caller for a key runs the work; callers arriving while it is in flight
+  wait for and share its result (or exception).
+  """
+
+  def __init__(self) -> None:
+    self._lock = threading.Lock()
+    self._calls: Dict[Hashable, Tuple[threading.Event, list]] = {}
+    self._tasks: Dict[Hashable, 'asyncio.Task'] = {}
+
+  def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+    with self._lock:
+      call = self._calls.get(key)
+      leader = call is None
+      if leader:
+        call = (threading.Event(), [])
+        self._calls[key] = call
+    done, outcome = call
+
+    if not leader:
+      done.wait()
+    else:
+      try:
+        outcome.append((True, fn()))
+      except BaseException as exc:  # noqa: BLE001
+        outcome.append((False, exc))
+      finally:
+        with self._lock:
+          self._calls.pop(key, None)
+        done.set()
+
+    ok, value = outcome[0]
+    if not ok:
+      raise value
+    return value
+
+  async def do_async(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+    task = self._tasks.get(key)
+    if task is None:
+      task = asyncio.ensure_future(fn())
+      self._tasks[key] = task
+      task.add_done_callback(lambda _t, k=key: self._tasks.pop(k, None))
+    # Shield so one waiter being cancelled (client disconnect) does not cancel the
+    # shared upstream call for everyone else.
+    return await asyncio.shield(task)
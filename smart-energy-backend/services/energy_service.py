@@ -1,73 +1,80 @@
 from typing import Dict, List
 
-from sqlalchemy import func
+from sqlalchemy import case, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 from database.models import EnergyRecord
+from database.watermark import records_watermark, records_watermark_async
+from services.cache import MISS, WatermarkCache
+from services.metrics import span
 
+_dashboard_cache = WatermarkCache('dashboard_stats')
 
-def get_dashboard_stats(db: Session) -> Dict:
-  total_energy = (
-    db.query(func.coalesce(func.sum(EnergyRecord.energy_kwh), 0.0)).scalar() or 0.0
-  )
-  total_cost = (
-    db.query(
-      func.coalesce(
-        func.sum(EnergyRecord.energy_kwh * EnergyRecord.electricity_tariff),
-        0.0,
-      ),
-    ).scalar()
-    or 0.0
-  )
 
+def _sort_key(value):
+  # SQLite orders NULL group keys first; keep that ordering for the distributions.
+  return (value is not None, value if value is not None else '')
+
+
+def _dashboard_stmt():
+  """One grouped scan of energy_records yielding every dashboard figure per (machine, shift)."""
   efficiency_expr = EnergyRecord.production_output / func.nullif(
     EnergyRecord.energy_kwh,
     0,
   )
-  average_efficiency = (
-    db.query(func.avg(efficiency_expr)).scalar()
-    if db.query(EnergyRecord.id).first()
-    else 0.0
-  ) or 0.0
-
-  total_anomalies = (
-    db.query(func.count())
-    .filter(EnergyRecord.true_anomaly_label == 1)
-    .scalar()
-    or 0
-  )
-
-  machine_rows: List = (
-    db.query(
-      EnergyRecord.machine_id,
-      func.coalesce(func.sum(EnergyRecord.energy_kwh), 0.0),
-    )
-    .group_by(EnergyRecord.machine_id)
-    .all()
-  )
-  shift_rows: List = (
-    db.query(
-      EnergyRecord.shift,
-      func.coalesce(func.sum(EnergyRecord.energy_kwh), 0.0),
-    )
-    .group_by(EnergyRecord.shift)
-    .all()
-  )
+  return select(
+    EnergyRecord.machine_id,
+    EnergyRecord.shift,
+    func.coalesce(func.sum(EnergyRecord.energy_kwh), 0.0),
+    func.coalesce(
+      func.sum(EnergyRecord.energy_kwh * EnergyRecord.electricity_tariff),
+      0.0,
+    ),
+    func.coalesce(func.sum(efficiency_expr), 0.0),
+    func.count(efficiency_expr),
+    func.coalesce(
+      func.sum(case((EnergyRecord.true_anomaly_label == 1, 1), else_=0)),
+      0,
+    ),
+  ).group_by(EnergyRecord.machine_id, EnergyRecord.shift)
+
+
+def _fold_dashboard_rows(rows: List) -> Dict:
+  total_energy = 0.0
+  total_cost = 0.0
+  efficiency_sum = 0.0
+  efficiency_count = 0
+  total_anomalies = 0
+  machine_totals: Dict = {}
+  shift_totals: Dict = {}
+
+  for machine_id, shift, energy, cost, eff_sum, eff_count, anomalies in rows:
+    energy = float(energy or 0.0)
+    total_energy += energy
+    total_cost += float(cost or 0.0)
+    efficiency_sum += float(eff_sum or 0.0)
+    efficiency_count += int(eff_count or 0)
+    total_anomalies += int(anomalies or 0)
+    machine_totals[machine_id] = machine_totals.get(machine_id, 0.0) + energy
+    shift_totals[shift] = shift_totals.get(shift, 0.0) + energy
+
+  average_efficiency = efficiency_sum / efficiency_count if efficiency_count else 0.0
 
   machine_energy_distribution = [
     {
       'machine_id': machine_id if machine_id is not None else 'Unknown',
-      'total_energy': float(total or 0.0),
+      'total_energy': float(machine_totals[machine_id]),
     }
-    for machine_id, total in machine_rows
+    for machine_id in sorted(machine_totals, key=_sort_key)
   ]
 
   shift_energy_distribution = [
     {
       'shift': shift if shift is not None else 'Unknown',
-      'total_energy': float(total or 0.0),
+      'total_energy': float(shift_totals[shift]),
     }
-    for shift, total in shift_rows
+    for shift in sorted(shift_totals, key=_sort_key)
   ]
 
   return {
@@ -80,6 +87,32 @@ def get_dashboard_stats(db: Session) -> Dict:
   }
 
 
+@span('dashboard.aggregate')
+def _aggregate_dashboard(db: Session) -> Dict:
+  return _fold_dashboard_rows(db.execute(_dashboard_stmt()).all())
+
+
+def get_dashboard_stats(db: Session) -> Dict:
+  """Return dashboard aggregates, recomputed only when energy_records changes."""
+  watermark = records_watermark(db)
+  return _dashboard_cache.get_or_compute(
+    'dashboard_stats',
+    watermark,
+    lambda: _aggregate_dashboard(db),
+  )
+
+
+async def get_dashboard_stats_async(db: AsyncSession) -> Dict:
+  """Async-session variant of `get_dashboard_stats`, sharing its cache."""
+  watermark = await records_watermark_async(db)
+  stats = _dashboard_cache.lookup('dashboard_stats', watermark)
+  if stats is MISS:
+    with span('dashboard.aggregate'):
+      stats = _fold_dashboard_rows((await db.execute(_dashboard_stmt())).all())
+    stats = _dashboard_cache.store('dashboard_stats', watermark, stats)
+  return stats
+
+
 def analyze_machine(
   db: Session,
   machine_id: str,
@@ -0,0 +1,31 @@
+import asyncio
+import contextvars
+import functools
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable
+
+# sklearn inference is CPU-bound and partly GIL-bound; a small dedicated pool keeps it
+# from starving the default threadpool that sync handlers and DB work rely on.
+ML_MAX_WORKERS = int(os.getenv('ML_MAX_WORKERS', str(min(4, os.cpu_count() or 1))))
+
+_ml_executor = ThreadPoolExecutor(max_workers=ML_MAX_WORKERS, thread_name_prefix='ml-inference')
+
+
+async def run_in_ml_executor(fn: Callable[..., Any], *args, **kwargs) -> Any:
+  """Run `fn(*args, **kwargs)` on the bounded ML pool and await its result.
+
+  The caller's context goes along, so spans inside `fn` count toward its request.
+  """
+  loop = asyncio.get_running_loop()
+  context = contextvars.copy_context()
+  return await loop.run_in_executor(_ml_executor, functools.partial(context.run, fn, *args, **kwargs))
+
+
+def submit_to_ml_executor(fn: Callable[..., Any], *args, **kwargs) -> Future:
+  """Fire-and-forget variant of `run_in_ml_executor` for background work."""
+  return _ml_executor.submit(fn, *args, **kwargs)
+
+
+def shutdown_ml_executor() -> None:
+  _ml_executor.shutdown(wait=False, cancel_futures=True)
@@ -1,28 +1,70 @@
+import asyncio
+import hashlib
+import json
+import logging
 import os
-from typing import Any, Dict
+import threading
+import time
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, Dict, List, Optional
 
 from dotenv import load_dotenv
+from sqlalchemy import delete, insert, select
+
+from database.db import AsyncSessionLocal, SessionLocal
+from database.models import RecommendationCacheEntry
+from services.cache import MISS, SingleFlight, TTLCache
+from services.metrics import span
 
 try:
   # The Groq SDK will be available after installing `groq` from requirements.txt.
-  from groq import Groq  # type: ignore[attr-defined]
+  from groq import AsyncGroq, Groq  # type: ignore[attr-defined]
 except Exception:  # noqa: BLE001
   Groq = None  # type: ignore[assignment]
+  AsyncGroq = None  # type: ignore[assignment]
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
 
-def generate_recommendation(prediction_data: Dict[str, Any]) -> str:
-  """Generate AI recommendation text using Groq.
+NOT_CONFIGURED_MESSAGE = 'Groq is not configured (missing GROQ_API_KEY).'
+UNAVAILABLE_MESSAGE = 'Groq recommendation service is currently unavailable.'
 
-  Expects GROQ_API_KEY in environment. If not configured, returns a safe fallback string.
+RECOMMENDATION_CACHE_TTL_SECONDS = float(os.getenv('RECOMMENDATION_CACHE_TTL_SECONDS', '3600'))
+RECOMMENDATION_CACHE_SIZE = int(os.getenv('RECOMMENDATION_CACHE_SIZE', '1024'))
+
+_recommendation_cache = TTLCache(
+  maxsize=RECOMMENDATION_CACHE_SIZE,
+  ttl=RECOMMENDATION_CACHE_TTL_SECONDS,
+  name='recommendations',
+)
+_single_flight = SingleFlight()
+
+
+def _normalized_prediction(prediction_data: Dict[str, Any]) -> Dict[str, Any]:
+  """Round the prompt inputs so near-identical analyses share one cached recommendation.
+
+  The advice does not change between an efficiency of 0.8312 and 0.8349, so the prompt
+  is built from these coarsened values and its fingerprint is the cache key.
   """
-  api_key = os.getenv('GROQ_API_KEY')
-  model_name = os.getenv('GROQ_MODEL', 'llama-3.1-8b-instant')
 
-  if Groq is None or not api_key:
-    return 'Groq is not configured (missing GROQ_API_KEY).'
+  def rounded(key: str, ndigits: int) -> Any:
+    value = prediction_data.get(key, 0)
+    try:
+      return round(float(value), ndigits)
+    except (TypeError, ValueError):
+      return value
+
+  return {
+    'machine_id': prediction_data.get('machine_id', 'Unknown'),
+    'anomaly_status': prediction_data.get('anomaly_status', 'Normal'),
+    'efficiency_score': rounded('efficiency_score', 2),
+    'energy_wasted': rounded('energy_wasted', 1),
+    'predicted_cost': rounded('predicted_cost', -1),
+  }
 
+
+def _build_messages(prediction_data: Dict[str, Any]) -> List[Dict[str, str]]:
   anomaly_status = prediction_data.get('anomaly_status', 'Normal')
   efficiency_score = prediction_data.get('efficiency_score', 0)
   energy_wasted = prediction_data.get('energy_wasted', 0)
@@ -38,23 +80,326 @@ def generate_recommendation(prediction_data: Dict[str, Any]) -> str:
     "Suggest practical steps to reduce energy consumption and improve efficiency in manufacturing machines. "
     "Provide a concise recommendation (3-6 bullet points) with actionable maintenance/operations suggestions."
   )
+  return [
+    {
+      'role': 'system',
+      'content': 'You are an industrial energy optimization assistant for manufacturing plants.',
+    },
+    {'role': 'user', 'content': prompt},
+  ]
 
-  try:
-    client = Groq(api_key=api_key)
-    response = client.chat.completions.create(
-      model=model_name,
-      messages=[
-        {
-          'role': 'system',
-          'content': 'You are an industrial energy optimization assistant for manufacturing plants.',
-        },
-        {'role': 'user', 'content': prompt},
-      ],
-      temperature=0.2,
-      max_tokens=220,
+
+def _completion_kwargs(prediction_data: Dict[str, Any]) -> Dict[str, Any]:
+  return {
+    'model': os.getenv('GROQ_MODEL', 'llama-3.1-8b-instant'),
+    'messages': _build_messages(_normalized_prediction(prediction_data)),
+    'temperature': 0.2,
+    'max_tokens': 220,
+  }
+
+
+def prompt_fingerprint(completion_kwargs: Dict[str, Any]) -> str:
+  """Stable cache key for one upstream completion request."""
+  payload = json.dumps(completion_kwargs, sort_keys=True, separators=(',', ':'))
+  return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _response_text(response) -> str:
+  content = response.choices[0].message.content
+  return (content or '').strip() or 'No recommendation generated.'
+
+
+# --- Clients -----------------------------------------------------------------------------
+
+
+class _FakeCompletions:
+  """Offline stand-in for `client.chat.completions`: deterministic text, optional latency."""
+
+  def __init__(self, latency_s: float, is_async: bool) -> None:
+    self.latency_s = latency_s
+    self.is_async = is_async
+    self.calls = 0
+
+  def _response(self, messages: List[Dict[str, str]]):
+    self.calls += 1
+    prompt = messages[-1]['content']
+    content = (
+      f"- Review operating schedule for: {prompt.split('.')[0]}\n"
+      '- Reduce idle running between batches.\n'
+      '- Check power factor correction and motor alignment.'
     )
-    content = response.choices[0].message.content
-    return (content or '').strip() or 'No recommendation generated.'
-  except Exception:
-    return 'Groq recommendation service is currently unavailable.'
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+  def _stream_chunks(self, messages: List[Dict[str, str]]) -> List[Any]:
+    content = self._response(messages).choices[0].message.content
+    return [
+      SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))])
+      for piece in content.splitlines(keepends=True)
+    ]
+
+  def create(self, messages: List[Dict[str, str]], stream: bool = False, **_kwargs):
+    if not self.is_async:
+      time.sleep(self.latency_s)
+      return iter(self._stream_chunks(messages)) if stream else self._response(messages)
+
+    async def run():
+      await asyncio.sleep(self.latency_s)
+      return self._response(messages)
+
+    async def run_stream():
+      chunks = self._stream_chunks(messages)
+      for chunk in chunks:
+        await asyncio.sleep(self.latency_s / len(chunks))
+        yield chunk
+
+    if stream:
+
+      async def opened():
+        return run_stream()
+
+      return opened()
+    return run()
+
+
+class FakeGroqClient:
+  """Client with the subset of the Groq SDK surface used here, for tests and benchmarks."""
+
+  def __init__(self, latency_s: float = 0.0, is_async: bool = False) -> None:
+    self.chat = SimpleNamespace(completions=_FakeCompletions(latency_s, is_async))
+
+
+_client_lock = threading.Lock()
+_clients: Dict[str, Any] = {}
+_fake_latency_s: Optional[float] = None
+
+
+def use_fake_client(latency_s: Optional[float] = 0.0) -> None:
+  """Route recommendations to `FakeGroqClient` (pass None to go back to Groq).
+
+  Also enabled with GROQ_USE_FAKE=1; GROQ_FAKE_LATENCY_MS sets the simulated latency.
+  """
+  global _fake_latency_s
+  with _client_lock:
+    _fake_latency_s = latency_s
+    _clients.clear()
+
+
+def _fake_latency() -> Optional[float]:
+  if _fake_latency_s is not None:
+    return _fake_latency_s
+  if os.getenv('GROQ_USE_FAKE', '').lower() in ('1', 'true', 'yes'):
+    return float(os.getenv('GROQ_FAKE_LATENCY_MS', '0')) / 1000.0
+  return None
+
+
+def _get_client(is_async: bool):
+  """Pooled client (one per flavour and API key) so HTTP connections are reused.
+
+  Returns None when Groq is not configured.
+  """
+  fake_latency = _fake_latency()
+  if fake_latency is not None:
+    key = f"fake:{'async' if is_async else 'sync'}"
+  else:
+    api_key = os.getenv('GROQ_API_KEY')
+    sdk = AsyncGroq if is_async else Groq
+    if sdk is None or not api_key:
+      return None
+    key = f"{'async' if is_async else 'sync'}:{api_key}"
+
+  client = _clients.get(key)
+  if client is None:
+    with _client_lock:
+      client = _clients.get(key)
+      if client is None:
+        if fake_latency is not None:
+          client = FakeGroqClient(latency_s=fake_latency, is_async=is_async)
+        else:
+          client = sdk(api_key=api_key)
+        _clients[key] = client
+  return client
+
+
+# --- Persistent cache --------------------------------------------------------------------
+
+
+def _persist_enabled() -> bool:
+  return os.getenv('RECOMMENDATION_CACHE_PERSIST', '').lower() in ('1', 'true', 'yes')
+
+
+def _persisted_stmt(fingerprint: str):
+  return select(RecommendationCacheEntry.text).where(
+    RecommendationCacheEntry.fingerprint == fingerprint,
+    RecommendationCacheEntry.expires_at > time.time(),
+  )
+
+
+def _persist_stmts(fingerprint: str, text_value: str):
+  expires_at = time.time() + RECOMMENDATION_CACHE_TTL_SECONDS
+  return (
+    delete(RecommendationCacheEntry).where(RecommendationCacheEntry.fingerprint == fingerprint),
+    insert(RecommendationCacheEntry).values(fingerprint=fingerprint, text=text_value, expires_at=expires_at),
+  )
+
+
+def _load_persisted(fingerprint: str) -> Optional[str]:
+  if not _persist_enabled():
+    return None
+  try:
+    with SessionLocal() as db:
+      return db.execute(_persisted_stmt(fingerprint)).scalar()
+  except Exception as exc:  # noqa: BLE001
+    logger.warning('Recommendation cache read failed: %s', exc)
+    return None
+
+
+def _store_persisted(fingerprint: str, text_value: str) -> None:
+  if not _persist_enabled():
+    return
+  try:
+    with SessionLocal() as db:
+      for stmt in _persist_stmts(fingerprint, text_value):
+        db.execute(stmt)
+      db.commit()
+  except Exception as exc:  # noqa: BLE001
+    logger.warning('Recommendation cache write failed: %s', exc)
+
+
+async def _load_persisted_async(fingerprint: str) -> Optional[str]:
+  if not _persist_enabled():
+    return None
+  try:
+    async with AsyncSessionLocal() as db:
+      return (await db.execute(_persisted_stmt(fingerprint))).scalar()
+  except Exception as exc:  # noqa: BLE001
+    logger.warning('Recommendation cache read failed: %s', exc)
+    return None
+
+
+async def _store_persisted_async(fingerprint: str, text_value: str) -> None:
+  if not _persist_enabled():
+    return
+  try:
+    async with AsyncSessionLocal() as db:
+      for stmt in _persist_stmts(fingerprint, text_value):
+        await db.execute(stmt)
+      await db.commit()
+  except Exception as exc:  # noqa: BLE001
+    logger.warning('Recommendation cache write failed: %s', exc)
+
+
+def clear_recommendation_cache() -> None:
+  """Drop in-memory cached recommendations (persisted rows simply expire)."""
+  _recommendation_cache.clear()
+
+
+# --- Public API --------------------------------------------------------------------------
+
+
+def generate_recommendation(prediction_data: Dict[str, Any]) -> str:
+  """Generate AI recommendation text using Groq.
+
+  Expects GROQ_API_KEY in environment. If not configured, returns a safe fallback string.
+  Successful completions are cached by prompt fingerprint; concurrent identical requests
+  share one upstream call.
+  """
+  client = _get_client(is_async=False)
+  if client is None:
+    return NOT_CONFIGURED_MESSAGE
+
+  kwargs = _completion_kwargs(prediction_data)
+  fingerprint = prompt_fingerprint(kwargs)
+  cached = _recommendation_cache.get(fingerprint)
+  if cached is not MISS:
+    return cached
+
+  def fetch() -> Optional[str]:
+    text_value = _load_persisted(fingerprint)
+    if text_value is None:
+      try:
+        with span('llm.completion'):
+          text_value = _response_text(client.chat.completions.create(**kwargs))
+      except Exception as exc:  # noqa: BLE001
+        logger.warning('Groq completion failed: %s', exc)
+        return None
+      _store_persisted(fingerprint, text_value)
+    _recommendation_cache.set(fingerprint, text_value)
+    return text_value
+
+  text_value = _single_flight.do(fingerprint, fetch)
+  return text_value if text_value is not None else UNAVAILABLE_MESSAGE
+
+
+async def generate_recommendation_async(prediction_data: Dict[str, Any]) -> str:
+  """Awaitable `generate_recommendation` using the pooled async Groq client."""
+  client = _get_client(is_async=True)
+  if client is None:
+    return NOT_CONFIGURED_MESSAGE
+
+  kwargs = _completion_kwargs(prediction_data)
+  fingerprint = prompt_fingerprint(kwargs)
+  cached = _recommendation_cache.get(fingerprint)
+  if cached is not MISS:
+    return cached
+
+  async def fetch() -> Optional[str]:
+    text_value = await _load_persisted_async(fingerprint)
+    if text_value is None:
+      try:
+        with span('llm.completion'):
+          text_value = _response_text(await client.chat.completions.create(**kwargs))
+      except Exception as exc:  # noqa: BLE001
+        logger.warning('Groq completion failed: %s', exc)
+        return None
+      await _store_persisted_async(fingerprint, text_value)
+    _recommendation_cache.set(fingerprint, text_value)
+    return text_value
+
+  text_value = await _single_flight.do_async(fingerprint, fetch)
+  return text_value if text_value is not None else UNAVAILABLE_MESSAGE
+
+
+def cached_recommendation(prediction_data: Dict[str, Any]) -> Optional[str]:
+  """Recommendation text already in the in-memory cache, else None (never calls Groq)."""
+  if _get_client(is_async=True) is None:
+    return NOT_CONFIGURED_MESSAGE
+  cached = _recommendation_cache.get(prompt_fingerprint(_completion_kwargs(prediction_data)))
+  return None if cached is MISS else cached
+
+
+async def stream_recommendation_async(prediction_data: Dict[str, Any]) -> AsyncIterator[str]:
+  """Yield recommendation text as Groq streams it, caching the full text at the end.
+
+  Cached and persisted recommendations are yielded as a single chunk. Upstream errors
+  propagate so the caller can decide how to report a half-streamed answer.
+  """
+  client = _get_client(is_async=True)
+  if client is None:
+    yield NOT_CONFIGURED_MESSAGE
+    return
+
+  kwargs = _completion_kwargs(prediction_data)
+  fingerprint = prompt_fingerprint(kwargs)
+  text_value = _recommendation_cache.get(fingerprint)
+  if text_value is MISS:
+    text_value = await _load_persisted_async(fingerprint)
+  if text_value is not None:
+    _recommendation_cache.set(fingerprint, text_value)
+    yield text_value
+    return
+
+  parts: List[str] = []
+  with span('llm.stream_start'):
+    stream = await client.chat.completions.create(stream=True, **kwargs)
+  async for chunk in stream:
+    piece = chunk.choices[0].delta.content if chunk.choices else None
+    if piece:
+      parts.append(piece)
+      yield piece
 
+  text_value = ''.join(parts).strip()
+  if not text_value:
+    yield 'No recommendation generated.'
+    return
+  _recommendation_cache.set(fingerprint, text_value)
+  await _store_persisted_async(fingerprint, text_value)
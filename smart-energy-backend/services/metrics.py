@@ -0,0 +1,262 @@
+"""Request timing, hot-path spans and cache counters in Prometheus text format.
+
+  http_request_duration_seconds{method,route,status}  histogram, per route template
+  span_duration_seconds{span}                         histogram, per `span(...)` name
+  cache_requests_total{cache,result}                  counter, result = hit | miss
+
+`span('name')` times a block; the DB engines report every statement as span
+'db.query'. Spans opened while a request is being served are also summed per request,
+and the totals are returned in a `Server-Timing` response header (browser dev tools show
+them next to the request) for every request with SERVER_TIMING=1, or for one request
+that sends `X-Server-Timing: 1` or `?server_timing=1`. Requests slower than
+SLOW_REQUEST_MS are logged with the same breakdown.
+
+Numbers are per process: with several uvicorn/gunicorn workers each one serves its own
+/metrics, and Prometheus should scrape every worker (or aggregate by instance).
+"""
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1').lower() in ('1', 'true', 'yes')
+SERVER_TIMING = os.getenv('SERVER_TIMING', '').lower() in ('1', 'true', 'yes')
+_TRUTHY = (b'1', b'true', b'yes')
+# Log requests slower than this with their span breakdown (0 = off).
+SLOW_REQUEST_MS = float(os.getenv('SLOW_REQUEST_MS', '0'))
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value: str) -> str:
+  return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+  pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+  if extra:
+    pairs.append(extra)
+  return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+  """Monotonic counter with a fixed set of label names."""
+
+  kind = 'counter'
+
+  def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+    self.name = name
+    self.documentation = documentation
+    self.labelnames = tuple(labelnames)
+    self._lock = threading.Lock()
+    self._values: Dict[Tuple[str, ...], float] = {}
+
+  def inc(self, *labels: str, amount: float = 1.0) -> None:
+    with self._lock:
+      self._values[labels] = self._values.get(labels, 0.0) + amount
+
+  def samples(self) -> Iterator[str]:
+    with self._lock:
+      values = sorted(self._values.items())
+    for labels, value in values:
+      yield f'{self.name}{_labels(self.labelnames, labels)} {value:g}'
+
+
+class Histogram:
+  """Cumulative-bucket histogram with a fixed set of label names."""
+
+  kind = 'histogram'
+
+  def __init__(
+    self,
+    name: str,
+    documentation: str,
+    labelnames: Sequence[str] = (),
+    buckets: Sequence[float] = DEFAULT_BUCKETS,
+  ) -> None:
+    self.name = name
+    self.documentation = documentation
+    self.labelnames = tuple(labelnames)
+    self.buckets = tuple(sorted(buckets))
+    self._lock = threading.Lock()
+    # labels -> (per-bucket counts with a trailing +Inf slot, sum)
+    self._series: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+  def observe(self, value: float, *labels: str) -> None:
+    index = bisect_left(self.buckets, value)
+    with self._lock:
+      series = self._series.get(labels)
+      if series is None:
+        series = self._series[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+      series[0][index] += 1
+      series[1][0] += value
+
+  def samples(self) -> Iterator[str]:
+    with self._lock:
+      series = sorted((labels, (list(counts), total[0])) for labels, (counts, total) in self._series.items())
+    for labels, (counts, total) in series:
+      cumulative = 0
+      for bound, count in zip(self.buckets + (float('inf'),), counts):
+        cumulative += count
+        le = 'le="+Inf"' if bound == float('inf') else f'le="{bound:g}"'
+        yield f'{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}'
+      yield f'{self.name}_sum{_labels(self.labelnames, labels)} {total:.6f}'
+      yield f'{self.name}_count{_labels(self.labelnames, labels)} {cumulative}'
+
+
+REQUEST_DURATION = Histogram(
+  'http_request_duration_seconds',
+  'HTTP request latency until the response started, by route template.',
+  ('method', 'route', 'status'),
+)
+SPAN_DURATION = Histogram('span_duration_seconds', 'Time spent in instrumented hot-path sections.', ('span',))
+CACHE_REQUESTS = Counter('cache_requests_total', 'Cache lookups by cache and result.', ('cache', 'result'))
+
+_METRICS = (REQUEST_DURATION, SPAN_DURATION, CACHE_REQUESTS)
+
+
+def render_metrics() -> str:
+  """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+  lines: List[str] = []
+  for metric in _METRICS:
+    lines.append(f'# HELP {metric.name} {metric.documentation}')
+    lines.append(f'# TYPE {metric.name} {metric.kind}')
+    lines.extend(metric.samples())
+  return '\n'.join(lines) + '\n'
+
+
+class _RequestSpans(dict):
+  """Span totals of one request: name -> [seconds, count].
+
+  Closed when the request ends; background tasks started by the request inherit its
+  context and must not keep adding to it.
+  """
+
+  closed = False
+
+
+_request_spans: ContextVar[Optional[_RequestSpans]] = ContextVar('request_spans', default=None)
+
+
+def record_span(name: str, seconds: float) -> None:
+  if not METRICS_ENABLED:
+    return
+  SPAN_DURATION.observe(seconds, name)
+  spans = _request_spans.get()
+  if spans is not None and not spans.closed:
+    entry = spans.setdefault(name, [0.0, 0])
+    entry[0] += seconds
+    entry[1] += 1
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+  """Time the enclosed block as `name` (a fixed string, it becomes a label value)."""
+  started = time.perf_counter()
+  try:
+    yield
+  finally:
+    record_span(name, time.perf_counter() - started)
+
+
+def count_cache(cache: str, hit: bool) -> None:
+  if METRICS_ENABLED:
+    CACHE_REQUESTS.inc(cache, 'hit' if hit else 'miss')
+
+
+def instrument_engine(engine) -> None:
+  """Record every statement run on a (sync) SQLAlchemy engine as span 'db.query'."""
+  from sqlalchemy import event
+
+  @event.listens_for(engine, 'before_cursor_execute')
+  def _before(conn, cursor, statement, parameters, context, executemany) -> None:  # noqa: ARG001
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+  @event.listens_for(engine, 'after_cursor_execute')
+  def _after(conn, cursor, statement, parameters, context, executemany) -> None:  # noqa: ARG001
+    started = conn.info.get('query_started')
+    if started:
+      record_span('db.query', time.perf_counter() - started.pop())
+
+  @event.listens_for(engine, 'handle_error')
+  def _error(context) -> None:
+    started = context.connection.info.get('query_started') if context.connection is not None else None
+    if started:
+      started.pop()
+
+
+def server_timing_header(spans: Dict[str, List[float]], total_seconds: float) -> str:
+  parts = [f'total;dur={total_seconds * 1000.0:.1f}']
+  for name, (seconds, count) in sorted(spans.items(), key=lambda item: -item[1][0]):
+    parts.append(f'{name};dur={seconds * 1000.0:.1f};desc="{count}x"')
+  return ', '.join(parts)
+
+
+def wants_server_timing(scope) -> bool:
+  """SERVER_TIMING, or the request's own X-Server-Timing header / server_timing query flag."""
+  if SERVER_TIMING:
+    return True
+  for name, value in scope.get('headers', ()):
+    if name == b'x-server-timing':
+      return value.strip().lower() in _TRUTHY
+  for pair in scope.get('query_string', b'').split(b'&'):
+    name, _, value = pair.partition(b'=')
+    if name == b'server_timing':
+      return value.lower() in _TRUTHY + (b'',)
+  return False
+
+
+class TimingMiddleware:
+  """ASGI middleware timing every HTTP request and collecting its spans.
+
+  The duration is taken when the response starts, so streamed bodies (recommendation
+  streams) count their time to first byte, which is also when Server-Timing is sent.
+  """
+
+  def __init__(self, app) -> None:
+    self.app = app
+
+  async def __call__(self, scope, receive, send) -> None:
+    if scope['type'] != 'http' or not METRICS_ENABLED:
+      await self.app(scope, receive, send)
+      return
+
+    started = time.perf_counter()
+    spans = _RequestSpans()
+    token = _request_spans.set(spans)
+    state = {'status': 500, 'elapsed': None}
+    server_timing = wants_server_timing(scope)
+
+    async def send_timed(message) -> None:
+      if message['type'] == 'http.response.start':
+        state['status'] = message['status']
+        state['elapsed'] = time.perf_counter() - started
+        if server_timing:
+          headers = list(message.get('headers', []))
+          headers.append((b'server-timing', server_timing_header(spans, state['elapsed']).encode('latin-1')))
+          message = {**message, 'headers': headers}
+      await send(message)
+
+    try:
+      await self.app(scope, receive, send_timed)
+    finally:
+      spans.closed = True
+      _request_spans.reset(token)
+      elapsed = state['elapsed'] if state['elapsed'] is not None else time.perf_counter() - started
+      # Route templates keep the label set bounded; unmatched paths share one series.
+      route = getattr(scope.get('route'), 'path', None) or 'unmatched'
+      REQUEST_DURATION.observe(elapsed, scope['method'], route, str(state['status']))
+      if SLOW_REQUEST_MS and elapsed * 1000.0 >= SLOW_REQUEST_MS:
+        logger.warning(
+          'Slow request %s %s: %.1f ms (%s)',
+          scope['method'],
+          scope['path'],
+          elapsed * 1000.0,
+          server_timing_header(spans, elapsed),
+        )
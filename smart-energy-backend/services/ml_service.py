@@ -1,13 +1,48 @@
-from typing import Dict, Optional
+from typing import Dict, List, Optional, Sequence, Tuple
 
 import numpy as np
 import pandas as pd
-from sqlalchemy import func
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from database.db import engine
-from database.models import EnergyRecord
-from ml.predict import predict_anomaly, predict_cost, predict_efficiency
+from database.db import SessionLocal
+from database.watermark import records_watermark, records_watermark_async
+from ml.predict import (
+  current_model_version,
+  polled_models,
+  predict_anomaly_batch,
+  predict_cost_batch,
+  predict_efficiency_batch,
+)
+from services.cache import MISS, WatermarkCache
+from services.executor import run_in_ml_executor
+from services.metrics import span
+from services.rollup_service import (
+  ensure_rollups_current,
+  ensure_rollups_current_async,
+  rollup_averages_stmt,
+  rollup_machine_averages_stmt,
+)
+from services.scoring_service import (
+  aggregate_scores,
+  current_score_version,
+  queue_score_pending_records,
+  served_score_version,
+  snapshot_score_version,
+)
+
+_insights_cache = WatermarkCache('ml_insights')
+
+
+class BatchTooLarge(Exception):
+  """A batch analysis would evaluate more than `max_cells` machine x scenario cells."""
+
+  def __init__(self, machines: int, scenarios: int, max_cells: int) -> None:
+    super().__init__(
+      f'{machines} machines x {scenarios} scenarios exceeds {max_cells} combinations per request.',
+    )
+    self.machines = machines
+    self.max_cells = max_cells
 
 
 def _as_float(value, default: float = 0.0) -> float:
@@ -19,38 +54,20 @@ def _as_float(value, default: float = 0.0) -> float:
     return default
 
 
-def _machine_averages(db: Session, machine_id: str) -> Dict[str, float]:
-  row = (
-    db.query(
-      func.avg(EnergyRecord.power_kw),
-      func.avg(EnergyRecord.load_percent),
-      func.avg(EnergyRecord.temperature),
-      func.avg(EnergyRecord.downtime_minutes),
-      func.avg(EnergyRecord.power_factor),
-      func.avg(EnergyRecord.energy_kwh),
-      func.avg(EnergyRecord.electricity_tariff),
-      func.avg(EnergyRecord.idle_flag),
-    )
-    .filter(EnergyRecord.machine_id == machine_id)
-    .first()
-  )
+# Keys of the dicts `_averages_from_row` returns.
+_AVERAGE_KEYS = (
+  'power_kw',
+  'load_percent',
+  'temperature',
+  'downtime_minutes',
+  'power_factor',
+  'energy_kwh',
+  'electricity_tariff',
+  'idle_rate',
+)
 
-  if row is None or all(v is None for v in row):
-    # Fall back to global averages if machine_id has no rows.
-    row = (
-      db.query(
-        func.avg(EnergyRecord.power_kw),
-        func.avg(EnergyRecord.load_percent),
-        func.avg(EnergyRecord.temperature),
-        func.avg(EnergyRecord.downtime_minutes),
-        func.avg(EnergyRecord.power_factor),
-        func.avg(EnergyRecord.energy_kwh),
-        func.avg(EnergyRecord.electricity_tariff),
-        func.avg(EnergyRecord.idle_flag),
-      )
-      .first()
-    )
 
+def _averages_from_row(row) -> Dict[str, float]:
   (
     avg_power_kw,
     avg_load_percent,
@@ -74,121 +91,255 @@ def _machine_averages(db: Session, machine_id: str) -> Dict[str, float]:
   }
 
 
-def run_full_analysis(machine_id: str, on_time_hours: float, off_time_hours: float, db: Session) -> Dict:
-  on_time_hours = max(_as_float(on_time_hours), 0.0)
-  off_time_hours = max(_as_float(off_time_hours), 0.0)
+@span('analysis.averages')
+def _machine_averages(db: Session, machine_id: str, window: Optional[str] = None) -> Dict[str, float]:
+  """Averages for `machine_id` from the machine_rollups tables (O(1) in history size)."""
+  ensure_rollups_current(db)
 
-  avg = _machine_averages(db, machine_id)
+  row = db.execute(rollup_averages_stmt(machine_id, window)).first()
+  if row is None or all(v is None for v in row):
+    # Fall back to averages over all machines if machine_id has no rows.
+    row = db.execute(rollup_averages_stmt(None, window)).first()
+  return _averages_from_row(row)
 
-  # Estimated energy (kWh) using average power draw over requested runtime.
-  estimated_energy = max(0.0, avg['power_kw']) * on_time_hours
 
-  try:
-    # ML predictions
-    anomaly_pred = predict_anomaly(
-      {
-        'power_kw': avg['power_kw'],
-        'load_percent': avg['load_percent'],
-        'temperature': avg['temperature'],
-        'downtime_minutes': avg['downtime_minutes'],
-        'power_factor': avg['power_factor'],
-        'energy_kwh': avg['energy_kwh'],
-      },
-    )
+async def _machine_averages_async(db: AsyncSession, machine_id: str, window: Optional[str] = None) -> Dict[str, float]:
+  with span('analysis.averages'):
+    await ensure_rollups_current_async(db)
 
-    predicted_cost = predict_cost(
-      {
-        'power_kw': avg['power_kw'],
-        'load_percent': avg['load_percent'],
-        'on_time_hours': on_time_hours,
-        'electricity_tariff': avg['electricity_tariff'],
-      },
-    )
+    row = (await db.execute(rollup_averages_stmt(machine_id, window))).first()
+    if row is None or all(v is None for v in row):
+      row = (await db.execute(rollup_averages_stmt(None, window))).first()
+  return _averages_from_row(row)
 
-    efficiency_score = predict_efficiency(
-      {
-        'load_percent': avg['load_percent'],
-        'downtime_minutes': avg['downtime_minutes'] + (10.0 if off_time_hours < 4 else 0.0),
-        'temperature': avg['temperature'],
-        'power_factor': avg['power_factor'],
-      },
-    )
+
+# Inputs each model is given; features a model was trained on beyond these are filled
+# with its training means.
+_ANOMALY_INPUTS = ['power_kw', 'load_percent', 'temperature', 'downtime_minutes', 'power_factor', 'energy_kwh']
+_COST_INPUTS = ['power_kw', 'load_percent', 'on_time_hours', 'electricity_tariff']
+_EFFICIENCY_INPUTS = ['load_percent', 'downtime_minutes', 'temperature', 'power_factor']
+
+
+@span('ml.analyze_grid')
+def analyze_grid(
+  machine_averages: Dict[str, Dict[str, float]],
+  scenarios: Sequence[Tuple[float, float]],
+) -> Dict:
+  """Score every (machine, (on_time_hours, off_time_hours)) pair; CPU-only, no DB access.
+
+  Each model runs once over all pairs (anomaly once per machine, since it only sees the
+  averages). Returns `machines` (per-machine anomaly results), `cells` (a machines x
+  scenarios matrix of scenario results) and `model_version`.
+  """
+  machines = list(machine_averages)
+  avg = pd.DataFrame([machine_averages[m] for m in machines], columns=list(_AVERAGE_KEYS))
+  on = np.maximum(np.array([_as_float(s[0]) for s in scenarios], dtype=float), 0.0)
+  off = np.maximum(np.array([_as_float(s[1]) for s in scenarios], dtype=float), 0.0)
+
+  # One row per (machine, scenario), machine-major.
+  n_machines, n_scenarios = len(machines), len(scenarios)
+  cells = avg.iloc[np.repeat(np.arange(n_machines), n_scenarios)].reset_index(drop=True)
+  cells['on_time_hours'] = np.tile(on, n_machines)
+  off_cells = np.tile(off, n_machines)
+
+  # Estimated energy (kWh) using average power draw over requested runtime, and its
+  # price at the machine's average tariff.
+  estimated_energy = np.maximum(cells['power_kw'].to_numpy(), 0.0) * cells['on_time_hours'].to_numpy()
+  energy_cost = estimated_energy * cells['electricity_tariff'].to_numpy()
+
+  try:
+    anomaly = predict_anomaly_batch(avg[_ANOMALY_INPUTS])
+    predicted_cost = predict_cost_batch(cells[_COST_INPUTS])
+    efficiency_inputs = cells[_EFFICIENCY_INPUTS].copy()
+    efficiency_inputs['downtime_minutes'] += np.where(off_cells < 4, 10.0, 0.0)
+    efficiency_score = predict_efficiency_batch(efficiency_inputs)
+    model_version = current_model_version()
   except Exception:
-    anomaly_pred = {'anomaly_status': 'Normal', 'anomaly_score': 0.0}
-    predicted_cost = estimated_energy * avg['electricity_tariff']
-    efficiency_score = 0.0
+    # Models not trained/loaded yet (e.g. first training still running): tariff-based
+    # cost and neutral anomaly/efficiency values, marked by model_version None.
+    anomaly = {'is_anomaly': np.zeros(n_machines, dtype=bool), 'anomaly_score': np.zeros(n_machines)}
+    predicted_cost = energy_cost
+    efficiency_score = np.zeros(len(cells))
+    model_version = None
 
   # Spec: energy_wasted = idle_flag × energy_kwh.
   # We approximate this over the requested runtime by scaling the machine-average wasted energy.
-  avg_on_time = (avg['energy_kwh'] / avg['power_kw']) if avg['power_kw'] > 0 else 1.0
-  avg_on_time = max(avg_on_time, 0.1)
-  scale = on_time_hours / avg_on_time
-  energy_wasted = (avg['idle_rate'] * avg['energy_kwh']) * scale
+  power = cells['power_kw'].to_numpy()
+  energy = cells['energy_kwh'].to_numpy()
+  with np.errstate(divide='ignore', invalid='ignore'):
+    avg_on_time = np.where(power > 0, energy / np.where(power > 0, power, 1.0), 1.0)
+  avg_on_time = np.maximum(avg_on_time, 0.1)
+  energy_wasted = cells['idle_rate'].to_numpy() * energy * (cells['on_time_hours'].to_numpy() / avg_on_time)
 
+  results = [
+    {
+      'predicted_cost': int(round(cost)),
+      'efficiency_score': float(round(eff, 4)),
+      'energy_wasted': float(round(wasted, 2)),
+      'estimated_energy': float(round(est, 2)),
+      'energy_cost': float(round(est_cost, 2)),
+    }
+    for cost, eff, wasted, est, est_cost in zip(
+      predicted_cost.tolist(),
+      efficiency_score.tolist(),
+      energy_wasted.tolist(),
+      estimated_energy.tolist(),
+      energy_cost.tolist(),
+    )
+  ]
   return {
-    'machine_id': machine_id,
-    'anomaly_status': anomaly_pred['anomaly_status'],
-    'anomaly_score': float(anomaly_pred['anomaly_score']),
-    'predicted_cost': int(round(predicted_cost)),
-    'efficiency_score': float(round(efficiency_score, 4)),
-    'energy_wasted': float(round(energy_wasted, 2)),
-    'estimated_energy': float(round(estimated_energy, 2)),
+    'machines': [
+      {
+        'machine_id': machine_id,
+        'anomaly_status': 'Anomaly' if flagged else 'Normal',
+        'anomaly_score': float(score),
+      }
+      for machine_id, flagged, score in zip(machines, anomaly['is_anomaly'].tolist(), anomaly['anomaly_score'].tolist())
+    ],
+    'cells': [results[i * n_scenarios:(i + 1) * n_scenarios] for i in range(n_machines)],
+    'model_version': model_version,
   }
 
 
-def get_dashboard_ml_insights(limit: Optional[int] = None) -> Dict:
-  """Compute ML-based dashboard insights over the stored dataset.
+def analyze_from_averages(
+  machine_id: str,
+  on_time_hours: float,
+  off_time_hours: float,
+  avg: Dict[str, float],
+) -> Dict:
+  """Model inference part of `run_full_analysis`; CPU-only, no database access."""
+  grid = analyze_grid({machine_id: avg}, [(on_time_hours, off_time_hours)])
+  return {**grid['machines'][0], **grid['cells'][0][0], 'model_version': grid['model_version']}
+
+
+def run_full_analysis(
+  machine_id: str,
+  on_time_hours: float,
+  off_time_hours: float,
+  db: Session,
+  window: Optional[str] = None,
+) -> Dict:
+  avg = _machine_averages(db, machine_id, window)
+  return analyze_from_averages(machine_id, on_time_hours, off_time_hours, avg)
+
+
+async def run_full_analysis_async(
+  machine_id: str,
+  on_time_hours: float,
+  off_time_hours: float,
+  db: AsyncSession,
+  window: Optional[str] = None,
+) -> Dict:
+  """Async `run_full_analysis`: awaits the DB query and runs inference on the ML pool."""
+  avg = await _machine_averages_async(db, machine_id, window)
+  # End the read transaction so the pooled connection is free while inference (and
+  # whatever the caller awaits next) runs.
+  await db.commit()
+  return await run_in_ml_executor(analyze_from_averages, machine_id, on_time_hours, off_time_hours, avg)
+
+
+async def run_batch_analysis_async(
+  db: AsyncSession,
+  machine_ids: Optional[List[str]],
+  scenarios: Sequence[Tuple[float, float]],
+  window: Optional[str] = None,
+  max_cells: Optional[int] = None,
+) -> Dict:
+  """`analyze_grid` over many machines, with all their averages from one grouped query.
 
-  - anomaly_count: predicted anomalies using IsolationForest
-  - average_efficiency_ml: average predicted efficiency using RandomForestRegressor
+  `machine_ids` None means every machine in the rollups. Machines without readings get
+  fleet-wide averages, like `run_full_analysis`, and are listed in `fallback_machines`.
+  Raises BatchTooLarge before any model runs when the grid exceeds `max_cells`.
   """
-  query = """
-    SELECT
-      power_kw,
-      load_percent,
-      temperature,
-      downtime_minutes,
-      power_factor,
-      energy_kwh
-    FROM energy_records
+  await ensure_rollups_current_async(db)
+  rows = (await db.execute(rollup_machine_averages_stmt(machine_ids, window))).all()
+  found = {row[0]: _averages_from_row(row[1:]) for row in rows if any(v is not None for v in row[1:])}
+
+  machines = list(dict.fromkeys(machine_ids)) if machine_ids is not None else list(found)
+  fallback = [m for m in machines if m not in found]
+  if fallback:
+    fleet = _averages_from_row((await db.execute(rollup_averages_stmt(None, window))).first())
+    found.update({m: fleet for m in fallback})
+  await db.commit()
+  if max_cells is not None and len(machines) * len(scenarios) > max_cells:
+    raise BatchTooLarge(len(machines), len(scenarios), max_cells)
+
+  grid = await run_in_ml_executor(analyze_grid, {m: found[m] for m in machines}, scenarios)
+  grid['fallback_machines'] = fallback
+  return grid
+
+
+_EMPTY_INSIGHTS = {'anomaly_count': 0, 'average_efficiency_ml': 0.0}
+
+
+@span('insights.compute')
+def _compute_ml_insights(version: str, limit: Optional[int]) -> Tuple[Dict, bool]:
+  """Insights from the newest complete scores, and whether they are `version`'s own.
+
+  Never scores in the request path: while `version` is behind, the previous version's
+  totals are served and a background scoring pass is queued.
   """
-  if limit:
-    query += f" LIMIT {int(limit)}"
+  served, complete = served_score_version(version)
+  if not complete:
+    queue_score_pending_records()
+  return aggregate_scores(served, limit=limit), complete
 
-  df = pd.read_sql_query(query, con=engine)
-  if df.empty:
-    return {'anomaly_count': 0, 'average_efficiency_ml': 0.0}
 
-  for c in df.columns:
-    df[c] = pd.to_numeric(df[c], errors='coerce')
-    df[c] = df[c].fillna(df[c].median() if not np.isnan(df[c].median()) else 0.0)
+def get_dashboard_ml_insights(limit: Optional[int] = None) -> Dict:
+  """Return ML-based dashboard insights from the persisted energy_scores store.
+
+  - anomaly_count: records the IsolationForest flags as anomalous
+  - average_efficiency_ml: mean RandomForestRegressor efficiency prediction
+
+  Read from the current model version's score totals and cached until the data or
+  model version moves. Until the current version has scored every record (scoring
+  runs in the background after ingest and training), the newest complete totals are
+  served uncached.
+  """
+  version = current_score_version()
+  if version is None:
+    return dict(_EMPTY_INSIGHTS)
 
+  db = SessionLocal()
   try:
-    from ml.predict import _load_anomaly_model, _load_efficiency_model  # noqa: PLC0415
-
-    anomaly_bundle = _load_anomaly_model()
-    eff_bundle = _load_efficiency_model()
-
-    # Align DataFrame columns with model feature lists.
-    anomaly_features = anomaly_bundle.get('features') or []
-    eff_features = eff_bundle.get('features') or []
-
-    if anomaly_features:
-      X_anom = df[[c for c in anomaly_features if c in df.columns]].to_numpy(dtype=float)
-      anomaly_labels = anomaly_bundle['model'].predict(X_anom)
-      anomaly_count = int((anomaly_labels == -1).sum())
-    else:
-      anomaly_count = 0
-
-    if eff_features:
-      X_eff = df[[c for c in eff_features if c in df.columns]].to_numpy(dtype=float)
-      eff_preds = eff_bundle['model'].predict(X_eff)
-      eff_preds = np.clip(np.asarray(eff_preds, dtype=float), 0.0, 1.0)
-      avg_eff = float(np.mean(eff_preds)) if len(eff_preds) else 0.0
-    else:
-      avg_eff = 0.0
-
-    return {'anomaly_count': anomaly_count, 'average_efficiency_ml': avg_eff}
+    watermark = records_watermark(db)
+  finally:
+    db.close()
+
+  key = ('ml_insights', limit)
+  insights = _insights_cache.lookup(key, (version, watermark))
+  if insights is not MISS:
+    return insights
+  try:
+    insights, complete = _compute_ml_insights(version, limit)
   except Exception:
-    return {'anomaly_count': 0, 'average_efficiency_ml': 0.0}
+    return dict(_EMPTY_INSIGHTS)
+  return _insights_cache.store(key, (version, watermark), insights) if complete else insights
+
 
+async def get_dashboard_ml_insights_async(db: AsyncSession, limit: Optional[int] = None) -> Dict:
+  """Async `get_dashboard_ml_insights`: cache hits never leave the event loop.
+
+  The loop only reads the model snapshot in service; when it is due a registry poll
+  (which may load and warm a new version) the version is resolved in the ML executor.
+  """
+  models = polled_models()
+  if models is not None:
+    version = snapshot_score_version(models)
+  else:
+    version = await run_in_ml_executor(current_score_version)
+  if version is None:
+    return dict(_EMPTY_INSIGHTS)
+
+  key = ('ml_insights', limit)
+  watermark = (version, await records_watermark_async(db))
+  insights = _insights_cache.lookup(key, watermark)
+  if insights is not MISS:
+    return insights
+
+  await db.commit()
+  try:
+    insights, complete = await run_in_ml_executor(_compute_ml_insights, version, limit)
+  except Exception:
+    return dict(_EMPTY_INSIGHTS)
+  return _insights_cache.store(key, watermark, insights) if complete else insights
@@ -0,0 +1,139 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from services.cache import MISS, TTLCache
+from services.groq_service import (
+  UNAVAILABLE_MESSAGE,
+  _completion_kwargs,
+  cached_recommendation,
+  prompt_fingerprint,
+  stream_recommendation_async,
+)
+
+logger = logging.getLogger(__name__)
+
+RECOMMENDATION_JOB_TTL_SECONDS = float(os.getenv('RECOMMENDATION_JOB_TTL_SECONDS', '900'))
+RECOMMENDATION_JOB_LIMIT = int(os.getenv('RECOMMENDATION_JOB_LIMIT', '1024'))
+
+
+class RecommendationJob:
+  """One LLM recommendation being generated in the background.
+
+  Streamed chunks are kept so late subscribers can replay them before following along.
+  Chunks are only ever appended: a final text passed to `finish` (a cached answer or
+  the failure message) is sent as one more chunk and replaces the streamed text only
+  in `text`.
+  """
+
+  def __init__(self, job_id: str, fingerprint: str) -> None:
+    self.id = job_id
+    self.fingerprint = fingerprint
+    self.status = 'pending'
+    self.chunks: List[str] = []
+    self.result: Optional[str] = None
+    self.created_at = time.time()
+    self.finished_at: Optional[float] = None
+    self._changed = asyncio.Event()
+
+  @property
+  def done(self) -> bool:
+    return self.status != 'pending'
+
+  @property
+  def text(self) -> str:
+    if self.result is not None:
+      return self.result.strip()
+    return ''.join(self.chunks).strip()
+
+  def _notify(self) -> None:
+    changed, self._changed = self._changed, asyncio.Event()
+    changed.set()
+
+  def append(self, piece: str) -> None:
+    self.chunks.append(piece)
+    self._notify()
+
+  def finish(self, status: str, text_value: Optional[str] = None) -> None:
+    if text_value is not None:
+      # Followers already hold the streamed chunks; set the final text apart from them.
+      self.chunks.append(f'\n\n{text_value}' if self.chunks else text_value)
+      self.result = text_value
+    self.status = status
+    self.finished_at = time.time()
+    self._notify()
+
+  def as_dict(self) -> Dict[str, Any]:
+    return {
+      'job_id': self.id,
+      'status': self.status,
+      'ai_recommendation': self.text if self.done else None,
+      'partial_recommendation': None if self.done else self.text,
+    }
+
+  async def follow(self) -> AsyncIterator[str]:
+    """Yield every chunk (already streamed ones first) until the job finishes."""
+    sent = 0
+    while True:
+      changed = self._changed
+      while sent < len(self.chunks):
+        sent += 1
+        yield self.chunks[sent - 1]
+      if self.done:
+        return
+      await changed.wait()
+
+
+_jobs = TTLCache(maxsize=RECOMMENDATION_JOB_LIMIT, ttl=RECOMMENDATION_JOB_TTL_SECONDS)
+# fingerprint -> job id of the generation currently running for that prompt.
+_in_flight: Dict[str, str] = {}
+_tasks: set = set()
+
+
+async def _run(job: RecommendationJob, prediction: Dict[str, Any]) -> None:
+  try:
+    async for piece in stream_recommendation_async(prediction):
+      job.append(piece)
+    job.finish('done')
+  except Exception as exc:  # noqa: BLE001
+    logger.warning('Recommendation job %s failed: %s', job.id, exc)
+    job.finish('failed', UNAVAILABLE_MESSAGE)
+  finally:
+    _in_flight.pop(job.fingerprint, None)
+
+
+def start_recommendation_job(prediction: Dict[str, Any]) -> RecommendationJob:
+  """Start (or join) the background recommendation for this analysis result.
+
+  Cached recommendations produce an already finished job. Identical prompts in flight
+  share one job, and therefore one upstream streaming call.
+  """
+  fingerprint = prompt_fingerprint(_completion_kwargs(prediction))
+  running_id = _in_flight.get(fingerprint)
+  if running_id is not None:
+    running = _jobs.get(running_id)
+    if running is not MISS:
+      return running
+
+  job = RecommendationJob(uuid.uuid4().hex, fingerprint)
+  _jobs.set(job.id, job)
+
+  cached = cached_recommendation(prediction)
+  if cached is not None:
+    job.finish('done', cached)
+    return job
+
+  _in_flight[fingerprint] = job.id
+  task = asyncio.get_running_loop().create_task(_run(job, prediction))
+  # Keep a reference so the task is not garbage collected mid-stream.
+  _tasks.add(task)
+  task.add_done_callback(_tasks.discard)
+  return job
+
+
+def get_recommendation_job(job_id: str) -> Optional[RecommendationJob]:
+  job = _jobs.get(job_id)
+  return None if job is MISS else job
@@ -0,0 +1,310 @@
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import func, inspect, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from database.db import Base, engine
+from database.models import (
+  EnergyRecord,
+  MachineDailyRollup,
+  MachineHourlyRollup,
+  MachineRollup,
+  RollupWatermark,
+)
+from database.watermark import records_watermark, reset_records_counter
+from services.executor import run_in_ml_executor
+from services.metrics import span
+
+logger = logging.getLogger(__name__)
+
+# Columns averaged by run_full_analysis, in the order of `_averages_from_row`.
+ROLLUP_COLUMNS = (
+  'power_kw',
+  'load_percent',
+  'temperature',
+  'downtime_minutes',
+  'power_factor',
+  'energy_kwh',
+  'electricity_tariff',
+  'idle_flag',
+)
+
+# Window name -> hours of hourly buckets to add up.
+ROLLUP_WINDOWS = {'24h': 24, '7d': 24 * 7, '30d': 24 * 30}
+
+# Bucket name -> (rollup table, SQLite strftime format of the bucket start). The formats
+# use the text layout SQLAlchemy uses for DateTime on SQLite, so SQL- and ORM-written
+# values compare correctly.
+TIMESERIES_BUCKETS = {
+  'hour': (MachineHourlyRollup, '%Y-%m-%d %H:00:00.000000'),
+  'day': (MachineDailyRollup, '%Y-%m-%d 00:00:00.000000'),
+}
+
+_WATERMARK_NAME = 'machine_rollups'
+_ROLLUP_TABLES = (
+  MachineRollup.__table__,
+  MachineHourlyRollup.__table__,
+  MachineDailyRollup.__table__,
+  RollupWatermark.__table__,
+)
+
+_lock = threading.Lock()
+_schema_checked = False
+
+
+def _average_sums() -> Dict[str, str]:
+  sums = {'readings': 'COUNT(*)'}
+  for name in ROLLUP_COLUMNS:
+    sums[f'sum_{name}'] = f'TOTAL({name})'
+    sums[f'n_{name}'] = f'COUNT({name})'
+  return sums
+
+
+_TIMESERIES_SUMS = {
+  'sum_cost': 'TOTAL(energy_kwh * electricity_tariff)',
+  'sum_production': 'TOTAL(production_output)',
+  'sum_idle_energy': 'TOTAL(CASE WHEN idle_flag THEN energy_kwh END)',
+  # co2_emission is the grid emission factor (kg per kWh) of the reading.
+  'sum_co2_kg': 'TOTAL(energy_kwh * co2_emission)',
+}
+
+
+def _upsert_sql(table: str, keys: Dict[str, str], sums: Dict[str, str]) -> str:
+  """INSERT ... SELECT ... GROUP BY that adds the new rows' sums onto existing ones."""
+  key_names = ', '.join(keys)
+  sum_names = ', '.join(sums)
+  updates = ', '.join(f'{c} = {c} + excluded.{c}' for c in sums)
+  group_by = ', '.join(str(i + 1) for i in range(len(keys)))
+  return (
+    f'INSERT INTO {table} ({key_names}, {sum_names}) '
+    f"SELECT {', '.join(list(keys.values()) + list(sums.values()))} FROM energy_records "
+    'WHERE id > :last_id AND id <= :upto_id '
+    + ''.join(f'AND {expr} IS NOT NULL ' for expr in keys.values())
+    + f'GROUP BY {group_by} '
+    f'ON CONFLICT ({key_names}) DO UPDATE SET {updates}'
+  )
+
+
+_ROLLUP_UPSERTS = [_upsert_sql('machine_rollups', {'machine_id': 'machine_id'}, _average_sums())] + [
+  _upsert_sql(
+    table.__tablename__,
+    {
+      'machine_id': 'machine_id',
+      'bucket_start': f"strftime('{bucket_format}', timestamp)",
+      'shift': "COALESCE(shift, '')",
+    },
+    {**_average_sums(), **_TIMESERIES_SUMS},
+  )
+  for table, bucket_format in TIMESERIES_BUCKETS.values()
+]
+
+
+def _ensure_rollup_schema() -> None:
+  """Create the rollup tables; drop and rebuild any whose columns no longer match.
+
+  Rollups are derived data, so a schema change is handled by recomputing them.
+  """
+  global _schema_checked
+  if _schema_checked:
+    return
+  inspector = inspect(engine)
+  stale = [
+    table
+    for table in _ROLLUP_TABLES
+    if inspector.has_table(table.name)
+    and {c['name'] for c in inspector.get_columns(table.name)} != set(table.columns.keys())
+  ]
+  if stale:
+    logger.warning('Rebuilding rollup tables after a schema change: %s', ', '.join(t.name for t in stale))
+    Base.metadata.drop_all(bind=engine, tables=list(_ROLLUP_TABLES))
+  Base.metadata.create_all(bind=engine, tables=list(_ROLLUP_TABLES))
+  if stale:
+    # The records counter lives in rollup_watermarks too.
+    with engine.begin() as conn:
+      reset_records_counter(conn)
+  _schema_checked = True
+
+
+@span('rollups.refresh')
+def refresh_machine_rollups() -> int:
+  """Fold energy_records rows added since the last refresh into the rollup tables.
+
+  One INSERT ... ON CONFLICT DO UPDATE per table over `id > last_id`, so the cost is
+  proportional to the new rows. The rollups are rebuilt from scratch when records were
+  removed. Returns the number of readings folded in.
+  """
+  with _lock:
+    _ensure_rollup_schema()
+    with engine.begin() as conn:
+      rows, max_id = records_watermark(conn)
+      mark = conn.execute(
+        select(RollupWatermark.last_id, RollupWatermark.rows).where(RollupWatermark.name == _WATERMARK_NAME),
+      ).first()
+      last_id, last_rows = (int(mark[0]), int(mark[1])) if mark else (0, 0)
+
+      if max_id < last_id or rows < last_rows:
+        logger.warning('energy_records shrank since the last rollup; rebuilding machine rollups.')
+        for table in _ROLLUP_TABLES[:-1]:
+          conn.execute(table.delete())
+        last_id, last_rows = 0, 0
+
+      if max_id <= last_id:
+        return 0
+
+      params = {'last_id': last_id, 'upto_id': max_id}
+      for upsert in _ROLLUP_UPSERTS:
+        conn.execute(text(upsert), params)
+      conn.execute(text('DELETE FROM rollup_watermarks WHERE name = :name'), {'name': _WATERMARK_NAME})
+      conn.execute(
+        RollupWatermark.__table__.insert().values(name=_WATERMARK_NAME, last_id=max_id, rows=rows),
+      )
+
+  folded = rows - last_rows
+  logger.info('Folded %d readings into machine rollups (up to id %d).', folded, max_id)
+  return folded
+
+
+def _rollup_lag_stmt():
+  """(max record id, last rolled-up id); the rollups are stale when the first is larger."""
+  last_id = (
+    select(RollupWatermark.last_id).where(RollupWatermark.name == _WATERMARK_NAME).scalar_subquery()
+  )
+  return select(func.coalesce(func.max(EnergyRecord.id), 0), func.coalesce(last_id, 0))
+
+
+def ensure_rollups_current(db: Session) -> None:
+  """Catch the rollups up when records arrived outside the paths that refresh them."""
+  max_id, rolled_up_id = db.execute(_rollup_lag_stmt()).one()
+  if max_id > rolled_up_id:
+    db.commit()
+    refresh_machine_rollups()
+
+
+async def ensure_rollups_current_async(db: AsyncSession) -> None:
+  max_id, rolled_up_id = (await db.execute(_rollup_lag_stmt())).one()
+  if max_id > rolled_up_id:
+    # Refresh off the event loop without holding this session's connection.
+    await db.commit()
+    await run_in_ml_executor(refresh_machine_rollups)
+
+
+def _rollup_source(window: Optional[str]):
+  """Rollup table to average over, plus the row filter selecting `window` (or None)."""
+  if window is not None and window not in ROLLUP_WINDOWS:
+    raise ValueError(f"Unknown rollup window {window!r}; expected one of {', '.join(ROLLUP_WINDOWS)}.")
+  if window is None:
+    return MachineRollup, None
+
+  hours = ROLLUP_WINDOWS[window]
+  window_start = select(
+    func.strftime('%Y-%m-%d %H:%M:%S.000000', func.max(MachineHourlyRollup.bucket_start), f'-{hours} hours'),
+  ).scalar_subquery()
+  return MachineHourlyRollup, MachineHourlyRollup.bucket_start > window_start
+
+
+def _average_columns(table):
+  return [
+    func.sum(getattr(table, f'sum_{name}')) / func.nullif(func.sum(getattr(table, f'n_{name}')), 0)
+    for name in ROLLUP_COLUMNS
+  ]
+
+
+def rollup_averages_stmt(machine_id: Optional[str] = None, window: Optional[str] = None):
+  """Averages of ROLLUP_COLUMNS for one machine (or all machines) from the rollups.
+
+  Without `window` this reads the machine's single all-time row. With a window
+  ('24h', '7d', '30d') it adds up the hourly buckets that end within that span of the
+  newest reading, so replayed historical datasets still get meaningful windows.
+  """
+  table, condition = _rollup_source(window)
+  stmt = select(*_average_columns(table))
+  if condition is not None:
+    stmt = stmt.where(condition)
+  if machine_id is not None:
+    stmt = stmt.where(table.machine_id == machine_id)
+  return stmt
+
+
+def rollup_machine_averages_stmt(machine_ids: Optional[List[str]] = None, window: Optional[str] = None):
+  """(machine_id, *averages) rows for many machines in one grouped query; all when None."""
+  table, condition = _rollup_source(window)
+  stmt = select(table.machine_id, *_average_columns(table))
+  if condition is not None:
+    stmt = stmt.where(condition)
+  if machine_ids is not None:
+    stmt = stmt.where(table.machine_id.in_(machine_ids))
+  return stmt.group_by(table.machine_id).order_by(table.machine_id)
+
+
+def _bucket_floor(value: datetime, bucket: str) -> datetime:
+  value = value.replace(minute=0, second=0, microsecond=0)
+  return value.replace(hour=0) if bucket == 'day' else value
+
+
+def timeseries_stmt(
+  machine_id: Optional[str],
+  start: Optional[datetime],
+  end: Optional[datetime],
+  bucket: str = 'hour',
+  shift: Optional[str] = None,
+):
+  """Per-bucket totals between `start` and `end` (inclusive), summed over shifts.
+
+  Reads only the rollup rows of the requested range: a year of hourly history for one
+  machine is ~8.8k bucket rows however many readings went into them.
+  """
+  if bucket not in TIMESERIES_BUCKETS:
+    raise ValueError(f"Unknown bucket {bucket!r}; expected one of {', '.join(TIMESERIES_BUCKETS)}.")
+  table = TIMESERIES_BUCKETS[bucket][0]
+
+  stmt = select(
+    table.bucket_start,
+    func.sum(table.readings),
+    func.sum(table.sum_energy_kwh),
+    func.sum(table.sum_cost),
+    func.sum(table.sum_production),
+    func.sum(table.sum_idle_energy),
+    func.sum(table.sum_co2_kg),
+  )
+  if machine_id is not None:
+    stmt = stmt.where(table.machine_id == machine_id)
+  if shift is not None:
+    stmt = stmt.where(table.shift == shift)
+  if start is not None:
+    stmt = stmt.where(table.bucket_start >= _bucket_floor(start, bucket))
+  if end is not None:
+    stmt = stmt.where(table.bucket_start <= end)
+  return stmt.group_by(table.bucket_start).order_by(table.bucket_start)
+
+
+def timeseries_points(rows) -> List[Dict]:
+  return [
+    {
+      'bucket_start': bucket_start.isoformat(),
+      'readings': int(readings or 0),
+      'energy_kwh': float(energy or 0.0),
+      'energy_cost': float(cost or 0.0),
+      'production_output': float(production or 0.0),
+      'idle_energy_kwh': float(idle_energy or 0.0),
+      'co2_kg': float(co2 or 0.0),
+    }
+    for bucket_start, readings, energy, cost, production, idle_energy, co2 in rows
+  ]
+
+
+async def get_timeseries_async(
+  db: AsyncSession,
+  machine_id: Optional[str],
+  start: Optional[datetime],
+  end: Optional[datetime],
+  bucket: str = 'hour',
+  shift: Optional[str] = None,
+) -> List[Dict]:
+  await ensure_rollups_current_async(db)
+  with span('timeseries.query'):
+    rows = (await db.execute(timeseries_stmt(machine_id, start, end, bucket, shift))).all()
+  return timeseries_points(rows)
@@ -0,0 +1,283 @@
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import select, text
+
+from database.db import engine
+from database.models import EnergyRecord, EnergyScore, EnergyScoreTotal
+from database.record_frames import peak_rss_bytes, read_record_frame
+from database.watermark import records_watermark
+from ml.feature_stats import feature_medians
+from ml.predict import LoadedModels, _build_feature_matrix, current_models
+from services.executor import submit_to_ml_executor
+from services.metrics import span
+
+logger = logging.getLogger(__name__)
+
+SCORE_BATCH_SIZE = 5000
+
+# Scoring runs from startup, ingest, training activation and telemetry flushes; one at a time.
+_score_lock = threading.Lock()
+# Set while a queue_score_pending_records() pass waits in the ML executor.
+_score_queued = False
+_score_queue_lock = threading.Lock()
+
+_ADD_TOTALS = (
+  'INSERT INTO energy_score_totals (model_version, scored, anomalies, sum_efficiency, n_efficiency) '
+  'VALUES (:version, :scored, :anomalies, :sum_efficiency, :n_efficiency) '
+  'ON CONFLICT(model_version) DO UPDATE SET '
+  'scored = scored + excluded.scored, '
+  'anomalies = anomalies + excluded.anomalies, '
+  'sum_efficiency = sum_efficiency + excluded.sum_efficiency, '
+  'n_efficiency = n_efficiency + excluded.n_efficiency'
+)
+# energy_score_totals columns computed from energy_scores rows.
+_TOTALS_COLUMNS = 'COUNT(*), COALESCE(SUM(is_anomaly), 0), COALESCE(SUM(efficiency), 0.0), COUNT(efficiency)'
+
+
+def _scoring_bundles():
+  # One snapshot, so both bundles come from the same registry version.
+  models = current_models()
+  if not models.complete:
+    raise FileNotFoundError('Models are not loaded.')
+  return models.bundles['anomaly'], models.bundles['efficiency']
+
+
+def score_model_version(anomaly_bundle: Dict, eff_bundle: Dict) -> str:
+  """Version key for scores produced by this anomaly/efficiency bundle pair."""
+  return f"{anomaly_bundle.get('version', 'unknown')}-{eff_bundle.get('version', 'unknown')}"
+
+
+def snapshot_score_version(models: LoadedModels) -> Optional[str]:
+  """Score version of a model snapshot; None when it is incomplete."""
+  if not models.complete:
+    return None
+  return score_model_version(models.bundles['anomaly'], models.bundles['efficiency'])
+
+
+def current_score_version() -> Optional[str]:
+  try:
+    return snapshot_score_version(current_models())
+  except Exception:  # noqa: BLE001
+    return None
+
+
+def _feature_columns(*bundles: Dict) -> List[str]:
+  table_columns = set(EnergyRecord.__table__.columns.keys())
+  columns: List[str] = []
+  for bundle in bundles:
+    for name in bundle.get('feature_order') or ():
+      if name in table_columns and name not in columns:
+        columns.append(name)
+  return columns
+
+
+def _read_totals(conn, version: str):
+  return conn.execute(
+    select(
+      EnergyScoreTotal.scored,
+      EnergyScoreTotal.anomalies,
+      EnergyScoreTotal.sum_efficiency,
+      EnergyScoreTotal.n_efficiency,
+    ).where(EnergyScoreTotal.model_version == version),
+  ).first()
+
+
+def _add_totals(conn, version: str, scored: int, anomalies: int, sum_efficiency: float, n_efficiency: int) -> None:
+  conn.execute(
+    text(_ADD_TOTALS),
+    {
+      'version': version,
+      'scored': int(scored),
+      'anomalies': int(anomalies),
+      'sum_efficiency': float(sum_efficiency),
+      'n_efficiency': int(n_efficiency),
+    },
+  )
+
+
+def _last_scored_id(conn, version: str) -> int:
+  last = conn.execute(
+    text('SELECT MAX(record_id) FROM energy_scores WHERE model_version = :version'),
+    {'version': version},
+  ).scalar()
+  return int(last or 0)
+
+
+@span('ml.score_records')
+def score_pending_records(batch_size: int = SCORE_BATCH_SIZE) -> int:
+  """Score every record that has no score under the current model version.
+
+  Records are processed in id order, `batch_size` rows per vectorized model call and
+  per transaction, so the work after an ingest is proportional to the new rows only.
+  Returns the number of records scored; 0 when models are not available yet.
+  """
+  with _score_lock:
+    return _score_pending_records(batch_size)
+
+
+def queue_score_pending_records() -> bool:
+  """Run `score_pending_records` on the ML executor unless a pass is already waiting there."""
+  global _score_queued
+  with _score_queue_lock:
+    if _score_queued:
+      return False
+    _score_queued = True
+  submit_to_ml_executor(_run_queued_scoring)
+  return True
+
+
+def _run_queued_scoring() -> None:
+  global _score_queued
+  with _score_queue_lock:
+    _score_queued = False
+  score_pending_records()
+
+
+def _score_pending_records(batch_size: int) -> int:
+  try:
+    anomaly_bundle, eff_bundle = _scoring_bundles()
+  except Exception as exc:  # noqa: BLE001
+    logger.info('Skipping record scoring (models unavailable): %s', exc)
+    return 0
+
+  version = score_model_version(anomaly_bundle, eff_bundle)
+  columns = _feature_columns(anomaly_bundle, eff_bundle)
+  table = EnergyScore.__table__
+
+  # Missing readings are filled with dataset medians before falling back to bundle means.
+  medians = {c: v for c, v in feature_medians().items() if c in columns}
+
+  with engine.begin() as conn:
+    if _read_totals(conn, version) is None:
+      # Scores written before the totals table existed are summed once.
+      sums = conn.execute(
+        text(f'SELECT {_TOTALS_COLUMNS} FROM energy_scores WHERE model_version = :version'),
+        {'version': version},
+      ).one()
+      _add_totals(conn, version, *sums)
+
+  scored = 0
+  while True:
+    with engine.begin() as conn:
+      last_id = _last_scored_id(conn, version)
+      df = read_record_frame(['id'] + columns, after_id=last_id, limit=batch_size, conn=conn)
+      if df.empty:
+        break
+
+      if medians:
+        df = df.fillna(medians)
+      n = len(df)
+      if anomaly_bundle['feature_order']:
+        decision = anomaly_bundle['model'].decision_function(_build_feature_matrix(anomaly_bundle, df))
+        decision = np.asarray(decision, dtype=float)
+      else:
+        decision = np.zeros(n, dtype=float)
+
+      if eff_bundle['feature_order']:
+        efficiency = eff_bundle['model'].predict(_build_feature_matrix(eff_bundle, df))
+        efficiency = np.clip(np.asarray(efficiency, dtype=float), 0.0, 1.0)
+      else:
+        efficiency = np.zeros(n, dtype=float)
+
+      rows = [
+        {
+          'model_version': version,
+          'record_id': int(record_id),
+          # IsolationForest labels a sample anomalous when its decision value is negative.
+          'is_anomaly': bool(score < 0),
+          'anomaly_score': float(score),
+          'efficiency': float(eff),
+        }
+        for record_id, score, eff in zip(df['id'].to_numpy(), decision, efficiency)
+      ]
+      conn.execute(table.insert(), rows)
+      finite = np.isfinite(efficiency)
+      _add_totals(
+        conn,
+        version,
+        n,
+        int(np.count_nonzero(decision < 0)),
+        float(efficiency[finite].sum()),
+        int(np.count_nonzero(finite)),
+      )
+      scored += n
+
+    if n < batch_size:
+      break
+
+  if scored:
+    peak = peak_rss_bytes()
+    logger.info(
+      'Scored %d energy records under model version %s (peak RSS %s MB).',
+      scored,
+      version,
+      round(peak / 2**20) if peak is not None else 'n/a',
+    )
+    prune_stale_scores(version)
+  return scored
+
+
+def prune_stale_scores(version: str) -> int:
+  """Delete scores of other model versions once `version` has scored every record."""
+  # Two range conditions instead of `!=` so SQLite can seek on the primary key.
+  other_versions = 'model_version < :version OR model_version > :version'
+  with engine.begin() as conn:
+    max_id = conn.execute(text('SELECT COALESCE(MAX(id), 0) FROM energy_records')).scalar()
+    if _last_scored_id(conn, version) < int(max_id):
+      return 0
+    removed = conn.execute(
+      text(f'DELETE FROM energy_scores WHERE {other_versions}'),
+      {'version': version},
+    ).rowcount
+    conn.execute(
+      text(f'DELETE FROM energy_score_totals WHERE {other_versions}'),
+      {'version': version},
+    )
+  if removed:
+    logger.info('Pruned %d scores from previous model versions.', removed)
+  return removed
+
+
+def served_score_version(version: str) -> Tuple[str, bool]:
+  """Score version whose totals to serve while `version` is the current one.
+
+  That is `version` once it has scored every record, and until then whichever version
+  has scored furthest (normally the previous model, kept until `version` completes).
+  The flag says whether `version` is complete.
+  """
+  with engine.connect() as conn:
+    _, max_id = records_watermark(conn)
+    if _last_scored_id(conn, version) >= max_id:
+      return version, True
+    versions = conn.execute(select(EnergyScoreTotal.model_version)).scalars().all()
+    served = max(versions, key=lambda v: _last_scored_id(conn, v), default=version)
+  return served, False
+
+
+def aggregate_scores(version: str, limit: Optional[int] = None) -> Dict:
+  """Anomaly count and mean efficiency for one model version.
+
+  Read from the running totals; only a `limit` (the first N records) scans
+  energy_scores, and then just those N rows.
+  """
+  with engine.connect() as conn:
+    totals = None if limit else _read_totals(conn, version)
+    if totals is None:
+      source = 'energy_scores WHERE model_version = :version'
+      params: Dict = {'version': version}
+      if limit:
+        source = f'(SELECT is_anomaly, efficiency FROM {source} ORDER BY record_id LIMIT :limit)'
+        params['limit'] = int(limit)
+      totals = conn.execute(
+        text(f'SELECT {_TOTALS_COLUMNS} FROM {source}'),
+        params,
+      ).one()
+
+  _, anomalies, sum_efficiency, n_efficiency = totals
+  return {
+    'anomaly_count': int(anomalies or 0),
+    'average_efficiency_ml': float(sum_efficiency or 0.0) / n_efficiency if n_efficiency else 0.0,
+  }
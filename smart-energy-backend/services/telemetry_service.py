@@ -0,0 +1,235 @@
+"""Micro-batched ingestion of live meter readings.
+
+Requests only append readings to a bounded in-memory buffer; a background thread
+flushes it to energy_records once TELEMETRY_BATCH_SIZE readings are waiting or the
+oldest one has waited TELEMETRY_FLUSH_MS, so SQLite sees one transaction per batch
+instead of one per reading. A full buffer rejects new readings (the route answers 429)
+rather than growing without bound. Readings still buffered when the process dies are
+lost; gateways should resend what was not acknowledged with a 202.
+
+Each flush also folds the new rows into the rollups and the online anomaly baselines,
+both incremental. Model scoring, the feature stats and the Parquet mirror can take far
+longer (a retrain rescores the whole history), so they are queued on the ML executor
+instead of holding up the flusher; the dashboard caches are keyed on the records
+watermark and pick the rows up on their next read. A batch whose insert keeps failing
+is dropped after TELEMETRY_MAX_RETRIES attempts.
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+import pandas as pd
+
+from database.csv_to_db import coerce_record_frame, insert_record_frame
+from database.db import engine
+from database.parquet_mirror import PARQUET_SYNC_ROWS, sync_parquet_mirror
+from ml.feature_stats import refresh_feature_stats
+from services.anomaly_service import refresh_online_anomalies
+from services.executor import submit_to_ml_executor
+from services.rollup_service import refresh_machine_rollups
+from services.scoring_service import score_pending_records
+
+logger = logging.getLogger(__name__)
+
+TELEMETRY_QUEUE_SIZE = int(os.getenv('TELEMETRY_QUEUE_SIZE', '100000'))
+TELEMETRY_BATCH_SIZE = int(os.getenv('TELEMETRY_BATCH_SIZE', '5000'))
+TELEMETRY_FLUSH_MS = float(os.getenv('TELEMETRY_FLUSH_MS', '250'))
+# The feature-stats store only feeds fill values and training, so it is refreshed
+# every this many flushed readings rather than on every flush.
+TELEMETRY_STATS_EVERY = int(os.getenv('TELEMETRY_STATS_EVERY', '50000'))
+# Flush attempts per batch before its readings are dropped (and logged as an error).
+TELEMETRY_MAX_RETRIES = int(os.getenv('TELEMETRY_MAX_RETRIES', '5'))
+
+
+class QueueFull(Exception):
+  """The buffer has no room for the readings; retry after `retry_after` seconds."""
+
+  def __init__(self, pending: int, capacity: int, retry_after: float) -> None:
+    super().__init__(f'Telemetry queue is full ({pending}/{capacity} readings pending).')
+    self.retry_after = retry_after
+
+
+class TelemetryBuffer:
+  """Bounded reading buffer drained by a flusher thread in size- or time-triggered batches."""
+
+  def __init__(
+    self,
+    capacity: int = TELEMETRY_QUEUE_SIZE,
+    batch_size: int = TELEMETRY_BATCH_SIZE,
+    flush_ms: float = TELEMETRY_FLUSH_MS,
+    max_retries: int = TELEMETRY_MAX_RETRIES,
+  ) -> None:
+    self.capacity = capacity
+    self.batch_size = batch_size
+    self.flush_seconds = flush_ms / 1000.0
+    self.max_retries = max(1, max_retries)
+    self._cond = threading.Condition()
+    self._pending: Deque[Dict] = deque()
+    self._oldest: Optional[float] = None
+    self._thread: Optional[threading.Thread] = None
+    self._stopping = False
+    self._since_stats = 0
+    # Background catch-up: at most one job queued or running; more flushes set the flag again.
+    self._catch_up_requested = False
+    self._catch_up_running = False
+    self._stats = {
+      'accepted': 0,
+      'rejected': 0,
+      'flushes': 0,
+      'flushed': 0,
+      'inserted': 0,
+      'duplicates': 0,
+      'failed_flushes': 0,
+      'dropped': 0,
+      'last_flush_seconds': None,
+      'last_flush_at': None,
+      'last_error': None,
+    }
+
+  def put(self, readings: List[Dict]) -> int:
+    """Buffer `readings` as a whole or not at all; returns the number now pending."""
+    with self._cond:
+      if len(readings) > self.capacity - len(self._pending):
+        self._stats['rejected'] += len(readings)
+        raise QueueFull(len(self._pending), self.capacity, retry_after=max(self.flush_seconds, 1.0))
+      if not self._pending:
+        self._oldest = time.monotonic()
+      self._pending.extend(readings)
+      self._stats['accepted'] += len(readings)
+      if self._thread is None and not self._stopping:
+        self._thread = threading.Thread(target=self._run, name='telemetry-flush', daemon=True)
+        self._thread.start()
+      self._cond.notify()
+      return len(self._pending)
+
+  def _take_batch(self) -> Optional[List[Dict]]:
+    """Wait until a batch is due and pop it; None once stopping with nothing left."""
+    with self._cond:
+      while True:
+        if len(self._pending) >= self.batch_size or (self._stopping and self._pending):
+          break
+        if self._stopping:
+          return None
+        if self._pending:
+          remaining = self._oldest + self.flush_seconds - time.monotonic()
+          if remaining <= 0:
+            break
+          self._cond.wait(remaining)
+        else:
+          self._cond.wait()
+      batch = [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+      self._oldest = time.monotonic() if self._pending else None
+      return batch
+
+  def _run(self) -> None:
+    while True:
+      batch = self._take_batch()
+      if batch is None:
+        return
+      for attempt in range(1, self.max_retries + 1):
+        try:
+          self._flush(batch)
+          break
+        except Exception as exc:  # noqa: BLE001
+          logger.warning('Telemetry flush of %d readings failed (attempt %d): %s', len(batch), attempt, exc)
+          with self._cond:
+            self._stats['failed_flushes'] += 1
+            self._stats['last_error'] = str(exc)
+          # Retried here, so new readings wait (and the route answers 429 once the buffer fills).
+          time.sleep(self.flush_seconds)
+      else:
+        logger.error('Dropping %d telemetry readings after %d failed flushes.', len(batch), self.max_retries)
+        with self._cond:
+          self._stats['dropped'] += len(batch)
+
+  def _flush(self, batch: List[Dict]) -> None:
+    started = time.perf_counter()
+    frame = coerce_record_frame(pd.DataFrame.from_records(batch))
+    with engine.begin() as conn:
+      inserted = insert_record_frame(conn, frame)
+
+    if inserted:
+      refresh_machine_rollups()
+      refresh_online_anomalies()
+      self._request_catch_up(inserted)
+
+    elapsed = time.perf_counter() - started
+    with self._cond:
+      self._stats['flushes'] += 1
+      self._stats['flushed'] += len(batch)
+      self._stats['inserted'] += inserted
+      self._stats['duplicates'] += len(batch) - inserted
+      self._stats['last_flush_seconds'] = round(elapsed, 4)
+      self._stats['last_flush_at'] = time.time()
+    logger.debug('Flushed %d readings (%d new) in %.3fs.', len(batch), inserted, elapsed)
+
+  def _request_catch_up(self, inserted: int) -> None:
+    """Queue scoring, feature stats and the mirror sync for the rows just inserted."""
+    with self._cond:
+      self._since_stats += inserted
+      self._catch_up_requested = True
+      if self._catch_up_running:
+        return
+      self._catch_up_running = True
+    try:
+      submit_to_ml_executor(self._catch_up)
+    except RuntimeError:  # the ML executor is already shut down
+      with self._cond:
+        self._catch_up_running = False
+
+  def _catch_up(self) -> None:
+    while True:
+      with self._cond:
+        if not self._catch_up_requested:
+          self._catch_up_running = False
+          return
+        self._catch_up_requested = False
+        refresh_stats = self._since_stats >= TELEMETRY_STATS_EVERY
+        if refresh_stats:
+          self._since_stats = 0
+      try:
+        if refresh_stats:
+          refresh_feature_stats()
+        score_pending_records()
+        sync_parquet_mirror(min_rows=PARQUET_SYNC_ROWS)
+      except Exception:  # noqa: BLE001
+        # The next flush queues another pass; scoring and the mirror resume from their watermarks.
+        logger.exception('Telemetry catch-up after flush failed.')
+
+  def status(self) -> Dict:
+    with self._cond:
+      return {
+        'pending': len(self._pending),
+        'capacity': self.capacity,
+        'batch_size': self.batch_size,
+        'flush_ms': self.flush_seconds * 1000.0,
+        **self._stats,
+      }
+
+  def close(self, timeout: float = 10.0) -> None:
+    """Flush what is still buffered and stop the flusher thread."""
+    with self._cond:
+      self._stopping = True
+      self._cond.notify()
+      thread = self._thread
+    if thread is not None:
+      thread.join(timeout)
+
+
+_buffer = TelemetryBuffer()
+
+
+def enqueue_readings(readings: List[Dict]) -> int:
+  """Buffer readings for the next flush; raises QueueFull when there is no room."""
+  return _buffer.put(readings)
+
+
+def telemetry_status() -> Dict:
+  return _buffer.status()
+
+
+def shutdown_telemetry() -> None:
+  _buffer.close()
@@ -0,0 +1,162 @@
+"""Background model training on a process pool.
+
+Training runs in a spawned worker process, so neither the GIL nor the event loop is
+held while IsolationForest / RandomForest fit. The worker reports progress through a
+queue that a listener thread folds into the job records served by /api/models/jobs.
+When a job publishes a new registry version, this process swaps it in and scores the
+records under it; other workers pick it up through registry polling.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional
+
+from ml.predict import current_models
+from ml.train_models import train_and_publish
+from services.scoring_service import score_pending_records
+
+logger = logging.getLogger(__name__)
+
+TRAINING_MAX_WORKERS = int(os.getenv('TRAINING_MAX_WORKERS', '1'))
+_JOB_HISTORY = 20
+
+_lock = threading.Lock()
+_jobs: Dict[str, Dict] = {}
+_pool: Optional[ProcessPoolExecutor] = None
+_progress_queue = None
+_listener: Optional[threading.Thread] = None
+
+# Set inside worker processes by `_init_worker`.
+_worker_queue = None
+
+
+def _init_worker(queue) -> None:
+  global _worker_queue
+  _worker_queue = queue
+
+
+def _train_in_worker(job_id: str) -> str:
+  def progress(stage: str, fraction: float) -> None:
+    _worker_queue.put((job_id, stage, fraction))
+
+  return train_and_publish(progress)
+
+
+def _listen(queue) -> None:
+  while True:
+    message = queue.get()
+    if message is None:
+      return
+    job_id, stage, fraction = message
+    with _lock:
+      job = _jobs.get(job_id)
+      if job is not None and job['status'] in ('queued', 'running'):
+        job.update(status='running', stage=stage, progress=round(fraction, 3))
+        job.setdefault('started_at', time.time())
+
+
+def _get_pool() -> ProcessPoolExecutor:
+  global _pool, _progress_queue, _listener
+  if _pool is None:
+    # spawn: forking a process that holds DB connections and threads is unsafe.
+    context = multiprocessing.get_context('spawn')
+    _progress_queue = context.Queue()
+    _pool = ProcessPoolExecutor(
+      max_workers=TRAINING_MAX_WORKERS,
+      mp_context=context,
+      initializer=_init_worker,
+      initargs=(_progress_queue,),
+    )
+    _listener = threading.Thread(target=_listen, args=(_progress_queue,), name='training-progress', daemon=True)
+    _listener.start()
+  return _pool
+
+
+def _discard_pool() -> None:
+  global _pool
+  if _pool is not None:
+    _pool.shutdown(wait=False, cancel_futures=True)
+    _pool = None
+
+
+def _activate(job_id: str, version: str) -> None:
+  """Swap the new version in and score records under it, off the request path."""
+  try:
+    current_models(force=True)
+    scored = score_pending_records()
+    logger.info('Training job %s: version %s active, %d records scored.', job_id, version, scored)
+  except Exception as exc:  # noqa: BLE001
+    logger.warning('Activating model version %s failed: %s', version, exc)
+
+
+def _on_done(job_id: str, future: Future) -> None:
+  with _lock:
+    job = _jobs[job_id]
+    job['finished_at'] = time.time()
+    if future.cancelled():
+      job.update(status='cancelled')
+      return
+    exc = future.exception()
+    if exc is not None:
+      logger.warning('Training job %s failed: %s', job_id, exc)
+      job.update(status='failed', error=str(exc))
+      if isinstance(exc, BrokenProcessPool):
+        # A worker died (e.g. OOM-killed); start a fresh pool for the next job.
+        _discard_pool()
+      return
+    job.update(status='succeeded', stage='published', progress=1.0, version=future.result())
+  threading.Thread(target=_activate, args=(job_id, job['version']), daemon=True).start()
+
+
+def start_training_job() -> Dict:
+  """Queue a training run, or return the one already queued or running."""
+  with _lock:
+    for job in _jobs.values():
+      if job['status'] in ('queued', 'running'):
+        return {**job, 'already_running': True}
+
+    job_id = uuid.uuid4().hex
+    job = {
+      'job_id': job_id,
+      'status': 'queued',
+      'stage': None,
+      'progress': 0.0,
+      'version': None,
+      'error': None,
+      'created_at': time.time(),
+    }
+    _jobs[job_id] = job
+    finished = [j['job_id'] for j in _jobs.values() if j['status'] not in ('queued', 'running')]
+    for old_id in finished[: max(0, len(finished) - _JOB_HISTORY)]:
+      del _jobs[old_id]
+
+  future = _get_pool().submit(_train_in_worker, job_id)
+  future.add_done_callback(lambda f: _on_done(job_id, f))
+  return {**job, 'already_running': False}
+
+
+def get_training_job(job_id: str) -> Optional[Dict]:
+  with _lock:
+    job = _jobs.get(job_id)
+    return dict(job) if job is not None else None
+
+
+def list_training_jobs() -> List[Dict]:
+  with _lock:
+    return [dict(job) for job in sorted(_jobs.values(), key=lambda j: j['created_at'], reverse=True)]
+
+
+def training_in_progress() -> bool:
+  with _lock:
+    return any(job['status'] in ('queued', 'running') for job in _jobs.values())
+
+
+def shutdown_training_pool() -> None:
+  _discard_pool()
+  if _progress_queue is not None:
+    _progress_queue.put(None)
@@ -0,0 +1,81 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from database.db import get_async_db
+from routes import analysis
+from services import ml_service
+
+
+class _Result:
+  def __init__(self, rows):
+    self._rows = rows
+
+  def all(self):
+    return self._rows
+
+  def first(self):
+    return self._rows[0] if self._rows else None
+
+
+class _RollupSession:
+  """Answers the grouped rollup query with one averages row per machine."""
+
+  def __init__(self, machines):
+    self.rows = [(m, 10.0, 50.0, 40.0, 0.0, 0.9, 10.0, 8.0, 0.1) for m in machines]
+
+  async def execute(self, stmt):
+    return _Result(self.rows)
+
+  async def commit(self):
+    pass
+
+
+@pytest.fixture
+def client(monkeypatch):
+  evaluated = []
+
+  async def rollups_current(db):
+    return None
+
+  def fake_grid(averages, scenarios):
+    evaluated.append(len(averages) * len(scenarios))
+    return {'machines': [{'machine_id': m} for m in averages], 'cells': [], 'model_version': None}
+
+  async def sessions():
+    yield _RollupSession([f'MCH-{i:03d}' for i in range(5)])
+
+  monkeypatch.setattr(ml_service, 'ensure_rollups_current_async', rollups_current)
+  monkeypatch.setattr(ml_service, 'analyze_grid', fake_grid)
+  monkeypatch.setattr(analysis, 'MAX_BATCH_CELLS', 8)
+  app = FastAPI()
+  app.include_router(analysis.router)
+  app.dependency_overrides[get_async_db] = sessions
+  test_client = TestClient(app)
+  test_client.evaluated = evaluated
+  return test_client
+
+
+def test_all_machines_are_counted_against_the_cell_limit(client):
+  # 5 machines in the rollups x 2 scenarios > 8, though no machine_ids were sent.
+  response = client.post('/api/analyze/batch', json={'on_time_hours': [8, 12], 'off_time_hours': [4]})
+
+  assert response.status_code == 413
+  assert client.evaluated == []
+
+
+def test_all_machines_within_the_limit_are_analyzed(client):
+  response = client.post('/api/analyze/batch', json={'scenarios': [{'on_time_hours': 8, 'off_time_hours': 4}]})
+
+  assert response.status_code == 200
+  assert client.evaluated == [5]
+
+
+def test_explicit_machine_ids_are_checked_before_querying(client):
+  response = client.post(
+    '/api/analyze/batch',
+    json={'machine_ids': [f'M{i}' for i in range(9)], 'scenarios': [{'on_time_hours': 1, 'off_time_hours': 1}]},
+  )
+
+  assert response.status_code == 413
+  assert client.evaluated == []
@@ -0,0 +1,32 @@
+import os
+
+from sqlalchemy import create_engine, inspect, text
+
+from database.dataset_loader import load_dataset
+from database.watermark import RECORDS_COUNTER
+
+BUNDLED_DATASET = os.path.join(
+  os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'dataset', 'energy_dataset.csv',
+)
+
+
+def test_load_dataset_honours_env_path_and_sets_up_schema(tmp_path, monkeypatch):
+  with open(BUNDLED_DATASET, encoding='utf-8') as fh:
+    head = [next(fh) for _ in range(6)]
+  csv_path = tmp_path / 'small.csv'
+  csv_path.write_text(''.join(head), encoding='utf-8')
+  monkeypatch.setenv('ENERGY_DATASET_PATH', str(csv_path))
+  engine = create_engine(f"sqlite:///{tmp_path / 'loader.db'}")
+
+  assert load_dataset(bind=engine) == 5
+  indexes = {ix['name'] for ix in inspect(engine).get_indexes('energy_records')}
+  assert 'ux_energy_records_reading' in indexes
+  with engine.connect() as conn:
+    counted = conn.execute(
+      text('SELECT rows FROM rollup_watermarks WHERE name = :name'), {'name': RECORDS_COUNTER},
+    ).scalar()
+  assert counted == 5
+
+  # The dedup index turns a second load into a no-op.
+  assert load_dataset(bind=engine) == 0
+  engine.dispose()
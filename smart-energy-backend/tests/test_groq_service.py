@@ -0,0 +1,120 @@
+import asyncio
+
+import pytest
+
+from services import groq_service
+from services.groq_service import (
+  UNAVAILABLE_MESSAGE,
+  _completion_kwargs,
+  cached_recommendation,
+  clear_recommendation_cache,
+  generate_recommendation,
+  generate_recommendation_async,
+  prompt_fingerprint,
+  stream_recommendation_async,
+  use_fake_client,
+)
+
+PREDICTION = {
+  'machine_id': 'MCH-004',
+  'anomaly_status': 'Normal',
+  'efficiency_score': 0.8312,
+  'energy_wasted': 12.34,
+  'predicted_cost': 1263,
+}
+
+
+@pytest.fixture(autouse=True)
+def fake_client(monkeypatch):
+  monkeypatch.delenv('RECOMMENDATION_CACHE_PERSIST', raising=False)
+  use_fake_client(0.0)
+  clear_recommendation_cache()
+  yield
+  use_fake_client(None)
+  clear_recommendation_cache()
+
+
+def _upstream_calls(is_async: bool) -> int:
+  return groq_service._get_client(is_async=is_async).chat.completions.calls
+
+
+async def _collect(prediction):
+  return [piece async for piece in stream_recommendation_async(prediction)]
+
+
+def test_fingerprint_is_stable_and_ignores_key_order():
+  kwargs = _completion_kwargs(PREDICTION)
+  reordered = dict(reversed(list(kwargs.items())))
+  assert prompt_fingerprint(kwargs) == prompt_fingerprint(reordered)
+  assert len(prompt_fingerprint(kwargs)) == 64
+
+
+def test_fingerprint_shares_near_identical_predictions():
+  near = {**PREDICTION, 'efficiency_score': 0.8349, 'energy_wasted': 12.31, 'predicted_cost': 1261}
+  assert prompt_fingerprint(_completion_kwargs(PREDICTION)) == prompt_fingerprint(_completion_kwargs(near))
+
+
+@pytest.mark.parametrize(
+  'change',
+  [{'machine_id': 'MCH-005'}, {'anomaly_status': 'Anomaly'}, {'efficiency_score': 0.62}, {'predicted_cost': 1400}],
+)
+def test_fingerprint_separates_different_prompts(change):
+  other = {**PREDICTION, **change}
+  assert prompt_fingerprint(_completion_kwargs(PREDICTION)) != prompt_fingerprint(_completion_kwargs(other))
+
+
+def test_cache_miss_calls_upstream_once_then_hits():
+  assert cached_recommendation(PREDICTION) is None
+
+  first = generate_recommendation(PREDICTION)
+  second = generate_recommendation({**PREDICTION, 'efficiency_score': 0.834})
+
+  assert first == second
+  assert 'MCH-004' in first
+  assert _upstream_calls(is_async=False) == 1
+  assert cached_recommendation(PREDICTION) == first
+
+
+def test_async_cache_is_shared_with_sync_path():
+  text_value = generate_recommendation(PREDICTION)
+  assert asyncio.run(generate_recommendation_async(PREDICTION)) == text_value
+  assert _upstream_calls(is_async=True) == 0
+
+
+def test_concurrent_async_misses_share_one_upstream_call():
+  use_fake_client(0.05)
+
+  async def burst():
+    return await asyncio.gather(*(generate_recommendation_async(PREDICTION) for _ in range(5)))
+
+  results = asyncio.run(burst())
+  assert len(set(results)) == 1
+  assert _upstream_calls(is_async=True) == 1
+
+
+def test_upstream_failure_is_reported_and_not_cached(monkeypatch):
+  attempts = []
+
+  def fail(**_kwargs):
+    attempts.append(1)
+    raise RuntimeError('upstream down')
+
+  monkeypatch.setattr(groq_service._get_client(is_async=False).chat.completions, 'create', fail)
+  assert generate_recommendation(PREDICTION) == UNAVAILABLE_MESSAGE
+  assert generate_recommendation(PREDICTION) == UNAVAILABLE_MESSAGE
+  assert len(attempts) == 2
+
+
+def test_stream_yields_pieces_and_caches_the_full_text():
+  pieces = asyncio.run(_collect(PREDICTION))
+
+  assert len(pieces) > 1
+  assert cached_recommendation(PREDICTION) == ''.join(pieces).strip()
+  assert _upstream_calls(is_async=True) == 1
+
+
+def test_stream_of_cached_text_is_one_chunk_without_upstream_call():
+  text_value = generate_recommendation(PREDICTION)
+
+  assert asyncio.run(_collect(PREDICTION)) == [text_value]
+  assert _upstream_calls(is_async=True) == 0
@@ -0,0 +1,40 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from routes import ingest
+
+
+@pytest.fixture
+def client(monkeypatch):
+  calls = {'ingested': [], 'queued': []}
+
+  def fake_ingest(path):
+    calls['ingested'].append(path)
+    return {'source': '/data/energy_dataset.csv', 'rows_inserted': 3}
+
+  monkeypatch.setattr(ingest, 'ingest_csv', fake_ingest)
+  monkeypatch.setattr(ingest, 'submit_to_ml_executor', calls['queued'].append)
+  app = FastAPI()
+  app.include_router(ingest.router)
+  test_client = TestClient(app)
+  test_client.calls = calls
+  return test_client
+
+
+@pytest.mark.parametrize('body', [None, {}, {'filename': None}])
+def test_ingest_without_filename_uses_the_default_dataset(client, body):
+  response = client.post('/api/ingest', json=body) if body is not None else client.post('/api/ingest')
+
+  assert response.status_code == 200
+  assert response.json()['source'] == 'energy_dataset.csv'
+  assert response.json()['refresh_queued'] is True
+  assert client.calls['ingested'] == [None]
+  assert client.calls['queued'] == [ingest._refresh_after_ingest]
+
+
+def test_ingest_rejects_files_outside_the_dataset_folder(client):
+  response = client.post('/api/ingest', json={'filename': '../main.py'})
+
+  assert response.status_code == 400
+  assert client.calls['ingested'] == []
@@ -0,0 +1,74 @@
+import pytest
+from sqlalchemy import create_engine, text
+
+from database.csv_to_db import _ensure_record_schema
+from database.db import Base
+from database.models import EnergyScore, EnergyScoreTotal
+from services import ml_service, scoring_service
+from services.cache import WatermarkCache
+
+
+@pytest.fixture
+def scores_db(tmp_path, monkeypatch):
+  engine = create_engine(f"sqlite:///{tmp_path / 'scores.db'}")
+  _ensure_record_schema(engine)
+  Base.metadata.create_all(bind=engine, tables=[EnergyScore.__table__, EnergyScoreTotal.__table__])
+  monkeypatch.setattr(scoring_service, 'engine', engine)
+  yield engine
+  engine.dispose()
+
+
+def _add_scores(conn, version, record_ids, anomalous):
+  for record_id in record_ids:
+    conn.execute(
+      text('INSERT INTO energy_scores (model_version, record_id, is_anomaly, efficiency) VALUES (:v, :id, :a, 50.0)'),
+      {'v': version, 'id': record_id, 'a': record_id in anomalous},
+    )
+  scoring_service._add_totals(conn, version, len(record_ids), len(anomalous), 50.0 * len(record_ids), len(record_ids))
+
+
+def _set_records(conn, rows):
+  conn.execute(
+    text("UPDATE rollup_watermarks SET rows = :rows, last_id = :rows WHERE name = 'energy_records'"),
+    {'rows': rows},
+  )
+
+
+def test_complete_version_is_served_and_cacheable(scores_db):
+  with scores_db.begin() as conn:
+    _set_records(conn, 3)
+    _add_scores(conn, 'new', [1, 2, 3], {2})
+
+  assert scoring_service.served_score_version('new') == ('new', True)
+
+
+def test_lagging_version_serves_previous_totals_and_queues_scoring(scores_db, monkeypatch):
+  queued = []
+  monkeypatch.setattr(ml_service, 'queue_score_pending_records', lambda: queued.append(True))
+  with scores_db.begin() as conn:
+    _set_records(conn, 3)
+    _add_scores(conn, 'old', [1, 2, 3], {1, 3})
+    _add_scores(conn, 'new', [1], set())
+
+  insights, complete = ml_service._compute_ml_insights('new', None)
+
+  assert not complete
+  assert insights == {'anomaly_count': 2, 'average_efficiency_ml': 50.0}
+  assert queued == [True]
+
+
+def test_partial_insights_are_not_cached(scores_db, monkeypatch):
+  monkeypatch.setattr(ml_service, '_insights_cache', WatermarkCache())
+  monkeypatch.setattr(ml_service, 'current_score_version', lambda: 'new')
+  monkeypatch.setattr(ml_service, 'records_watermark', lambda db: (3, 3))
+  monkeypatch.setattr(ml_service, 'queue_score_pending_records', lambda: None)
+  with scores_db.begin() as conn:
+    _set_records(conn, 3)
+    _add_scores(conn, 'old', [1, 2, 3], {1, 2})
+    _add_scores(conn, 'new', [1, 2], set())
+
+  assert ml_service.get_dashboard_ml_insights()['anomaly_count'] == 2
+  # Same watermark, but the background pass has finished: the new totals show up.
+  with scores_db.begin() as conn:
+    _add_scores(conn, 'new', [3], {3})
+  assert ml_service.get_dashboard_ml_insights()['anomaly_count'] == 1
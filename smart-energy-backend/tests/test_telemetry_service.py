@@ -0,0 +1,60 @@
+import pytest
+
+from services import telemetry_service
+from services.telemetry_service import TelemetryBuffer
+
+
+def _reading(i):
+  return {'machine_id': 'MCH-001', 'timestamp': f'2024-01-01 {i:02d}:00:00', 'power_kw': float(i)}
+
+
+def test_failing_batch_is_dropped_after_max_retries():
+  buffer = TelemetryBuffer(capacity=10, batch_size=3, flush_ms=1, max_retries=2)
+  attempts = []
+
+  def failing_flush(batch):
+    attempts.append(len(batch))
+    raise RuntimeError('database is locked')
+
+  buffer._flush = failing_flush
+  buffer.put([_reading(i) for i in range(3)])
+  buffer.close()
+
+  status = buffer.status()
+  assert attempts == [3, 3]
+  assert status['failed_flushes'] == 2
+  assert status['dropped'] == 3
+  assert status['pending'] == 0
+
+
+@pytest.fixture
+def catch_up(monkeypatch):
+  calls = {'submitted': [], 'scored': 0, 'synced': 0}
+
+  def score():
+    calls['scored'] += 1
+
+  def sync(min_rows):
+    calls['synced'] += 1
+
+  monkeypatch.setattr(telemetry_service, 'submit_to_ml_executor', calls['submitted'].append)
+  monkeypatch.setattr(telemetry_service, 'score_pending_records', score)
+  monkeypatch.setattr(telemetry_service, 'sync_parquet_mirror', sync)
+  return calls
+
+
+def test_scoring_is_queued_once_per_pending_catch_up(catch_up):
+  buffer = TelemetryBuffer()
+
+  buffer._request_catch_up(10)
+  buffer._request_catch_up(10)
+  assert len(catch_up['submitted']) == 1
+  assert catch_up['scored'] == 0
+
+  catch_up['submitted'][0]()
+  assert catch_up['scored'] == 1
+  assert catch_up['synced'] == 1
+
+  # Once the job has finished, the next flush queues a new one.
+  buffer._request_catch_up(10)
+  assert len(catch_up['submitted']) == 2
@@ -0,0 +1,43 @@
+from datetime import datetime
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from database.db import get_async_db
+from routes import timeseries
+
+
+@pytest.fixture
+def client(monkeypatch):
+  calls = []
+
+  async def fake_timeseries(db, machine_id, start, end, bucket, shift):
+    calls.append((start, end))
+    return []
+
+  async def no_db():
+    yield None
+
+  monkeypatch.setattr(timeseries, 'get_timeseries_async', fake_timeseries)
+  app = FastAPI()
+  app.include_router(timeseries.router)
+  app.dependency_overrides[get_async_db] = no_db
+  test_client = TestClient(app)
+  test_client.calls = calls
+  return test_client
+
+
+def test_mixed_timezone_bounds_are_compared_in_utc(client):
+  response = client.get('/api/timeseries', params={'from': '2024-01-01T05:00:00+05:30', 'to': '2024-01-01T00:00:00'})
+
+  assert response.status_code == 200
+  assert client.calls == [(datetime(2023, 12, 31, 23, 30), datetime(2024, 1, 1))]
+  assert response.json()['from'] == '2023-12-31T23:30:00'
+
+
+def test_from_after_to_is_rejected(client):
+  response = client.get('/api/timeseries', params={'from': '2024-01-02T00:00:00Z', 'to': '2024-01-01T00:00:00'})
+
+  assert response.status_code == 400
+  assert client.calls == []